@@ -1,7 +1,9 @@
 # app.py
 import streamlit as st
-from config_manager import config_manager
+from backend.metrics import start_metrics_server
+from backend.services import get_services
 from search_settings import render_search_settings
+from ui.usage_ui import render_usage_sidebar
 
 # アプリ全体のタブアイコン＆タイトル（おすすめ）
 st.set_page_config(
@@ -10,9 +12,12 @@ st.set_page_config(
     layout="wide"
 )
 
+# METRICS_PORTが設定されていれば /metrics を別スレッドで公開（プロセスで1回だけ）
+start_metrics_server()
+
 # サイドバーで設定を表示
 render_search_settings()
-config_ready = config_manager.render_sidebar_config()
+config_ready = get_services().config.render_sidebar_config()
 
 # Streamlitアプリのタイトル設定
 st.title("🎀✨ ChatGAL ✨🎀")
@@ -27,3 +32,6 @@ pg = st.navigation([
     evaluation_page
 ], position="sidebar")
 pg.run()
+
+# ページの処理が終わってから表示して、このターンの使用量まで反映する
+render_usage_sidebar(get_services().usage)
@@ -1,23 +1,80 @@
 # backend/chat.py
-from typing import List, Dict, Any, Optional
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.prompts import ChatPromptTemplate
+import os
+import re
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 
-from backend.evaluation import evaluation_service
+from backend.metrics import CHAT_LATENCY, LLM_TOKENS, RATE_LIMITS
+from backend.tracing import record_llm_usage, span, start_trace
+from backend.usage import THROTTLED_CONTEXT_DOCS
 from backend.utils.clean_text_for_llm import clean_text_for_llm
 from config_manager import config_manager
 
+if TYPE_CHECKING:
+    from langchain_core.prompts import ChatPromptTemplate
+
+# 言い換え検索で作る言い換えの数
+MULTI_QUERY_VARIANTS = int(os.environ.get("MULTI_QUERY_VARIANTS", 3))
+
+# 言い換えの行頭の番号や箇条書きの記号
+_VARIANT_PREFIX = re.compile(r"^\s*(?:[-*・●]|\d+[.)．）、:])\s*")
+
 class ChatService:
-    def __init__(self, document_processor=None):
+    def __init__(self, document_processor=None, config=None, evaluation_service=None, usage=None, capture_evaluations: bool = True):
         self.document_processor = document_processor
+        self.config = config or config_manager
+        self._evaluation_service = evaluation_service
+        # チャットごとに評価データを保存するか（CLIで保存しないとき用）
+        self.capture_evaluations = capture_evaluations
+        # このセッションのトークン使用量（UsageLedger。Noneなら記録も予算チェックもしない）
+        self.usage = usage
         
     def get_llm(self):
         """LLMインスタンスを取得"""
-        return config_manager.get_llm()
+        return self.config.get_llm()
     
-    def format_messages_to_prompt(self, messages: List[Dict[str, str]]) -> ChatPromptTemplate:
+    @property
+    def evaluation_service(self):
+        """評価データの収集先（ragas・pandasを読み込まないEvaluationCaptureなので、最初のチャットも重くならない）"""
+        if self._evaluation_service is None:
+            from backend.evaluation_capture import EvaluationCapture
+            self._evaluation_service = EvaluationCapture(self.config, usage=self.usage)
+        return self._evaluation_service
+    
+    def generate_query_variants(self, query: str, n: int = MULTI_QUERY_VARIANTS) -> List[str]:
+        """検索用に質問の言い換えをLLM1回で作る（失敗したら空で、元の質問だけで検索する）"""
+        prompt_text = f"""次の質問を、資料の検索に使うために同じ意味のまま言葉や言い回しを変えて{n}個言い換えてください。
+短い質問やあいまいな質問は、省略されていそうな言葉を補ってください。
+1行に1つずつ、番号や説明はつけずに出力してください。
+
+質問: {query}"""
+        try:
+            with span("multi_query", variants=n) as record:
+                response = self.get_llm().invoke(prompt_text)
+                record_llm_usage(record, response)
+            usage_metadata = getattr(response, 'usage_metadata', None) or {}
+            if usage_metadata.get("input_tokens"):
+                LLM_TOKENS.inc(usage_metadata["input_tokens"], type="prompt")
+            if usage_metadata.get("output_tokens"):
+                LLM_TOKENS.inc(usage_metadata["output_tokens"], type="completion")
+            content = str(getattr(response, 'content', response))
+            if self.usage is not None:
+                self.usage.record_llm_usage("chat", usage_metadata, prompt_text, content)
+        except Exception as e:
+            print(f"❌ Query variants error: {str(e)}")
+            return []
+        
+        variants = []
+        for line in content.splitlines():
+            variant = _VARIANT_PREFIX.sub("", line).strip()
+            if variant and variant != query and variant not in variants:
+                variants.append(variant)
+        return variants[:n]
+    
+    def format_messages_to_prompt(self, messages: List[Dict[str, str]]) -> "ChatPromptTemplate":
         """メッセージリストをChatPromptTemplateに変換"""
+        # langchain_coreのプロンプト周りは重いので、最初のチャットまで読み込まない
+        from langchain_core.prompts import ChatPromptTemplate
+        
         prompts = []
         for message in messages:
             if message["role"] in ("system", "user"):
@@ -29,6 +86,9 @@ class ChatService:
     
     def create_rag_chain(self, retriever):
         """RAGチェーンを作成"""
+        from langchain_core.output_parsers import StrOutputParser
+        from langchain_core.runnables import RunnablePassthrough
+        
         def format_docs(docs):
             return "\n\n".join(doc.page_content for doc in docs)
         
@@ -44,8 +104,24 @@ class ChatService:
         
         return rag_chain
     
-    def chat_with_rag(self, messages: List[Dict[str, str]], query: str) -> Dict[str, Any]:
-        """RAGを使用してチャット応答を生成"""
+    def chat_with_rag(self, messages: List[Dict[str, str]], query: str, source_files: Optional[List[str]] = None, multi_query: bool = False) -> Dict[str, Any]:
+        """RAGを使用してチャット応答を生成（処理ごとの時間とトークン数をトレースに記録）
+
+        source_files を渡すとそのファイルの中だけから文脈を探す
+        multi_query なら質問の言い換えも一緒に検索する
+        """
+        with start_trace("chat_with_rag") as trace:
+            result = self._chat_with_rag(messages, query, source_files, multi_query)
+            trace.set(success=result["success"])
+        result["trace"] = trace
+        self._record_metrics("rag", result)
+        return result
+    
+    def _chat_with_rag(self, messages: List[Dict[str, str]], query: str, source_files: Optional[List[str]] = None, multi_query: bool = False) -> Dict[str, Any]:
+        budget_error = self._budget_error()
+        if budget_error:
+            return budget_error
+        
         try:
             if not self.document_processor or self.document_processor.get_stats()['total_files'] == 0:
                 return {
@@ -55,16 +131,30 @@ class ChatService:
                     "context_docs": []
                 }
             
+            # 言い換え検索なら、先に質問の言い換えを作る（節約モードのときはLLM呼び出しを増やさない）
+            variants = None
+            if multi_query and not (self.usage is not None and self.usage.status("chat") == "throttled"):
+                variants = self.generate_query_variants(query)
+            
             # 関連文書を検索
-            context_docs = self.document_processor.search_documents(query)
+            with span("search") as record:
+                context_docs, query_vector, context_vectors = self.document_processor.search_documents_with_vectors(query, source_files, variants)
+                if record is not None:
+                    record.set(docs=len(context_docs))
+            
+            # 予算の残りが少ないときは文脈を減らしてプロンプトを小さくする
+            if self.usage is not None and self.usage.status("chat") == "throttled" and len(context_docs) > THROTTLED_CONTEXT_DOCS:
+                context_docs = context_docs[:THROTTLED_CONTEXT_DOCS]
+                context_vectors = context_vectors[:THROTTLED_CONTEXT_DOCS] if context_vectors is not None else None
 
             # 文脈をクリーンアップ
-            cleaned_contexts = []
-            for doc in context_docs:
-                cleaned_content = clean_text_for_llm(doc.page_content)
-                cleaned_contexts.append(cleaned_content)
-            
-            context = "\n\n".join(cleaned_contexts)
+            with span("clean_context"):
+                cleaned_contexts = []
+                for doc in context_docs:
+                    cleaned_content = clean_text_for_llm(doc.page_content)
+                    cleaned_contexts.append(cleaned_content)
+                
+                context = "\n\n".join(cleaned_contexts)
             
             # システムプロンプトを作成
             system_message = f"""あなたは質問応答のアシスタントで、質問に対して日本のギャルのように簡単な言葉を使って説明します。絵文字もたくさん使ってください。「ギャル風に答えるね」といった前置きは不要です。いきなりギャルの言葉遣いで回答してください。
@@ -81,30 +171,43 @@ class ChatService:
             chat_messages.extend([msg for msg in messages if msg["role"] != "system"])
             
             # プロンプトを作成
-            prompt = self.format_messages_to_prompt(chat_messages)
+            with span("build_prompt"):
+                prompt = self.format_messages_to_prompt(chat_messages)
+                prompt_messages = prompt.format_messages()
             
             # LLMで応答生成
             llm = self.get_llm()
-            response = llm.invoke(prompt.format_messages())
+            with span("llm") as record:
+                response = llm.invoke(prompt_messages)
+                record_llm_usage(record, response)
+            if self.usage is not None:
+                self.usage.record_llm_usage(
+                    "chat", getattr(response, 'usage_metadata', None),
+                    "".join(str(message.content) for message in prompt_messages), str(getattr(response, 'content', response))
+                )
             ai_response = response.content if hasattr(response, 'content') else str(response)
             
-            # 評価用データを自動収集
-            contexts = [doc.page_content for doc in context_docs]
+            # 評価用データを自動収集（文脈はチャンクIDで参照する）
             source_files = list(set([doc.metadata.get('source_file', '不明') for doc in context_docs]))
             
-            evaluation_service.add_chat_for_evaluation(
-                question=query,
-                answer=ai_response,
-                contexts=contexts,
-                source_files=source_files
-            )
+            if self.capture_evaluations:
+                with span("evaluation_capture"):
+                    self.evaluation_service.add_chat_for_evaluation(
+                        question=query,
+                        answer=ai_response,
+                        context_docs=context_docs,
+                        source_files=source_files,
+                        query_vector=query_vector,
+                        context_vectors=context_vectors
+                    )
             
             return {
                 "success": True,
                 "message": "応答を正常に生成しました",
                 "response": response.content if hasattr(response, 'content') else str(response),
                 "context_docs": context_docs,
-                "context": context
+                "context": context,
+                "usage": getattr(response, 'usage_metadata', None) or {}
             }
             
         except Exception as e:
@@ -116,7 +219,41 @@ class ChatService:
             }
     
     def chat_without_rag(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
-        """RAGを使用せずにチャット応答を生成"""
+        """RAGを使用せずにチャット応答を生成（処理ごとの時間とトークン数をトレースに記録）"""
+        with start_trace("chat_without_rag") as trace:
+            result = self._chat_without_rag(messages)
+            trace.set(success=result["success"])
+        result["trace"] = trace
+        self._record_metrics("plain", result)
+        return result
+    
+    def _budget_error(self) -> Optional[Dict[str, Any]]:
+        """チャットの予算を使い切っていればエラーの結果を返す"""
+        if self.usage is None or self.usage.status("chat") != "exceeded":
+            return None
+        return {
+            "success": False,
+            "message": "このセッションのトークン予算を使い切っちゃった💸 新しいセッションで話しかけてね",
+            "response": None,
+            "context_docs": []
+        }
+    
+    def _record_metrics(self, mode: str, result: Dict[str, Any]):
+        """1ターンのレイテンシ・トークン数・429をメトリクスに記録"""
+        CHAT_LATENCY.observe(result["trace"].duration_ms / 1000, mode=mode, status="success" if result["success"] else "error")
+        usage = result.get("usage") or {}
+        if usage.get("input_tokens"):
+            LLM_TOKENS.inc(usage["input_tokens"], type="prompt")
+        if usage.get("output_tokens"):
+            LLM_TOKENS.inc(usage["output_tokens"], type="completion")
+        if not result["success"] and "429" in result["message"]:
+            RATE_LIMITS.inc(operation="chat")
+    
+    def _chat_without_rag(self, messages: List[Dict[str, str]]) -> Dict[str, Any]:
+        budget_error = self._budget_error()
+        if budget_error:
+            return budget_error
+        
         try:
             # システムプロンプトを作成
             system_message = f"あなたは質問応答のアシスタントで、質問に対して日本のギャルのように簡単な言葉を使って説明します。絵文字もたくさん使ってください。「ギャル風に答えるね」といった前置きは不要です。いきなりギャルの言葉遣いで回答してください。"
@@ -127,18 +264,28 @@ class ChatService:
             chat_messages.extend([msg for msg in messages if msg["role"] != "system"])
             
             # プロンプトを作成
-            prompt = self.format_messages_to_prompt(chat_messages)
+            with span("build_prompt"):
+                prompt = self.format_messages_to_prompt(chat_messages)
+                prompt_messages = prompt.format_messages()
             
             # LLMで応答生成
             llm = self.get_llm()
-            response = llm.invoke(prompt.format_messages())
+            with span("llm") as record:
+                response = llm.invoke(prompt_messages)
+                record_llm_usage(record, response)
+            if self.usage is not None:
+                self.usage.record_llm_usage(
+                    "chat", getattr(response, 'usage_metadata', None),
+                    "".join(str(message.content) for message in prompt_messages), str(getattr(response, 'content', response))
+                )
             
             return {
                 "success": True,
                 "message": "応答を正常に生成しました",
                 "response": response.content if hasattr(response, 'content') else str(response),
                 "context_docs": [],
-                "context": ""
+                "context": "",
+                "usage": getattr(response, 'usage_metadata', None) or {}
             }
             
         except Exception as e:
@@ -149,9 +296,9 @@ class ChatService:
                 "context_docs": []
             }
     
-    def generate_response(self, messages: List[Dict[str, str]], query: str, use_rag: bool = True) -> Dict[str, Any]:
+    def generate_response(self, messages: List[Dict[str, str]], query: str, use_rag: bool = True, source_files: Optional[List[str]] = None, multi_query: bool = False) -> Dict[str, Any]:
         """統合されたレスポンス生成メソッド"""
         if use_rag and self.document_processor and self.document_processor.get_stats()['processed_files']:
-            return self.chat_with_rag(messages, query)
+            return self.chat_with_rag(messages, query, source_files, multi_query)
         else:
             return self.chat_without_rag(messages)
\ No newline at end of file
@@ -0,0 +1,181 @@
+# backend/chunk_store.py
+import mmap
+import os
+import tempfile
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_core.documents import Document
+
+# チャンクの本文を置くフォルダ（空ならメモリ上のバッファ、設定するとそこの一時ファイルをmmapで読む）
+CHUNK_STORE_DIR_ENV = "CHUNK_STORE_DIR"
+
+
+class ChunkStore:
+    """チャンクの本文とメタデータを詰めて持つストア
+
+    本文は1本のUTF-8バッファに追記して行ごとの開始位置と長さで引き、メタデータはキーごとに
+    値を重複なしの表にして行ごとには番号だけ持つよ（同じファイルのsource_fileやsession_idを
+    チャンクの数だけ持たない）。Documentは読み出すときにだけ作る。
+    directory を渡すと本文はそのフォルダの名前なし一時ファイルに書いて、mmapで読む。
+    """
+
+    def __init__(self, directory: Optional[str] = None):
+        self.directory = directory
+        self._starts = array('q')
+        self._lengths = array('q')
+        # メタデータのキーごとの列（値の表の番号。-1はその行にキーがない）
+        self._columns: Dict[str, array] = {}
+        self._values: Dict[str, List[Any]] = {}
+        self._codes: Dict[str, Dict[Any, int]] = {}
+        # 値がハッシュできなくて表にできないメタデータ
+        self._extra: Dict[int, Dict[str, Any]] = {}
+        self._size = 0
+        self._mmap: Optional[mmap.mmap] = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            # 名前なしのファイルなので、閉じれば（プロセスが落ちても）ディスクから消える
+            self._file = tempfile.TemporaryFile(dir=directory)
+            self._buffer = None
+        else:
+            self._file = None
+            self._buffer = bytearray()
+
+    @classmethod
+    def from_env(cls) -> "ChunkStore":
+        """CHUNK_STORE_DIR環境変数に合わせて作成"""
+        return cls(os.environ.get(CHUNK_STORE_DIR_ENV) or None)
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    @property
+    def mmapped(self) -> bool:
+        return self._file is not None
+
+    @property
+    def nbytes(self) -> int:
+        """本文と行ごとの配列のバイト数（値の表は除く）"""
+        return self._size + self._starts.itemsize * len(self._starts) * 2 + sum(
+            column.itemsize * len(column) for column in self._columns.values()
+        )
+
+    def append(self, text: str, metadata: Optional[Dict[str, Any]] = None) -> int:
+        """チャンクを追加して行番号を返す"""
+        data = text.encode('utf-8')
+        row = len(self._starts)
+        self._starts.append(self._write(data))
+        self._lengths.append(len(data))
+        for column in self._columns.values():
+            column.append(-1)
+        self._set_metadata(row, metadata or {})
+        return row
+
+    def replace(self, row: int, text: str, metadata: Optional[Dict[str, Any]] = None):
+        """行の中身を差し替え（本文は元の場所に収まればそこに上書き、収まらなければ追記して指す位置を変える）"""
+        data = text.encode('utf-8')
+        if len(data) <= self._lengths[row]:
+            self._overwrite(self._starts[row], data)
+        else:
+            self._starts[row] = self._write(data)
+        self._lengths[row] = len(data)
+        for column in self._columns.values():
+            column[row] = -1
+        self._extra.pop(row, None)
+        self._set_metadata(row, metadata or {})
+
+    def _write(self, data: bytes) -> int:
+        start = self._size
+        if self._file is None:
+            self._buffer += data
+        else:
+            self._file.seek(start)
+            self._file.write(data)
+        self._size += len(data)
+        return start
+
+    def _overwrite(self, start: int, data: bytes):
+        if self._file is None:
+            self._buffer[start:start + len(data)] = data
+        else:
+            self._file.seek(start)
+            self._file.write(data)
+            # mmapはファイルと同じページを見ているので、書き出せばそのまま読める
+            self._file.flush()
+
+    def _read(self, start: int, length: int) -> bytes:
+        if length == 0 or self._size == 0:
+            # 空のファイルはmmapできない
+            return b""
+        if self._file is None:
+            return bytes(memoryview(self._buffer)[start:start + length])
+        if self._mmap is None or len(self._mmap) < start + length:
+            # 追記したぶんまで見えるように貼り直す
+            self._file.flush()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._mmap = mmap.mmap(self._file.fileno(), self._size, access=mmap.ACCESS_READ)
+        return self._mmap[start:start + length]
+
+    def _set_metadata(self, row: int, metadata: Dict[str, Any]):
+        for key, value in metadata.items():
+            try:
+                code = self._intern(key, value)
+            except TypeError:
+                self._extra.setdefault(row, {})[key] = value
+                continue
+            column = self._columns.get(key)
+            if column is None:
+                column = self._columns[key] = array('i', [-1]) * len(self._starts)
+            column[row] = code
+
+    def _intern(self, key: str, value: Any) -> int:
+        codes = self._codes.setdefault(key, {})
+        # 1と1.0とTrueは同じキーになってしまうので型も含める
+        interned = (type(value), value)
+        code = codes.get(interned)
+        if code is None:
+            values = self._values.setdefault(key, [])
+            code = codes[interned] = len(values)
+            values.append(value)
+        return code
+
+    def text(self, row: int) -> str:
+        """行の本文"""
+        return self._read(self._starts[row], self._lengths[row]).decode('utf-8')
+
+    def value(self, row: int, key: str, default: Any = None) -> Any:
+        """行のメタデータの値を1つだけ取得"""
+        column = self._columns.get(key)
+        if column is not None and column[row] >= 0:
+            return self._values[key][column[row]]
+        return self._extra.get(row, {}).get(key, default)
+
+    def metadata(self, row: int) -> Dict[str, Any]:
+        """行のメタデータ（呼ぶたびに新しいdict）"""
+        metadata = {
+            key: self._values[key][column[row]]
+            for key, column in self._columns.items()
+            if column[row] >= 0
+        }
+        metadata.update(self._extra.get(row, {}))
+        return metadata
+
+    def document(self, row: int, doc_id: Optional[str] = None) -> Document:
+        """行をDocumentにする"""
+        return Document(id=doc_id, page_content=self.text(row), metadata=self.metadata(row))
+
+    def compact(self, rows: Iterable[int]) -> "ChunkStore":
+        """指定した行だけを詰め直した新しいストア（削除のあとに使う）"""
+        compacted = ChunkStore(self.directory)
+        for row in rows:
+            compacted.append(self.text(row), self.metadata(row))
+        return compacted
+
+    def close(self):
+        """mmapと一時ファイルを閉じる"""
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
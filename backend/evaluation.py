@@ -1,208 +1,446 @@
 # backend/evaluation.py
-import pandas as pd
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass
+import math
+import os
+import threading
+import weakref
 from datetime import datetime
-import streamlit as st
-
-from ragas import evaluate, EvaluationDataset
-from ragas.llms import LangchainLLMWrapper
-from ragas.embeddings import LangchainEmbeddingsWrapper
-from ragas.metrics import (
-    context_precision, 
-    context_recall, 
-    faithfulness,
-    answer_relevancy
-)
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 
+from langchain_core.callbacks import BaseCallbackHandler
+
+from backend.evaluation_cache import EvaluationCache, make_cache_key
+from backend.evaluation_capture import METRIC_NAMES, ChatEvaluation, EvaluationCapture, evaluation_store
+from backend.evaluation_export import WRITERS, export_columns
+from backend.evaluation_sampling import EvaluationSample, estimate_judge_cost, stratified_sample
+from backend.evaluation_store import METRIC_COLUMNS, EvaluationStore
+from backend.fast_metrics import FAST_METRIC_NAMES
 from config_manager import config_manager
 
-@dataclass
-class ChatEvaluation:
-    """チャット評価データクラス"""
-    timestamp: datetime
-    question: str
-    answer: str
-    contexts: List[str]
-    source_files: List[str]
-    context_precision: Optional[float] = None
-    context_recall: Optional[float] = None
-    faithfulness: Optional[float] = None
-    answer_relevancy: Optional[float] = None
-    overall_score: Optional[float] = None
-
-class EvaluationService:
-    def __init__(self):
-        # 使用可能なメトリクス
-        self.available_metrics = {
-            'context_precision': context_precision,
-            'context_recall': context_recall,
-            'faithfulness': faithfulness,
-            'answer_relevancy': answer_relevancy
-        }
+if TYPE_CHECKING:
+    import pandas as pd
+    from ragas import RunConfig
+
+# 未採点のチャットを読み出して評価する単位（1回のevaluateに入れる最大件数）
+EVALUATION_PAGE_SIZE = 1000
+
+# エクスポートで1回に読み出して書き出す件数（Parquetではこれが1つのrow groupになる）
+EXPORT_BATCH_SIZE = 500
+
+# 時系列グラフに描く最大の点数（これを超えたら時間で間引く）
+CHART_MAX_POINTS = 500
+
+# RAGASのRunConfigのデフォルト（環境変数で上書きできる）
+DEFAULT_RUN_CONFIG = {
+    'max_workers': int(os.environ.get('RAGAS_MAX_WORKERS', 16)),
+    'timeout': int(os.environ.get('RAGAS_TIMEOUT', 180)),
+    'max_retries': int(os.environ.get('RAGAS_MAX_RETRIES', 10)),
+    'max_wait': int(os.environ.get('RAGAS_MAX_WAIT', 60)),
+}
+
+class MetricProgressHandler(BaseCallbackHandler):
+    """RAGASのメトリクス計算が1つ終わるごとに進捗を通知するコールバック"""
+    
+    def __init__(self, total: int, progress_callback):
+        self.total = total
+        self.progress_callback = progress_callback
+        self.done = 0
+        self._metric_runs = set()
+        self._lock = threading.Lock()
+    
+    def on_chain_start(self, serialized, inputs, *, run_id, metadata=None, **kwargs):
+        from ragas.callbacks import ChainType
+        if metadata and metadata.get("type") == ChainType.METRIC:
+            with self._lock:
+                self._metric_runs.add(run_id)
+    
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
     
-    def get_wrappers(self):
-        """ラッパーを取得"""
-        llm = config_manager.get_llm()
-        embedding = config_manager.get_embedding()
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+    
+    def _finish(self, run_id):
+        with self._lock:
+            if run_id not in self._metric_runs:
+                return
+            self._metric_runs.discard(run_id)
+            self.done += 1
+            done = self.done
+        self.progress_callback(f"Evaluating {done}/{self.total} metric scores...")
+
+class UsageCallbackHandler(BaseCallbackHandler):
+    """RAGASの採点でLLMが使ったトークンをセッションの使用量に記録するコールバック"""
+    
+    def __init__(self, usage, feature: str = "evaluation"):
+        self.usage = usage
+        self.feature = feature
+    
+    def on_llm_end(self, response, **kwargs):
+        recorded = False
+        for generations in response.generations:
+            for generation in generations:
+                usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+                if usage_metadata:
+                    self.usage.record_llm_usage(self.feature, usage_metadata)
+                    recorded = True
+        if recorded:
+            return
+        # メッセージにusageがないモデルはllm_outputのtoken_usageを見る
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+        if token_usage:
+            self.usage.record(self.feature, token_usage.get("prompt_tokens", 0), token_usage.get("completion_tokens", 0))
+        else:
+            self.usage.record_llm_usage(
+                self.feature, None, completion_text="".join(generation.text for generations in response.generations for generation in generations)
+            )
+
+class EvaluationService(EvaluationCapture):
+    """評価データの採点・集計・エクスポート（ragas・pandasは採点やエクスポートのときだけ読み込む）"""
+    
+    def __init__(self, config=None, cache: Optional[EvaluationCache] = None, store: Optional[EvaluationStore] = None, usage=None):
+        super().__init__(config, store or evaluation_store, usage)
+        self.run_config_params = dict(DEFAULT_RUN_CONFIG)
+        self._wrappers_cache = None
+        self._available_metrics = None
+        # セッションをまたいで残る (入力, メトリクス, 採点モデル) ごとのスコアキャッシュ
+        self.cache = cache or EvaluationCache()
+    
+    @property
+    def available_metrics(self) -> Dict[str, Any]:
+        """使用可能なメトリクス（初めて使うときにragasを読み込む）"""
+        if self._available_metrics is None:
+            from ragas.metrics import answer_relevancy, context_precision, context_recall, faithfulness
+            self._available_metrics = {
+                'context_precision': context_precision,
+                'context_recall': context_recall,
+                'faithfulness': faithfulness,
+                'answer_relevancy': answer_relevancy
+            }
+        return self._available_metrics
+    
+    def get_wrappers(self, llm=None, embedding=None):
+        """ラッパーを取得（同じモデルならラッパーを使い回す）"""
+        llm = llm or self.config.get_llm()
+        embedding = embedding or self.config.get_embedding()
         
         if not llm or not embedding:
             raise ValueError("LLM or Embedding is not configured")
         
+        if self._wrappers_cache and self._wrappers_cache[0] is llm and self._wrappers_cache[1] is embedding:
+            return self._wrappers_cache[2], self._wrappers_cache[3]
+        
+        from ragas.embeddings import LangchainEmbeddingsWrapper
+        from ragas.llms import LangchainLLMWrapper
+        
         llm_wrapper = LangchainLLMWrapper(llm)
         embeddings_wrapper = LangchainEmbeddingsWrapper(embedding)
+        self._wrappers_cache = (llm, embedding, llm_wrapper, embeddings_wrapper)
         
         return llm_wrapper, embeddings_wrapper
     
-    def add_chat_for_evaluation(self, question: str, answer: str, contexts: List[str], source_files: List[str]):
-        """チャット結果を評価用に追加"""
-        if "evaluation_data" not in st.session_state:
-            st.session_state.evaluation_data = []
-        
-        evaluation_item = ChatEvaluation(
-            timestamp=datetime.now(),
-            question=question,
-            answer=answer,
-            contexts=contexts,
-            source_files=source_files
-        )
-        
-        st.session_state.evaluation_data.append(evaluation_item)
+    def get_run_config(self, **overrides) -> "RunConfig":
+        """RAGASのRunConfigを作成"""
+        from ragas import RunConfig
+        params = {**self.run_config_params, **{k: v for k, v in overrides.items() if v is not None}}
+        return RunConfig(**params)
+    
+    def count_missing_fast_metrics(self) -> int:
+        """高速メトリクスがまだないチャットの件数"""
+        # 文脈がないと他の高速メトリクスはNoneのままなので、必ず計算できるfast_relevancyで判定
+        return self.store.count(missing_metrics=['fast_relevancy'])
+    
+    def evaluate_fast_metrics(self, progress_callback=None, force: bool = False) -> int:
+        """高速メトリクスがまだないチャットをページ単位でまとめて計算して書き戻す"""
+        missing_metrics = None if force else ['fast_relevancy']
+        total = self.store.count(missing_metrics=missing_metrics)
+        done = 0
+        for items in self.store.iter_batches(EVALUATION_PAGE_SIZE, missing_metrics=missing_metrics):
+            self.compute_fast_metrics(items, self.resolve_contexts(items))
+            self.store.update_scores(items)
+            done += len(items)
+            if progress_callback:
+                progress_callback(f"Fast metrics: {done}/{total}")
+        return done
+    
+    def count_evaluation_data(self, **filters) -> int:
+        """評価データの件数を取得"""
+        return self.store.count(**filters)
+    
+    def get_evaluation_data(self, **options) -> List[ChatEvaluation]:
+        """評価データを読み出す（フィルター・並び順・ページ指定はストアに渡す）"""
+        return self.store.scan(**options)
     
     def evaluate_single_chat(self, evaluation_item: ChatEvaluation, selected_metrics: List[str]) -> ChatEvaluation:
         """単一のチャット結果を評価"""
+        return self.evaluate_chats_batch([evaluation_item], selected_metrics)[0]
+    
+    def evaluate_chats_batch(self, items: List[ChatEvaluation], selected_metrics: List[str], run_config: Optional["RunConfig"] = None, progress_callback=None, llm=None, embedding=None, usage=None, contexts: Optional[List[List[str]]] = None) -> List[ChatEvaluation]:
+        """複数のチャット結果を1つのデータセットにまとめて1回のevaluateで評価（contextsを渡すと文脈の本文を引き直さない）"""
+        # 選択されたメトリクスで評価
+        metrics = [self.available_metrics[metric] for metric in selected_metrics if metric in self.available_metrics]
+        
+        if not items or not metrics:
+            return items
+        
+        import pandas as pd
+        from ragas import EvaluationDataset, evaluate
+        
         try:
-            # DataFrameを作成
+            # 全件分のDataFrameを作成
             data = {
-                'user_input': [evaluation_item.question],
-                'response': [evaluation_item.answer],
-                'retrieved_contexts': [evaluation_item.contexts],
-                'reference': [evaluation_item.answer]  # 自己参照として使用
+                'user_input': [item.question for item in items],
+                'response': [item.answer for item in items],
+                'retrieved_contexts': self.resolve_contexts(items) if contexts is None else contexts,
+                'reference': [item.answer for item in items]  # 自己参照として使用
             }
             
             df = pd.DataFrame(data)
             dataset = EvaluationDataset.from_pandas(df)
             
-            # 選択されたメトリクスで評価
-            metrics = [self.available_metrics[metric] for metric in selected_metrics if metric in self.available_metrics]
-            
-            if not metrics:
-                return evaluation_item
-            
             # ラッパーを取得
-            llm_wrapper, embeddings_wrapper = self.get_wrappers()
+            llm_wrapper, embeddings_wrapper = self.get_wrappers(llm, embedding)
+            
+            callbacks = []
+            if progress_callback:
+                callbacks.append(MetricProgressHandler(len(items) * len(metrics), progress_callback))
+            usage = usage or self.usage
+            if usage is not None:
+                callbacks.append(UsageCallbackHandler(usage))
             
             result = evaluate(
                 dataset,
                 llm=llm_wrapper,
                 embeddings=embeddings_wrapper,
                 metrics=metrics,
+                run_config=run_config or self.get_run_config(),
+                callbacks=callbacks,
+                show_progress=False,
             )
             
-            # 結果を評価アイテムに反映
-            result_dict = result.to_pandas().iloc[0].to_dict()
+            # 結果を行ごとに評価アイテムに反映（RAGASは入力順で返す）
+            for item, scores in zip(items, result.scores):
+                self._apply_scores(item, scores, selected_metrics)
             
-            if 'context_precision' in selected_metrics:
-                evaluation_item.context_precision = result_dict.get('context_precision')
-            if 'context_recall' in selected_metrics:
-                evaluation_item.context_recall = result_dict.get('context_recall')
-            if 'faithfulness' in selected_metrics:
-                evaluation_item.faithfulness = result_dict.get('faithfulness')
-            if 'answer_relevancy' in selected_metrics:
-                evaluation_item.answer_relevancy = result_dict.get('answer_relevancy')
-            
-            # 総合スコアを計算
-            scores = []
-            if evaluation_item.context_precision is not None:
-                scores.append(evaluation_item.context_precision)
-            if evaluation_item.context_recall is not None:
-                scores.append(evaluation_item.context_recall)
-            if evaluation_item.faithfulness is not None:
-                scores.append(evaluation_item.faithfulness)
-            if evaluation_item.answer_relevancy is not None:
-                scores.append(evaluation_item.answer_relevancy)
-            
-            if scores:
-                evaluation_item.overall_score = sum(scores) / len(scores)
-            
-            return evaluation_item
+            return items
             
         except Exception as e:
             print(f"Evaluation error: {e}")
-            return evaluation_item
+            return items
+    
+    def _apply_scores(self, evaluation_item: ChatEvaluation, scores: Dict[str, Any], selected_metrics: List[str]):
+        """スコアを評価アイテムに反映して総合スコアを再計算"""
+        for metric in METRIC_NAMES:
+            if metric in selected_metrics and metric in scores:
+                score = scores[metric]
+                # 失敗した行はNaNになるので未評価扱いにする
+                if score is not None and not (isinstance(score, float) and math.isnan(score)):
+                    setattr(evaluation_item, metric, float(score))
+        
+        # 総合スコアを計算
+        metric_scores = [getattr(evaluation_item, metric) for metric in METRIC_NAMES if getattr(evaluation_item, metric) is not None]
+        
+        if metric_scores:
+            evaluation_item.overall_score = sum(metric_scores) / len(metric_scores)
     
-    def evaluate_all_chats(self, selected_metrics: List[str], progress_callback=None) -> List[ChatEvaluation]:
-        """全てのチャット結果を評価"""
-        if "evaluation_data" not in st.session_state:
+    def evaluate_all_chats(self, selected_metrics: List[str], progress_callback=None, run_config: Optional["RunConfig"] = None, force: bool = False, max_calls: Optional[int] = None, max_tokens: Optional[int] = None) -> List[ChatEvaluation]:
+        """全てのチャット結果を評価（採点済みの組み合わせとキャッシュ済みのスコアはスキップ）
+
+        max_calls / max_tokens を渡すと、全件ではなく予算内の層別サンプルだけを評価する
+        """
+        metrics = [metric for metric in selected_metrics if metric in self.available_metrics]
+        if not metrics:
             return []
         
+        if max_calls is not None or max_tokens is not None:
+            sample = self.sample_for_evaluation(metrics, max_calls, max_tokens, force)
+            for start in range(0, len(sample.items), EVALUATION_PAGE_SIZE):
+                self.evaluate_items(sample.items[start:start + EVALUATION_PAGE_SIZE], metrics, progress_callback, run_config, force)
+            return sample.items
+        
         evaluated_data = []
-        total_items = len(st.session_state.evaluation_data)
+        # 未採点のものだけをページ単位で読み出して評価・書き戻し
+        for items in self.store.iter_batches(EVALUATION_PAGE_SIZE, missing_metrics=None if force else metrics):
+            self.evaluate_items(items, metrics, progress_callback, run_config, force)
+            evaluated_data.extend(items)
         
-        for i, item in enumerate(st.session_state.evaluation_data):
-            if progress_callback:
-                progress_callback(f"Evaluating {i+1}/{total_items}: {item.question[:50]}...")
+        return evaluated_data
+    
+    def sample_for_evaluation(self, selected_metrics: List[str], max_calls: Optional[int] = None, max_tokens: Optional[int] = None, force: bool = False, seed: Optional[int] = None) -> EvaluationSample:
+        """未採点のチャットから予算内に収まる層別サンプルを選ぶ"""
+        candidates = []
+        costs = []
+        for items in self.store.iter_batches(EVALUATION_PAGE_SIZE, missing_metrics=None if force else selected_metrics):
+            # 見積もりのために文脈の本文を引くのはページ単位（見積もったら捨てる）
+            contexts = self.resolve_contexts(items)
+            for item, item_contexts in zip(items, contexts):
+                missing = [metric for metric in selected_metrics if force or getattr(item, metric) is None]
+                costs.append(estimate_judge_cost(item.question, item.answer, item_contexts, missing))
+            candidates.extend(items)
+        
+        return stratified_sample(candidates, costs, max_calls, max_tokens, seed)
+    
+    def evaluate_items(self, items: List[ChatEvaluation], metrics: List[str], progress_callback=None, run_config: Optional["RunConfig"] = None, force: bool = False, llm=None, embedding=None, usage=None) -> List[ChatEvaluation]:
+        """評価アイテムのうち未採点の組み合わせだけを評価してストアに書き戻す
+
+        llm / embedding を渡すとself.configの代わりにそれを使う（バックグラウンド実行用）
+        usage を渡すと採点で使ったトークンをそのセッションの使用量に記録する
+        """
+        judge = self.config.get_llm_name(llm) or ""
+        
+        # まだスコアのない (アイテム, メトリクス) の組み合わせを集める
+        missing_metrics = {}
+        for index, item in enumerate(items):
+            missing = [metric for metric in metrics if force or getattr(item, metric) is None]
+            if missing:
+                missing_metrics[index] = missing
+        
+        # キャッシュキーは文脈の本文から作る（チャンクIDの付け方が変わってもキャッシュが使える）
+        contexts = dict(zip(missing_metrics, self.resolve_contexts([items[index] for index in missing_metrics])))
+        pending = {
+            index: {
+                metric: make_cache_key(items[index].question, items[index].answer, contexts[index], metric, judge)
+                for metric in missing
+            }
+            for index, missing in missing_metrics.items()
+        }
+        
+        # 永続キャッシュにあるスコアはそのまま使う
+        cached_scores = {} if force else self.cache.get_many(key for keys in pending.values() for key in keys.values())
+        cache_hits = 0
+        groups = {}
+        for index, keys in pending.items():
+            hits = {metric: cached_scores[key] for metric, key in keys.items() if key in cached_scores}
+            if hits:
+                self._apply_scores(items[index], hits, list(hits))
+                cache_hits += len(hits)
             
-            evaluated_item = self.evaluate_single_chat(item, selected_metrics)
-            evaluated_data.append(evaluated_item)
+            # 残りのメトリクスが同じアイテム同士をまとめて評価する
+            remaining = tuple(metric for metric in metrics if metric in keys and metric not in hits)
+            if remaining:
+                groups.setdefault(remaining, []).append(index)
         
-        # セッション状態を更新
-        st.session_state.evaluation_data = evaluated_data
-        return evaluated_data
+        if progress_callback:
+            pending_pairs = sum(len(group_metrics) * len(indices) for group_metrics, indices in groups.items())
+            progress_callback(f"Cache hits: {cache_hits}, evaluating {pending_pairs} metric scores...")
+        
+        for group_metrics, indices in groups.items():
+            self.evaluate_chats_batch(
+                [items[index] for index in indices], list(group_metrics), run_config, progress_callback, llm, embedding, usage,
+                contexts=[contexts[index] for index in indices]
+            )
+            
+            # 新しく採点できたスコアをキャッシュに保存
+            self.cache.put_many(
+                (pending[index][metric], metric, judge, getattr(items[index], metric))
+                for index in indices
+                for metric in group_metrics
+                if getattr(items[index], metric) is not None
+            )
+        
+        # スコアが変わったアイテムをストアに書き戻す
+        self.store.update_scores([items[index] for index in pending])
+        return items
     
     def get_evaluation_summary(self) -> Dict[str, Any]:
         """評価結果のサマリーを取得"""
-        if "evaluation_data" not in st.session_state:
+        averages = self.store.averages()
+        
+        if averages['total'] == 0:
             return {}
         
-        data = st.session_state.evaluation_data
-        evaluated_data = [item for item in data if item.overall_score is not None]
+        summary = {"total_chats": averages['total'], "evaluated_chats": averages['evaluated']}
         
-        if not evaluated_data:
-            return {"total_chats": len(data), "evaluated_chats": 0}
+        # 高速メトリクスはLLM採点と関係なく全チャットぶんの平均
+        for metric in FAST_METRIC_NAMES:
+            if averages[metric] is not None:
+                summary[f"avg_{metric}"] = averages[metric]
+        
+        if averages['evaluated'] == 0:
+            return summary
         
         # 各メトリクスの平均を計算
-        summary = {
-            "total_chats": len(data),
-            "evaluated_chats": len(evaluated_data),
-            "avg_overall_score": sum(item.overall_score for item in evaluated_data) / len(evaluated_data)
-        }
+        summary["avg_overall_score"] = averages['overall_score']
         
         # 各メトリクスの平均
-        metrics = ['context_precision', 'context_recall', 'faithfulness', 'answer_relevancy']
-        for metric in metrics:
-            scores = [getattr(item, metric) for item in evaluated_data if getattr(item, metric) is not None]
-            if scores:
-                summary[f"avg_{metric}"] = sum(scores) / len(scores)
+        for metric in METRIC_NAMES:
+            if averages[metric] is not None:
+                summary[f"avg_{metric}"] = averages[metric]
+        
+        # 一部だけ採点したときのために、全チャットの平均の95%信頼区間もつける
+        intervals = self.store.confidence_intervals()
+        for metric in METRIC_NAMES + ['overall_score']:
+            if intervals[metric] is not None:
+                summary[f"ci_{metric}"] = intervals[metric]
         
         return summary
     
-    def export_evaluation_data(self) -> pd.DataFrame:
+    def get_metric_distribution(self) -> Dict[str, Dict[str, float]]:
+        """メトリクスごとの四分位数を取得（箱ひげ図用）"""
+        return self.store.quantiles(METRIC_NAMES)
+    
+    def get_metric_time_series(self, max_points: int = CHART_MAX_POINTS):
+        """メトリクスの時系列を取得（件数が多いときは時間で間引いて平均）"""
+        timestamps, series = self.store.time_series(max_points, METRIC_NAMES)
+        return [datetime.fromtimestamp(timestamp) for timestamp in timestamps], series
+    
+    def iter_export_records(self, include_contexts: bool = True, batch_size: int = EXPORT_BATCH_SIZE):
+        """エクスポート用のレコードをバッチごとに作る（文脈の本文はバッチ単位で引く）"""
+        for items in self.store.iter_batches(batch_size):
+            contexts = self.resolve_contexts(items) if include_contexts else [None] * len(items)
+            records = []
+            for item, item_contexts in zip(items, contexts):
+                record = {
+                    'timestamp': item.timestamp,
+                    'question': item.question,
+                    'answer': item.answer,
+                    'source_files': item.source_files,
+                    **{column: getattr(item, column) for column in METRIC_COLUMNS}
+                }
+                if include_contexts:
+                    record['contexts'] = item_contexts
+                records.append(record)
+            yield records
+    
+    def export_evaluation_file(self, file, export_format: str = 'csv', include_contexts: bool = True) -> int:
+        """評価データをCSV/Parquetでファイルに少しずつ書き出して、書いた件数を返す"""
+        return WRITERS[export_format](self.iter_export_records(include_contexts), file, include_contexts)
+    
+    def export_evaluation_data(self) -> "pd.DataFrame":
         """評価データをDataFrameとしてエクスポート"""
-        if "evaluation_data" not in st.session_state:
-            return pd.DataFrame()
+        import pandas as pd
         
         data = []
-        for item in st.session_state.evaluation_data:
-            data.append({
-                'timestamp': item.timestamp,
-                'question': item.question,
-                'answer': item.answer,
-                'contexts': '; '.join(item.contexts),
-                'source_files': '; '.join(item.source_files),
-                'context_precision': item.context_precision,
-                'context_recall': item.context_recall,
-                'faithfulness': item.faithfulness,
-                'answer_relevancy': item.answer_relevancy,
-                'overall_score': item.overall_score
-            })
-        
-        return pd.DataFrame(data)
+        for records in self.iter_export_records():
+            for record in records:
+                record['contexts'] = '; '.join(record['contexts'])
+                record['source_files'] = '; '.join(record['source_files'])
+                data.append(record)
+        
+        return pd.DataFrame(data, columns=export_columns())
     
     def clear_evaluation_data(self):
         """評価データをクリア"""
-        if "evaluation_data" in st.session_state:
-            del st.session_state.evaluation_data
+        self.store.clear()
 
 # グローバルインスタンス
-evaluation_service = EvaluationService()
\ No newline at end of file
+evaluation_service = EvaluationService()
+
+# セッションのモデル設定ごとの評価サービス（セッションが終わって設定が消えれば一緒に消える）
+_config_services = weakref.WeakKeyDictionary()
+
+def evaluation_service_for(config, usage=None, workspace_id: Optional[str] = None) -> EvaluationService:
+    """モデル設定ごとの評価サービスを取得（キャッシュはグローバルインスタンスと共有）
+
+    usage を渡すと、作るときにそのセッションのトークン使用量を記録先にする。
+    workspace_id を渡すと、ストアはそのワークスペースの行しか読み書きできないビューになる
+    """
+    if workspace_id is None and (config is None or config is config_manager):
+        return evaluation_service
+    store = evaluation_store if workspace_id is None else evaluation_store.for_workspace(workspace_id)
+    if config is None or config is config_manager:
+        # グローバル設定はセッション間で共有されるので、サービスは覚えておかない
+        return EvaluationService(config, cache=evaluation_service.cache, store=store, usage=usage)
+    service = _config_services.get(config)
+    if service is None or getattr(service.store, 'workspace_id', None) != workspace_id:
+        service = _config_services[config] = EvaluationService(config, cache=evaluation_service.cache, store=store, usage=usage)
+    return service
\ No newline at end of file
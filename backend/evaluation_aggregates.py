@@ -0,0 +1,166 @@
+# backend/evaluation_aggregates.py
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class MetricsAggregate:
+    """評価スコアの列指向バッファとメトリクスごとの累積和・二乗和・件数
+
+    追加・更新のたびに差分だけ反映するので、平均はO(1)、グラフ用の集計はNumPyでまとめて計算できるよ。
+    スコアが未評価のところはNaNで持つよ。
+    """
+
+    def __init__(self, columns: Sequence[str], capacity: int = 1024):
+        self.columns = list(columns)
+        self.clear(capacity)
+
+    def clear(self, capacity: int = 1024):
+        """バッファと累積値を空にする"""
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._timestamps = np.zeros(capacity, dtype=np.float64)
+        self._scores = np.full((capacity, len(self.columns)), np.nan)
+        self._rows: Dict[int, int] = {}
+        self._size = 0
+        self.sums = np.zeros(len(self.columns))
+        self.sq_sums = np.zeros(len(self.columns))
+        self.counts = np.zeros(len(self.columns), dtype=np.int64)
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        """タイムスタンプ列（UNIX秒）"""
+        return self._timestamps[:self._size]
+
+    @property
+    def scores(self) -> np.ndarray:
+        """スコア列（行 × メトリクス）"""
+        return self._scores[:self._size]
+
+    def _reserve(self, size: int):
+        """足りなければ容量を倍々で増やす"""
+        capacity = len(self._ids)
+        if size <= capacity:
+            return
+        while capacity < size:
+            capacity *= 2
+        self._ids = np.resize(self._ids, capacity)
+        self._timestamps = np.resize(self._timestamps, capacity)
+        scores = np.full((capacity, len(self.columns)), np.nan)
+        scores[:self._size] = self._scores[:self._size]
+        self._scores = scores
+
+    def _accumulate(self, scores: np.ndarray, sign: int):
+        """累積和と件数に行をまとめて足す（sign=-1で引く）"""
+        if len(scores):
+            self.sums += sign * np.nansum(scores, axis=0)
+            self.sq_sums += sign * np.nansum(scores * scores, axis=0)
+            self.counts += sign * np.count_nonzero(~np.isnan(scores), axis=0)
+
+    def upsert_many(self, ids: Sequence[int], timestamps: Sequence[float], scores: Sequence[Sequence[Optional[float]]]):
+        """行をまとめて追加・更新（既存の行は古い値を引いてから足し直す）"""
+        if not len(ids):
+            return
+        ids = np.asarray(ids, dtype=np.int64)
+        timestamps = np.asarray(timestamps, dtype=np.float64)
+        scores = np.array(scores, dtype=np.float64).reshape(len(ids), len(self.columns))
+
+        existing = np.fromiter((item_id in self._rows for item_id in ids.tolist()), dtype=bool, count=len(ids))
+        if existing.any():
+            rows = np.fromiter((self._rows[item_id] for item_id in ids[existing].tolist()), dtype=np.int64)
+            self._accumulate(self._scores[rows], -1)
+            self._scores[rows] = scores[existing]
+            self._timestamps[rows] = timestamps[existing]
+            self._accumulate(scores[existing], 1)
+
+        new = ~existing
+        count = int(new.sum())
+        if count:
+            start = self._size
+            self._reserve(start + count)
+            self._ids[start:start + count] = ids[new]
+            self._timestamps[start:start + count] = timestamps[new]
+            self._scores[start:start + count] = scores[new]
+            self._rows.update(zip(ids[new].tolist(), range(start, start + count)))
+            self._size += count
+            self._accumulate(scores[new], 1)
+
+    def averages(self) -> Dict[str, Optional[float]]:
+        """メトリクスごとの平均（1件もなければNone）"""
+        return {
+            column: (float(self.sums[index] / self.counts[index]) if self.counts[index] else None)
+            for index, column in enumerate(self.columns)
+        }
+
+    def confidence_intervals(self, z: float = 1.96) -> Dict[str, Optional[Tuple[float, float]]]:
+        """全チャットの平均に対する信頼区間（採点済みを無作為標本とみなし、有限母集団修正つき）
+
+        層別サンプリングは比例配分なので平均はそのまま使えて、単純無作為の分散は層別の分散以上だから区間は保守的になるよ。
+        """
+        result = {}
+        population = self._size
+        for index, column in enumerate(self.columns):
+            count = int(self.counts[index])
+            if count < 2:
+                result[column] = None
+                continue
+            mean = self.sums[index] / count
+            variance = max(0.0, (self.sq_sums[index] - count * mean * mean) / (count - 1))
+            correction = (population - count) / (population - 1) if population > 1 else 0.0
+            margin = z * np.sqrt(variance / count * max(0.0, correction))
+            result[column] = (float(mean - margin), float(mean + margin))
+        return result
+
+    def count(self, column: str) -> int:
+        """スコアのある件数"""
+        return int(self.counts[self.columns.index(column)])
+
+    def quantiles(self, columns: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+        """箱ひげ図用の四分位数とひげの位置をメトリクスごとに計算"""
+        result = {}
+        for column in columns or self.columns:
+            values = self.scores[:, self.columns.index(column)]
+            values = values[~np.isnan(values)]
+            if not len(values):
+                continue
+            q1, median, q3 = np.percentile(values, [25, 50, 75])
+            iqr = q3 - q1
+            inside = values[(values >= q1 - 1.5 * iqr) & (values <= q3 + 1.5 * iqr)]
+            result[column] = {
+                'q1': float(q1),
+                'median': float(median),
+                'q3': float(q3),
+                'lowerfence': float(inside.min()),
+                'upperfence': float(inside.max()),
+                'mean': float(values.mean()),
+            }
+        return result
+
+    def time_series(self, max_points: int = 500, columns: Optional[List[str]] = None) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+        """時系列用に時間で等間隔のバケットに分けて平均（件数が少なければそのまま）"""
+        columns = columns or self.columns
+        indices = [self.columns.index(column) for column in columns]
+        order = np.argsort(self.timestamps, kind='stable')
+        timestamps = self.timestamps[order]
+        scores = self.scores[order][:, indices]
+
+        if len(timestamps) <= max_points:
+            return timestamps, {column: scores[:, i] for i, column in enumerate(columns)}
+
+        edges = np.linspace(timestamps[0], timestamps[-1], max_points + 1)
+        buckets = np.clip(np.searchsorted(edges, timestamps, side='right') - 1, 0, max_points - 1)
+        counts = np.bincount(buckets, minlength=max_points)
+        occupied = counts > 0
+        bucket_times = np.bincount(buckets, weights=timestamps, minlength=max_points)[occupied] / counts[occupied]
+
+        series = {}
+        for i, column in enumerate(columns):
+            values = scores[:, i]
+            valid = ~np.isnan(values)
+            sums = np.bincount(buckets[valid], weights=values[valid], minlength=max_points)
+            valid_counts = np.bincount(buckets[valid], minlength=max_points)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                series[column] = np.where(valid_counts > 0, sums / valid_counts, np.nan)[occupied]
+        return bucket_times, series
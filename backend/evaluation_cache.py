@@ -0,0 +1,78 @@
+# backend/evaluation_cache.py
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import closing
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "evaluation_cache.sqlite3")
+
+
+def make_cache_key(question: str, answer: str, contexts: List[str], metric: str, judge: str) -> str:
+    """評価結果のキャッシュキーを作成（入力・メトリクス・採点モデルが同じなら同じキー）"""
+    payload = json.dumps([question, answer, contexts, metric, judge], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class EvaluationCache:
+    """メトリクスごとの評価結果をSQLiteに永続化するキャッシュ"""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path or os.environ.get("EVALUATION_CACHE_PATH", DEFAULT_CACHE_PATH)
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        """接続を作成（初回だけテーブルを作る）"""
+        if not self._initialized:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS metric_scores ("
+                "key TEXT PRIMARY KEY, metric TEXT NOT NULL, judge TEXT NOT NULL, "
+                "score REAL NOT NULL, created_at REAL NOT NULL)"
+            )
+            connection.commit()
+            self._initialized = True
+        return connection
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, float]:
+        """キャッシュ済みのスコアをまとめて取得"""
+        keys = list(keys)
+        found = {}
+        with closing(self._connect()) as connection:
+            # SQLiteのパラメータ数上限に引っかからないように分割
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = connection.execute(
+                    f"SELECT key, score FROM metric_scores WHERE key IN ({placeholders})", chunk
+                )
+                found.update(rows)
+        return found
+
+    def put_many(self, entries: Iterable[Tuple[str, str, str, float]]):
+        """(key, metric, judge, score) をまとめて保存"""
+        now = time.time()
+        rows = [(key, metric, judge, score, now) for key, metric, judge, score in entries]
+        if not rows:
+            return
+        with closing(self._connect()) as connection:
+            connection.executemany("INSERT OR REPLACE INTO metric_scores VALUES (?, ?, ?, ?, ?)", rows)
+            connection.commit()
+
+    def clear(self):
+        """キャッシュを全削除"""
+        with closing(self._connect()) as connection:
+            connection.execute("DELETE FROM metric_scores")
+            connection.commit()
+
+    def count(self) -> int:
+        """キャッシュ件数を取得"""
+        with closing(self._connect()) as connection:
+            return connection.execute("SELECT COUNT(*) FROM metric_scores").fetchone()[0]
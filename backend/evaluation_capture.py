@@ -0,0 +1,136 @@
+# backend/evaluation_capture.py
+import math
+import os
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, List, Optional
+
+from backend.evaluation_store import EvaluationStore
+from backend.fast_metrics import compute_fast_metrics, metrics_for_row, unique_texts
+from backend.local_models import estimate_tokens
+from backend.metrics import EMBEDDING_CALLS, EMBEDDING_TOKENS
+from backend.tracing import span
+from backend.upload import make_chunk_id
+from config_manager import config_manager
+
+@dataclass(slots=True)
+class ChatEvaluation:
+    """チャット評価データクラス（文脈は本文ではなくチャンクIDと類似度で持つ）"""
+    timestamp: datetime
+    question: str
+    answer: str
+    context_ids: List[str]
+    source_files: List[str]
+    context_scores: array = field(default_factory=lambda: array('f'))
+    context_precision: Optional[float] = None
+    context_recall: Optional[float] = None
+    faithfulness: Optional[float] = None
+    answer_relevancy: Optional[float] = None
+    overall_score: Optional[float] = None
+    fast_relevancy: Optional[float] = None
+    fast_grounding: Optional[float] = None
+    retrieval_top_score: Optional[float] = None
+    retrieval_score_spread: Optional[float] = None
+    id: Optional[int] = None
+    session_id: Optional[str] = None
+    # 評価データを見られるワークスペース（CLIのバッチなどはNone）
+    workspace_id: Optional[str] = None
+
+METRIC_NAMES = ['context_precision', 'context_recall', 'faithfulness', 'answer_relevancy']
+
+# チャットのたびに埋め込みだけで高速メトリクスを計算するか
+FAST_METRICS_ENABLED = os.environ.get('FAST_METRICS', 'true').lower() not in ('false', '0', 'no')
+
+class EvaluationCapture:
+    """チャット結果を評価データとして保存して、高速メトリクスをその場で計算する
+
+    ragas・pandasは読み込まないので、チャットの1ターン目が重くならないよ。
+    LLM採点はこれを継承したEvaluationService（backend/evaluation.py）でやる。
+    """
+
+    def __init__(self, config=None, store: Optional[EvaluationStore] = None, usage=None):
+        # このセッションのモデル設定（省略時はCLI・ベンチマーク用のグローバル設定）
+        self.config = config or config_manager
+        # このセッションのトークン使用量（UsageLedger。Noneなら記録しない）
+        self.usage = usage
+        # 評価データ本体の永続ストア（省略時はプロセスで共有するストア。セッションのビューを渡すとそのセッションの行になる）
+        self.store = store or evaluation_store
+
+    def add_chat_for_evaluation(self, question: str, answer: str, context_docs: List[Any], source_files: List[str], query_vector=None, context_vectors=None):
+        """チャット結果を評価用に追加（文脈の本文はチャンクIDごとに1回だけ保存）
+
+        検索で使った質問・文脈のベクトルを渡すと、それを使って高速メトリクスもその場で計算する
+        """
+        chunk_texts = {}
+        chunk_scores = {}
+        for doc in context_docs:
+            chunk_id = doc.id or doc.metadata.get('chunk_id') or make_chunk_id(doc.page_content)
+            chunk_texts[chunk_id] = doc.page_content
+            chunk_scores[chunk_id] = doc.metadata.get('score', math.nan)
+
+        evaluation_item = ChatEvaluation(
+            timestamp=datetime.now(),
+            question=question,
+            answer=answer,
+            context_ids=list(chunk_texts),
+            context_scores=array('f', chunk_scores.values()),
+            source_files=source_files
+        )
+
+        if FAST_METRICS_ENABLED:
+            try:
+                with span("fast_metrics"):
+                    self.compute_fast_metrics([evaluation_item], [list(chunk_texts.values())], [query_vector], [context_vectors])
+            except Exception as e:
+                # 高速メトリクスが取れなくてもチャットは止めない（後でまとめて計算できる）
+                print(f"Fast metrics error: {e}")
+
+        with span("evaluation_store"):
+            self.store.append(evaluation_item, chunk_texts)
+
+    def compute_fast_metrics(self, items: List[ChatEvaluation], contexts: List[List[str]], question_vectors=None, context_vectors=None, embedding=None) -> List[ChatEvaluation]:
+        """高速メトリクスをまとめて計算して評価アイテムに反映（埋め込みの呼び出しは1回だけ）"""
+        embedding = embedding or self.config.get_embedding()
+        if not embedding or not items:
+            return items
+        question_vectors = question_vectors or [None] * len(items)
+        context_vectors = context_vectors or [None] * len(items)
+
+        # 手元にベクトルがないテキストだけを重複なしで集めて埋め込む
+        texts = unique_texts(
+            [[item.answer] for item in items]
+            + [[item.question] for item, vector in zip(items, question_vectors) if vector is None]
+            + [item_contexts for item_contexts, vectors in zip(contexts, context_vectors) if vectors is None]
+        )
+        with span("embed_documents", texts=len(texts)) as record:
+            vectors = dict(zip(texts, embedding.embed_documents(texts)))
+            embedding_tokens = sum(estimate_tokens(text) for text in texts)
+            EMBEDDING_CALLS.inc(phase="fast_metrics")
+            EMBEDDING_TOKENS.inc(embedding_tokens, phase="fast_metrics")
+            if self.usage is not None:
+                self.usage.record("fast_metrics", embedding_tokens=embedding_tokens, estimated=True)
+            if record is not None:
+                record.set(embedding_tokens=embedding_tokens)
+
+        metrics = compute_fast_metrics(
+            [vectors[item.question] if vector is None else vector for item, vector in zip(items, question_vectors)],
+            [vectors[item.answer] for item in items],
+            [
+                [vectors[text] for text in item_contexts] if item_vectors is None else item_vectors
+                for item_contexts, item_vectors in zip(contexts, context_vectors)
+            ],
+            [item.context_scores for item in items],
+        )
+        for index, item in enumerate(items):
+            for name, value in metrics_for_row(metrics, index).items():
+                setattr(item, name, value)
+        return items
+
+    def resolve_contexts(self, items: List[ChatEvaluation]) -> List[List[str]]:
+        """評価アイテムのチャンクIDを文脈の本文に戻す（採点・エクスポートの直前だけ）"""
+        texts = self.store.get_chunk_texts({chunk_id for item in items for chunk_id in item.context_ids})
+        return [[texts[chunk_id] for chunk_id in item.context_ids if chunk_id in texts] for item in items]
+
+# グローバルインスタンス（評価データの永続ストアはプロセスで1つ）
+evaluation_store = EvaluationStore(item_factory=ChatEvaluation)
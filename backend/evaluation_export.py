@@ -0,0 +1,81 @@
+# backend/evaluation_export.py
+import csv
+import io
+import os
+from typing import Any, BinaryIO, Dict, Iterable, List
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from backend.evaluation_store import METRIC_COLUMNS
+
+# エクスポート形式ごとの拡張子とMIMEタイプ
+EXPORT_FORMATS = {
+    'csv': {'extension': 'csv', 'mime': 'text/csv'},
+    'parquet': {'extension': 'parquet', 'mime': 'application/vnd.apache.parquet'},
+}
+
+# ダウンロードに渡せるファイルの上限（Streamlitのダウンロードボタンはファイルを丸ごとメモリに載せるので）
+EXPORT_MAX_MB = int(os.environ.get('EVALUATION_EXPORT_MAX_MB', 50))
+EXPORT_MAX_BYTES = EXPORT_MAX_MB * 1024 * 1024
+
+
+def export_columns(include_contexts: bool = True) -> List[str]:
+    """エクスポートする列名"""
+    return ['timestamp', 'question', 'answer', *(['contexts'] if include_contexts else []), 'source_files', *METRIC_COLUMNS]
+
+
+def write_csv(batches: Iterable[List[Dict[str, Any]]], file: BinaryIO, include_contexts: bool = True) -> int:
+    """レコードのバッチを順番にCSVへ書き出す（リスト列は「; 」で連結）"""
+    columns = export_columns(include_contexts)
+    text = io.TextIOWrapper(file, encoding='utf-8', newline='', write_through=True)
+    try:
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        rows = 0
+        for records in batches:
+            writer.writerows(
+                [
+                    '; '.join(record[column]) if isinstance(record[column], list)
+                    else ('' if record[column] is None else record[column])
+                    for column in columns
+                ]
+                for record in records
+            )
+            rows += len(records)
+        return rows
+    finally:
+        # 呼び出し元のファイルは閉じない
+        text.detach()
+
+
+def parquet_schema(include_contexts: bool = True) -> pa.Schema:
+    """Parquetのスキーマ（文脈とファイル名は文字列のリストで持つ）"""
+    fields = [
+        pa.field('timestamp', pa.timestamp('us')),
+        pa.field('question', pa.string()),
+        pa.field('answer', pa.string()),
+    ]
+    if include_contexts:
+        fields.append(pa.field('contexts', pa.list_(pa.string())))
+    fields.append(pa.field('source_files', pa.list_(pa.string())))
+    fields.extend(pa.field(column, pa.float64()) for column in METRIC_COLUMNS)
+    return pa.schema(fields)
+
+
+def write_parquet(batches: Iterable[List[Dict[str, Any]]], file: BinaryIO, include_contexts: bool = True) -> int:
+    """レコードのバッチを1つずつrow groupとしてParquetへ書き出す"""
+    schema = parquet_schema(include_contexts)
+    rows = 0
+    with pq.ParquetWriter(file, schema, compression='zstd') as writer:
+        for records in batches:
+            if records:
+                writer.write_table(pa.Table.from_pylist(records, schema=schema))
+                rows += len(records)
+    return rows
+
+
+WRITERS = {
+    'csv': write_csv,
+    'parquet': write_parquet,
+}
@@ -0,0 +1,157 @@
+# backend/evaluation_sampling.py
+import random
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from backend.local_models import estimate_tokens
+
+# メトリクス1つの採点でLLMを呼ぶ回数の目安（context_precisionは文脈1本ごとに1回）
+JUDGE_CALLS_PER_METRIC = {
+    'context_precision': None,
+    'context_recall': 1,
+    'faithfulness': 2,
+    'answer_relevancy': 1,
+}
+
+# 採点プロンプトの指示文・例のぶんのトークン数の目安（1回の呼び出しあたり）
+JUDGE_PROMPT_OVERHEAD_TOKENS = 600
+
+# 時間帯・回答の長さを何分割して層にするか
+TIME_BUCKETS = 4
+LENGTH_BUCKETS = 4
+
+# 高速メトリクスの下位何%を外れ値として別の層にするか
+OUTLIER_QUANTILE = 10
+
+
+@dataclass
+class EvaluationSample:
+    """予算内で選んだ採点対象"""
+    items: List[Any]
+    population: int
+    strata: int
+    estimated_calls: int = 0
+    estimated_tokens: int = 0
+    allocation: Dict[Tuple, int] = field(default_factory=dict, repr=False)
+
+
+def estimate_judge_cost(question: str, answer: str, contexts: Sequence[str], metrics: Sequence[str]) -> Tuple[int, int]:
+    """1チャットを採点するときのLLM呼び出し回数とトークン数を見積もり"""
+    context_tokens = sum(estimate_tokens(context) for context in contexts)
+    base_tokens = estimate_tokens(question) + estimate_tokens(answer)
+    calls = 0
+    tokens = 0
+    for metric in metrics:
+        metric_calls = JUDGE_CALLS_PER_METRIC.get(metric, 1) or max(1, len(contexts))
+        calls += metric_calls
+        tokens += metric_calls * (JUDGE_PROMPT_OVERHEAD_TOKENS + base_tokens) + context_tokens
+    return calls, tokens
+
+
+def _bucket(values: np.ndarray, buckets: int) -> np.ndarray:
+    """分位点で値をバケットに分ける"""
+    if len(values) == 0:
+        return np.zeros(0, dtype=np.int64)
+    edges = np.unique(np.percentile(values, np.linspace(0, 100, buckets + 1)[1:-1]))
+    return np.searchsorted(edges, values, side='right')
+
+
+def build_strata(items: Sequence[Any]) -> List[Tuple]:
+    """ソースファイル・時間帯・回答の長さ・高速メトリクスの外れ値で層を作る"""
+    timestamps = np.array([item.timestamp.timestamp() for item in items], dtype=np.float64)
+    lengths = np.array([len(item.answer) for item in items], dtype=np.float64)
+    time_buckets = _bucket(timestamps, TIME_BUCKETS)
+    length_buckets = _bucket(lengths, LENGTH_BUCKETS)
+
+    # 高速メトリクスが低いチャットは問題がありそうなので、ちゃんと拾えるように別の層にする
+    outliers = np.zeros(len(items), dtype=bool)
+    for name in ('fast_relevancy', 'fast_grounding'):
+        values = np.array([np.nan if getattr(item, name, None) is None else getattr(item, name) for item in items], dtype=np.float64)
+        valid = ~np.isnan(values)
+        if valid.sum() >= 2:
+            outliers[valid] |= values[valid] <= np.percentile(values[valid], OUTLIER_QUANTILE)
+
+    return [
+        (min(item.source_files) if item.source_files else '不明', int(time_bucket), int(length_bucket), bool(outlier))
+        for item, time_bucket, length_bucket, outlier in zip(items, time_buckets, length_buckets, outliers)
+    ]
+
+
+def stratified_sample(
+    items: Sequence[Any],
+    costs: Sequence[Tuple[int, int]],
+    max_calls: Optional[int] = None,
+    max_tokens: Optional[int] = None,
+    seed: Optional[int] = None,
+) -> EvaluationSample:
+    """予算（LLM呼び出し回数・トークン数）に収まるように層別で比例配分してサンプリング
+
+    層ごとの件数を全体に比例させるので、採点済みの平均はそのまま全体の平均の推定になるよ。
+    小さい層や外れ値の層だけ多めに取ると推定が偏るから、最低件数や上乗せはしないよ。
+    """
+    if not items:
+        return EvaluationSample(items=[], population=0, strata=0)
+
+    rng = random.Random(seed)
+    strata = build_strata(items)
+    members: Dict[Tuple, List[int]] = {}
+    for index, key in enumerate(strata):
+        members.setdefault(key, []).append(index)
+    for indices in members.values():
+        rng.shuffle(indices)
+
+    # 平均コストから取れそうな件数を決める
+    calls = np.array([cost[0] for cost in costs], dtype=np.float64)
+    tokens = np.array([cost[1] for cost in costs], dtype=np.float64)
+    limits = [len(items)]
+    if max_calls is not None:
+        limits.append(int(max_calls // max(calls.mean(), 1)))
+    if max_tokens is not None:
+        limits.append(int(max_tokens // max(tokens.mean(), 1)))
+    target = max(0, min(limits))
+
+    # 最大剰余法で層ごとの件数を比例配分
+    quotas = {key: target * len(indices) / len(items) for key, indices in members.items()}
+    allocation = {key: int(quota) for key, quota in quotas.items()}
+    leftover = target - sum(allocation.values())
+    for key in sorted(quotas, key=lambda key: quotas[key] - int(quotas[key]), reverse=True)[:max(0, leftover)]:
+        allocation[key] += 1
+
+    # 層ごとの配分に対する進み具合の順に並べて、予算を超えたところで打ち切る（途中で切っても比例のまま）
+    chosen = [indices[:allocation[key]] for key, indices in members.items()]
+    order = [
+        index
+        for _, index in sorted(
+            ((position + 1) / len(indices), index)
+            for indices in chosen
+            for position, index in enumerate(indices)
+        )
+    ]
+
+    selected = []
+    used_calls = 0
+    used_tokens = 0
+    for index in order:
+        if max_calls is not None and used_calls + calls[index] > max_calls:
+            continue
+        if max_tokens is not None and used_tokens + tokens[index] > max_tokens:
+            continue
+        selected.append(index)
+        used_calls += int(calls[index])
+        used_tokens += int(tokens[index])
+
+    selected.sort()
+    final_allocation: Dict[Tuple, int] = {}
+    for index in selected:
+        final_allocation[strata[index]] = final_allocation.get(strata[index], 0) + 1
+
+    return EvaluationSample(
+        items=[items[index] for index in selected],
+        population=len(items),
+        strata=len(members),
+        estimated_calls=used_calls,
+        estimated_tokens=used_tokens,
+        allocation=final_allocation,
+    )
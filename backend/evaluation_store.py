@@ -0,0 +1,457 @@
+# backend/evaluation_store.py
+import atexit
+import json
+import os
+import sqlite3
+import threading
+from array import array
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from backend.evaluation_aggregates import MetricsAggregate
+from backend.fast_metrics import FAST_METRIC_NAMES
+from backend.upload import make_chunk_id
+
+DEFAULT_STORE_PATH = os.path.join(".cache", "evaluations.sqlite3")
+
+# 評価データを残す日数（0なら消さずにずっと残す）
+EVALUATION_RETENTION_DAYS = float(os.environ.get("EVALUATION_RETENTION_DAYS", 0))
+
+SCORE_COLUMNS = ['context_precision', 'context_recall', 'faithfulness', 'answer_relevancy', 'overall_score']
+
+# LLM採点のスコアと高速メトリクスを合わせた、評価テーブルのスコア列
+METRIC_COLUMNS = SCORE_COLUMNS + FAST_METRIC_NAMES
+
+RECORD_COLUMNS = "id, timestamp, session_id, workspace_id, question, answer, context_ids, context_scores, source_files"
+
+SORT_COLUMNS = {
+    'timestamp': 'timestamp',
+    'score': 'COALESCE(overall_score, 0)',
+}
+
+
+class EvaluationStore:
+    """評価データを追記型でSQLiteに永続化するストア
+
+    チャットごとの追加はバッファしてまとめて書き込み、読み出しの前に必ずフラッシュするよ。
+    参照した文脈はチャンクIDだけを持って、本文はchunksテーブルに1回だけ保存するよ。
+    ファイルはプロセスで共有するので、画面からはfor_workspace()で自分のワークスペースの行だけのビューを使ってね。
+    行はずっと残して、消すのは削除ボタンか保存期間（EVALUATION_RETENTION_DAYS、デフォルトはなし）を過ぎたときだけ。
+    """
+
+    def __init__(self, item_factory: Callable[..., Any] = dict, path: Optional[str] = None, batch_size: int = 32, retention_days: Optional[float] = None):
+        # 読み出した行から評価アイテムを作る関数（ChatEvaluationなど）
+        self.item_factory = item_factory
+        self.path = path or os.environ.get("EVALUATION_STORE_PATH", DEFAULT_STORE_PATH)
+        self.batch_size = batch_size
+        self.retention_days = EVALUATION_RETENTION_DAYS if retention_days is None else retention_days
+        self._buffer = []
+        self._chunk_buffer = {}
+        self._lock = threading.RLock()
+        self._connection = None
+        # スコアの集計はワークスペースごと（Noneは全体）にメモリ上で差分更新（他プロセスの書き込みを検知したら読み直す）
+        self._aggregates: Dict[Optional[str], MetricsAggregate] = {}
+        self._aggregate_versions: Dict[Optional[str], int] = {}
+        atexit.register(self.flush)
+
+    @property
+    def connection(self) -> sqlite3.Connection:
+        """接続を取得（初回だけテーブルを作る）"""
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS evaluations ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "timestamp REAL NOT NULL, session_id TEXT, workspace_id TEXT, "
+                "question TEXT NOT NULL, answer TEXT NOT NULL, "
+                "context_ids TEXT NOT NULL DEFAULT '[]', context_scores BLOB, source_files TEXT NOT NULL, "
+                "context_precision REAL, context_recall REAL, faithfulness REAL, "
+                "answer_relevancy REAL, overall_score REAL, "
+                f"{', '.join(f'{column} REAL' for column in FAST_METRIC_NAMES)})"
+            )
+            connection.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, text TEXT NOT NULL)")
+            self._migrate_inline_contexts(connection)
+            self._add_missing_columns(connection)
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_timestamp ON evaluations (timestamp)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_overall ON evaluations (overall_score)")
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_evaluations_workspace ON evaluations (workspace_id)")
+            if self.retention_days:
+                self._delete_older_than(connection, self.retention_days)
+            connection.commit()
+            self._connection = connection
+        return self._connection
+
+    def _delete_older_than(self, connection: sqlite3.Connection, days: float):
+        """保存期間を過ぎた行と、参照されなくなったチャンクの本文を削除"""
+        connection.execute(
+            "DELETE FROM evaluations WHERE timestamp < ?",
+            (datetime.now().timestamp() - days * 24 * 60 * 60,)
+        )
+        self._delete_orphan_chunks(connection)
+
+    def _delete_orphan_chunks(self, connection: sqlite3.Connection):
+        """どの評価データからも参照されていないチャンクの本文を削除"""
+        connection.execute(
+            "DELETE FROM chunks WHERE id NOT IN "
+            "(SELECT DISTINCT context.value FROM evaluations, json_each(evaluations.context_ids) AS context)"
+        )
+
+    def _migrate_inline_contexts(self, connection: sqlite3.Connection):
+        """文脈の本文を行ごとに持っていた古いテーブルをチャンクID参照に移行
+
+        ファイル・ページはもう分からないので、チャット時にIDのない文脈と同じく本文だけからIDを作る
+        """
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(evaluations)")}
+        if "contexts" not in columns:
+            return
+        if "context_ids" not in columns:
+            connection.execute("ALTER TABLE evaluations ADD COLUMN context_ids TEXT NOT NULL DEFAULT '[]'")
+            connection.execute("ALTER TABLE evaluations ADD COLUMN context_scores BLOB")
+        for row_id, contexts in connection.execute("SELECT id, contexts FROM evaluations").fetchall():
+            texts = {make_chunk_id(text): text for text in json.loads(contexts)}
+            connection.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?)", texts.items())
+            connection.execute("UPDATE evaluations SET context_ids = ? WHERE id = ?", (json.dumps(list(texts)), row_id))
+        connection.execute("ALTER TABLE evaluations DROP COLUMN contexts")
+
+    def _add_missing_columns(self, connection: sqlite3.Connection):
+        """後から増えた列を古いテーブルに追加"""
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(evaluations)")}
+        if "workspace_id" not in columns:
+            # それまでの行はセッションごとに消える前提だったので、どのワークスペースにも入れない
+            connection.execute("ALTER TABLE evaluations ADD COLUMN workspace_id TEXT")
+        for column in METRIC_COLUMNS:
+            if column not in columns:
+                connection.execute(f"ALTER TABLE evaluations ADD COLUMN {column} REAL")
+
+    def append(self, item, chunk_texts: Optional[Dict[str, str]] = None):
+        """評価アイテムを追加（バッファがたまったらまとめて書き込み）"""
+        with self._lock:
+            self._buffer.append(item)
+            self._chunk_buffer.update(chunk_texts or {})
+            if len(self._buffer) >= self.batch_size:
+                self.flush()
+
+    def append_many(self, items: List[Any], chunk_texts: Optional[Dict[str, str]] = None):
+        """評価アイテムをまとめて追加"""
+        with self._lock:
+            self._buffer.extend(items)
+            self._chunk_buffer.update(chunk_texts or {})
+            self.flush()
+
+    def flush(self):
+        """バッファ中のアイテムを1トランザクションで書き込んでIDを振る"""
+        with self._lock:
+            if not self._buffer and not self._chunk_buffer:
+                return
+            items, self._buffer = self._buffer, []
+            chunk_texts, self._chunk_buffer = self._chunk_buffer, {}
+            with self.connection:
+                # 同じチャンクの本文は何回参照されても1回だけ保存
+                self.connection.executemany("INSERT OR IGNORE INTO chunks VALUES (?, ?)", chunk_texts.items())
+                for item in items:
+                    cursor = self.connection.execute(
+                        "INSERT INTO evaluations (timestamp, session_id, workspace_id, question, answer, context_ids, context_scores, source_files, "
+                        f"{', '.join(METRIC_COLUMNS)}) VALUES ({', '.join('?' * (8 + len(METRIC_COLUMNS)))})",
+                        (
+                            item.timestamp.timestamp(), item.session_id, item.workspace_id, item.question, item.answer,
+                            json.dumps(item.context_ids),
+                            item.context_scores.tobytes(),
+                            json.dumps(item.source_files, ensure_ascii=False),
+                            *(getattr(item, column) for column in METRIC_COLUMNS)
+                        )
+                    )
+                    item.id = cursor.lastrowid
+            self._upsert_aggregates(items)
+
+    def get_chunk_texts(self, chunk_ids, workspace_id: Optional[str] = None) -> Dict[str, str]:
+        """チャンクIDから本文をまとめて引く（workspace_idを渡すとそのワークスペースの行が参照しているチャンクだけ）"""
+        chunk_ids = list(chunk_ids)
+        texts = {}
+        workspace_clause = ""
+        workspace_params = []
+        if workspace_id is not None:
+            workspace_clause = (
+                " AND id IN (SELECT context.value FROM evaluations, json_each(evaluations.context_ids) AS context"
+                " WHERE evaluations.workspace_id = ?)"
+            )
+            workspace_params = [workspace_id]
+        with self._lock:
+            self.flush()
+            for start in range(0, len(chunk_ids), 500):
+                chunk = chunk_ids[start:start + 500]
+                rows = self.connection.execute(
+                    f"SELECT id, text FROM chunks WHERE id IN ({','.join('?' * len(chunk))}){workspace_clause}", chunk + workspace_params
+                )
+                texts.update(rows)
+        return texts
+
+    def update_scores(self, items: List[Any], workspace_id: Optional[str] = None):
+        """評価アイテムのスコアをまとめて更新（workspace_idを渡すとそのワークスペースの行だけ）"""
+        if workspace_id is not None:
+            items = [item for item in items if item.workspace_id == workspace_id]
+        workspace_clause = "" if workspace_id is None else " AND workspace_id = ?"
+        with self._lock:
+            self.flush()
+            with self.connection:
+                self.connection.executemany(
+                    f"UPDATE evaluations SET {', '.join(f'{column} = ?' for column in METRIC_COLUMNS)} WHERE id = ?{workspace_clause}",
+                    [
+                        (*(getattr(item, column) for column in METRIC_COLUMNS), item.id, *([] if workspace_id is None else [workspace_id]))
+                        for item in items
+                    ]
+                )
+            self._upsert_aggregates(items)
+
+    def _upsert_aggregates(self, items: List[Any]):
+        """読み込み済みの集計（全体とワークスペースごと）に評価アイテムを反映"""
+        for workspace_id, aggregate in self._aggregates.items():
+            selected = items if workspace_id is None else [item for item in items if item.workspace_id == workspace_id]
+            if selected:
+                aggregate.upsert_many(*self._aggregate_rows(selected))
+
+    def _aggregate_rows(self, items: List[Any]) -> Tuple[List[int], List[float], List[List[Optional[float]]]]:
+        """評価アイテムを集計バッファ用の列に変換"""
+        return (
+            [item.id for item in items],
+            [item.timestamp.timestamp() for item in items],
+            [[getattr(item, column) for column in METRIC_COLUMNS] for item in items],
+        )
+
+    def _where(
+        self,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        min_score: Optional[float] = None,
+        max_score: Optional[float] = None,
+        evaluated_only: bool = False,
+        missing_metrics: Optional[List[str]] = None,
+        workspace_id: Optional[str] = None,
+    ) -> Tuple[str, List[Any]]:
+        """フィルター条件からWHERE句を組み立てる（workspace_idを渡すとそのワークスペースの行だけ）"""
+        clauses = []
+        params = []
+        if workspace_id is not None:
+            clauses.append("workspace_id = ?")
+            params.append(workspace_id)
+        if start is not None:
+            clauses.append("timestamp >= ?")
+            params.append(start.timestamp())
+        if end is not None:
+            clauses.append("timestamp < ?")
+            params.append(end.timestamp())
+        if min_score is not None:
+            clauses.append("overall_score >= ?")
+            params.append(min_score)
+        if max_score is not None:
+            clauses.append("overall_score <= ?")
+            params.append(max_score)
+        if evaluated_only:
+            clauses.append("overall_score IS NOT NULL")
+        if missing_metrics:
+            clauses.append("(" + " OR ".join(f"{metric} IS NULL" for metric in missing_metrics if metric in METRIC_COLUMNS) + ")")
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def _to_item(self, row: Tuple) -> Any:
+        """行を評価アイテムに変換"""
+        item_id, timestamp, session_id, workspace_id, question, answer, context_ids, context_scores, source_files, *scores = row
+        scores_array = array('f')
+        if context_scores:
+            scores_array.frombytes(context_scores)
+        return self.item_factory(**{
+            'id': item_id,
+            'timestamp': datetime.fromtimestamp(timestamp),
+            'session_id': session_id,
+            'workspace_id': workspace_id,
+            'question': question,
+            'answer': answer,
+            'context_ids': json.loads(context_ids),
+            'context_scores': scores_array,
+            'source_files': json.loads(source_files),
+            **dict(zip(METRIC_COLUMNS, scores)),
+        })
+
+    def scan(
+        self,
+        order_by: str = 'timestamp',
+        descending: bool = False,
+        limit: Optional[int] = None,
+        offset: int = 0,
+        **filters,
+    ) -> List[Any]:
+        """フィルター・並び順・ページ指定で評価データを読み出す"""
+        where, params = self._where(**filters)
+        query = (
+            f"SELECT {RECORD_COLUMNS}, {', '.join(METRIC_COLUMNS)} FROM evaluations{where} "
+            f"ORDER BY {SORT_COLUMNS[order_by]} {'DESC' if descending else 'ASC'}, id"
+        )
+        if limit is not None:
+            query += " LIMIT ? OFFSET ?"
+            params += [limit, offset]
+        with self._lock:
+            self.flush()
+            rows = self.connection.execute(query, params).fetchall()
+        return [self._to_item(row) for row in rows]
+
+    def iter_batches(self, batch_size: int = 1000, after_id: int = 0, **filters) -> Iterator[List[Any]]:
+        """ID順にバッチで読み出す（大きな履歴でもメモリを食わない）"""
+        where, params = self._where(**filters)
+        last_id = after_id
+        while True:
+            id_clause = ("AND" if where else "WHERE") + " id > ?"
+            with self._lock:
+                self.flush()
+                rows = self.connection.execute(
+                    f"SELECT {RECORD_COLUMNS}, {', '.join(METRIC_COLUMNS)} FROM evaluations{where} {id_clause} ORDER BY id LIMIT ?",
+                    params + [last_id, batch_size]
+                ).fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield [self._to_item(row) for row in rows]
+
+    def count(self, **filters) -> int:
+        """条件に合う件数を取得"""
+        where, params = self._where(**filters)
+        with self._lock:
+            self.flush()
+            return self.connection.execute(f"SELECT COUNT(*) FROM evaluations{where}", params).fetchone()[0]
+
+    @property
+    def aggregate(self) -> MetricsAggregate:
+        """最新の状態に揃えた全体のスコア集計を取得"""
+        return self.aggregate_for(None)
+
+    def aggregate_for(self, workspace_id: Optional[str] = None) -> MetricsAggregate:
+        """最新の状態に揃えたスコア集計を取得（workspace_idを渡すとそのワークスペースの行だけ）"""
+        with self._lock:
+            self.flush()
+            # data_versionは他の接続がコミットしたときだけ変わる
+            version = self.connection.execute("PRAGMA data_version").fetchone()[0]
+            aggregate = self._aggregates.get(workspace_id)
+            if aggregate is None or version != self._aggregate_versions.get(workspace_id):
+                where, params = self._where(workspace_id=workspace_id)
+                rows = self.connection.execute(
+                    f"SELECT id, timestamp, {', '.join(METRIC_COLUMNS)} FROM evaluations{where} ORDER BY id", params
+                ).fetchall()
+                aggregate = self._aggregates[workspace_id] = MetricsAggregate(METRIC_COLUMNS, max(1024, len(rows)))
+                if rows:
+                    ids, timestamps, *scores = zip(*rows)
+                    aggregate.upsert_many(ids, timestamps, list(zip(*scores)))
+                self._aggregate_versions[workspace_id] = version
+            return aggregate
+
+    def averages(self, workspace_id: Optional[str] = None) -> Dict[str, Any]:
+        """件数と各スコアの平均を取得（集計済みの累積和から計算）"""
+        with self._lock:
+            aggregate = self.aggregate_for(workspace_id)
+            return {'total': len(aggregate), 'evaluated': aggregate.count('overall_score'), **aggregate.averages()}
+
+    def confidence_intervals(self, z: float = 1.96, workspace_id: Optional[str] = None) -> Dict[str, Optional[Tuple[float, float]]]:
+        """スコア平均の信頼区間を取得"""
+        with self._lock:
+            return self.aggregate_for(workspace_id).confidence_intervals(z)
+
+    def quantiles(self, columns: Optional[List[str]] = None, workspace_id: Optional[str] = None) -> Dict[str, Dict[str, float]]:
+        """スコアの四分位数をメトリクスごとに取得"""
+        with self._lock:
+            return self.aggregate_for(workspace_id).quantiles(columns)
+
+    def time_series(self, max_points: int = 500, columns: Optional[List[str]] = None, workspace_id: Optional[str] = None):
+        """時間で間引いたスコアの時系列を取得"""
+        with self._lock:
+            return self.aggregate_for(workspace_id).time_series(max_points, columns)
+
+    def clear(self, workspace_id: Optional[str] = None):
+        """評価データを削除（workspace_idを渡すとそのワークスペースの行だけ。参照されなくなったチャンクの本文も消す）"""
+        with self._lock:
+            self.flush()
+            where, params = self._where(workspace_id=workspace_id)
+            with self.connection:
+                self.connection.execute(f"DELETE FROM evaluations{where}", params)
+                self._delete_orphan_chunks(self.connection)
+            if workspace_id is None:
+                self._aggregates.clear()
+            else:
+                # 全体の集計は次に使うときに読み直す
+                self._aggregates.pop(workspace_id, None)
+                self._aggregates.pop(None, None)
+
+    def purge_older_than(self, days: float):
+        """保存期間を過ぎた評価データを削除（自動で消すのはretention_daysを設定したときだけ）"""
+        with self._lock:
+            self.flush()
+            with self.connection:
+                self._delete_older_than(self.connection, days)
+            self._aggregates.clear()
+
+    def for_workspace(self, workspace_id: str) -> "WorkspaceEvaluationStore":
+        """1ワークスペースの行だけを読み書きするビューを取得"""
+        return WorkspaceEvaluationStore(self, workspace_id)
+
+
+class WorkspaceEvaluationStore:
+    """EvaluationStoreを1ワークスペースぶんに絞ったビュー
+
+    追加する行にはワークスペースIDをつけて、読み出し・件数・集計・エクスポート・削除は全部そのワークスペースの行だけにするよ。
+    """
+
+    def __init__(self, store: EvaluationStore, workspace_id: str):
+        self.store = store
+        self.workspace_id = workspace_id
+
+    @property
+    def item_factory(self) -> Callable[..., Any]:
+        return self.store.item_factory
+
+    def append(self, item, chunk_texts: Optional[Dict[str, str]] = None):
+        """評価アイテムをこのワークスペースの行として追加"""
+        item.workspace_id = self.workspace_id
+        self.store.append(item, chunk_texts)
+
+    def append_many(self, items: List[Any], chunk_texts: Optional[Dict[str, str]] = None):
+        """評価アイテムをこのワークスペースの行としてまとめて追加"""
+        for item in items:
+            item.workspace_id = self.workspace_id
+        self.store.append_many(items, chunk_texts)
+
+    def flush(self):
+        self.store.flush()
+
+    def get_chunk_texts(self, chunk_ids) -> Dict[str, str]:
+        return self.store.get_chunk_texts(chunk_ids, workspace_id=self.workspace_id)
+
+    def update_scores(self, items: List[Any]):
+        self.store.update_scores(items, workspace_id=self.workspace_id)
+
+    def scan(self, **options) -> List[Any]:
+        return self.store.scan(workspace_id=self.workspace_id, **options)
+
+    def iter_batches(self, batch_size: int = 1000, after_id: int = 0, **filters) -> Iterator[List[Any]]:
+        return self.store.iter_batches(batch_size, after_id, workspace_id=self.workspace_id, **filters)
+
+    def count(self, **filters) -> int:
+        return self.store.count(workspace_id=self.workspace_id, **filters)
+
+    @property
+    def aggregate(self) -> MetricsAggregate:
+        return self.store.aggregate_for(self.workspace_id)
+
+    def averages(self) -> Dict[str, Any]:
+        return self.store.averages(workspace_id=self.workspace_id)
+
+    def confidence_intervals(self, z: float = 1.96) -> Dict[str, Optional[Tuple[float, float]]]:
+        return self.store.confidence_intervals(z, workspace_id=self.workspace_id)
+
+    def quantiles(self, columns: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+        return self.store.quantiles(columns, workspace_id=self.workspace_id)
+
+    def time_series(self, max_points: int = 500, columns: Optional[List[str]] = None):
+        return self.store.time_series(max_points, columns, workspace_id=self.workspace_id)
+
+    def clear(self):
+        """このワークスペースの評価データだけを削除"""
+        self.store.clear(self.workspace_id)
@@ -0,0 +1,163 @@
+# backend/evaluation_worker.py
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from backend.evaluation import evaluation_service
+from config_manager import config_manager
+
+if TYPE_CHECKING:
+    from ragas import RunConfig
+
+# バックグラウンド評価で1回に評価してストアに書き戻す件数
+BACKGROUND_CHUNK_SIZE = 50
+
+
+@dataclass
+class EvaluationJob:
+    """バックグラウンド評価ジョブの状態"""
+    job_id: str
+    metrics: List[str]
+    status: str = "queued"  # queued / running / done / failed / cancelled
+    total: int = 0
+    done: int = 0
+    message: str = ""
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    cancel_event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def progress(self) -> float:
+        """進捗率 (0〜1)"""
+        if self.status == "done":
+            return 1.0
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def is_active(self) -> bool:
+        """実行待ち・実行中かどうか"""
+        return self.status in ("queued", "running")
+
+
+class EvaluationWorker:
+    """評価ジョブをスレッドで実行して、終わったチャンクから順にスコアを書き込むワーカー
+
+    RAGASのメトリクスはプロセス共通のオブジェクトなので、ジョブは1本ずつ順番に実行するよ。
+    """
+
+    def __init__(self, max_jobs: int = 100):
+        self.max_jobs = max_jobs
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="evaluation-worker")
+        self._jobs: Dict[str, EvaluationJob] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, selected_metrics: List[str], run_config: Optional["RunConfig"] = None, force: bool = False, max_calls: Optional[int] = None, max_tokens: Optional[int] = None, config=None, usage=None, service=None) -> EvaluationJob:
+        """評価ジョブを登録（モデルは登録時点の設定を使う）
+
+        max_calls / max_tokens を渡すと、予算内の層別サンプルだけを評価する
+        config を渡すとそのセッションのモデルで評価する（省略時はグローバル設定）
+        usage を渡すと採点のトークンをそのセッションの使用量に記録し、予算を使い切ったら止める
+        service を渡すとそのセッションの評価サービスのストア（そのセッションの行だけ）を採点する
+        """
+        config = config or config_manager
+        service = service or evaluation_service
+        llm = config.get_llm()
+        embedding = config.get_embedding()
+        if not llm or not embedding:
+            raise ValueError("LLM or Embedding is not configured")
+
+        job = EvaluationJob(job_id=str(uuid.uuid4()), metrics=list(selected_metrics))
+        with self._lock:
+            self._jobs[job.job_id] = job
+            self._prune_jobs()
+        self._executor.submit(self._run, job, service, run_config, force, llm, embedding, max_calls, max_tokens, usage)
+        return job
+
+    def get_job(self, job_id: Optional[str]) -> Optional[EvaluationJob]:
+        """ジョブの状態を取得"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str):
+        """ジョブを止める（実行中のチャンクが終わったところで止まる）"""
+        job = self.get_job(job_id)
+        if job and job.is_active:
+            job.cancel_event.set()
+
+    def _prune_jobs(self):
+        """終わった古いジョブを忘れる"""
+        finished = [job for job in self._jobs.values() if not job.is_active]
+        for job in sorted(finished, key=lambda job: job.submitted_at)[:max(0, len(self._jobs) - self.max_jobs)]:
+            del self._jobs[job.job_id]
+
+    def _iter_pending(self, store, missing_metrics: Optional[List[str]]):
+        """未採点のチャットをチャンクごとに読み出す"""
+        last_id = 0
+        while True:
+            # 書き戻したチャンクは未採点でなくなるので、ID順に次のチャンクを読む
+            items = next(store.iter_batches(BACKGROUND_CHUNK_SIZE, missing_metrics=missing_metrics, after_id=last_id), [])
+            if not items:
+                return
+            last_id = items[-1].id
+            yield items
+
+    def _run(self, job: EvaluationJob, service, run_config, force, llm, embedding, max_calls=None, max_tokens=None, usage=None):
+        """ジョブ本体（チャンクごとに評価してストアに書き戻す）"""
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+            job.finished_at = time.time()
+            return
+
+        job.status = "running"
+        missing_metrics = None if force else job.metrics
+
+        try:
+            if max_calls is not None or max_tokens is not None:
+                job.message = "予算に合わせてサンプリング中..."
+                sample = service.sample_for_evaluation(job.metrics, max_calls, max_tokens, force)
+                job.total = len(sample.items)
+                chunks = (
+                    sample.items[start:start + BACKGROUND_CHUNK_SIZE]
+                    for start in range(0, len(sample.items), BACKGROUND_CHUNK_SIZE)
+                )
+            else:
+                job.total = service.store.count(missing_metrics=missing_metrics)
+                chunks = self._iter_pending(service.store, missing_metrics)
+
+            budget_exceeded = False
+            for items in chunks:
+                if job.cancel_event.is_set():
+                    break
+                if usage is not None and usage.status("evaluation") == "exceeded":
+                    budget_exceeded = True
+                    break
+
+                def progress_callback(message, offset=job.done):
+                    job.message = f"{offset + len(items)}/{job.total}件目まで: {message}"
+
+                service.evaluate_items(
+                    items, job.metrics, progress_callback, run_config, force, llm, embedding, usage
+                )
+                job.done += len(items)
+
+            job.status = "cancelled" if job.cancel_event.is_set() else "done"
+            job.message = f"{job.done}/{job.total}件の評価が終わったよ"
+            if budget_exceeded:
+                job.message += "（トークン予算を使い切ったのでここで止めたよ💸）"
+
+        except Exception as e:
+            traceback.print_exc()
+            job.status = "failed"
+            job.error = str(e)
+
+        finally:
+            job.finished_at = time.time()
+
+
+# グローバルインスタンス
+evaluation_worker = EvaluationWorker()
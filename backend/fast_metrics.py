@@ -0,0 +1,76 @@
+# backend/fast_metrics.py
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# LLMを呼ばずに埋め込みと検索スコアだけで計算する高速メトリクス
+FAST_METRIC_NAMES = ['fast_relevancy', 'fast_grounding', 'retrieval_top_score', 'retrieval_score_spread']
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    """行ごとに長さ1に正規化（ゼロベクトルはそのまま）"""
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1.0, norms)
+
+
+def compute_fast_metrics(
+    question_vectors,
+    answer_vectors,
+    context_vectors: Sequence,
+    retrieval_scores: Sequence[Sequence[float]],
+) -> Dict[str, np.ndarray]:
+    """チャットのまとまりに対して高速メトリクスをまとめて計算
+
+    - fast_relevancy: 質問と回答のコサイン類似度
+    - fast_grounding: 回答と一番近い文脈チャンクのコサイン類似度
+    - retrieval_top_score: 検索で一番高かった類似度
+    - retrieval_score_spread: 検索結果の類似度の最大と最小の差
+    文脈や検索スコアがないチャットはNaNになるよ。
+    """
+    questions = normalize_rows(question_vectors)
+    answers = normalize_rows(answer_vectors)
+    count = len(answers)
+
+    relevancy = np.einsum('ij,ij->i', questions, answers)
+
+    # 文脈はチャットごとに本数が違うので、全部つなげてからチャットごとに最大を取る
+    grounding = np.full(count, np.nan, dtype=np.float32)
+    lengths = np.array([len(vectors) for vectors in context_vectors], dtype=np.int64)
+    if lengths.sum():
+        contexts = normalize_rows(np.concatenate([vectors for vectors in context_vectors if len(vectors)]))
+        owners = np.repeat(np.arange(count), lengths)
+        similarities = np.einsum('ij,ij->i', contexts, answers[owners])
+        has_contexts = lengths > 0
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])[has_contexts]
+        grounding[has_contexts] = np.maximum.reduceat(similarities, starts)
+
+    top_scores = np.full(count, np.nan, dtype=np.float32)
+    spreads = np.full(count, np.nan, dtype=np.float32)
+    for index, scores in enumerate(retrieval_scores):
+        scores = np.asarray(scores, dtype=np.float32)
+        scores = scores[~np.isnan(scores)]
+        if len(scores):
+            top_scores[index] = scores.max()
+            spreads[index] = scores.max() - scores.min()
+
+    return {
+        'fast_relevancy': relevancy,
+        'fast_grounding': grounding,
+        'retrieval_top_score': top_scores,
+        'retrieval_score_spread': spreads,
+    }
+
+
+def metrics_for_row(metrics: Dict[str, np.ndarray], index: int) -> Dict[str, float]:
+    """まとめて計算した結果から1チャット分を取り出す（NaNはNone）"""
+    row = {}
+    for name in FAST_METRIC_NAMES:
+        value = float(metrics[name][index])
+        row[name] = None if np.isnan(value) else value
+    return row
+
+
+def unique_texts(texts_per_item: List[List[str]]) -> List[str]:
+    """埋め込みを1回で済ませるために重複を除いたテキストの一覧を作る"""
+    return list(dict.fromkeys(text for texts in texts_per_item for text in texts))
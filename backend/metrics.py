@@ -0,0 +1,242 @@
+# backend/metrics.py
+import math
+import os
+import threading
+import weakref
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# メトリクスを出すポート（METRICS_PORT環境変数。空ならサーバーを立てない）
+METRICS_PORT_ENV = "METRICS_PORT"
+
+# レイテンシのヒストグラムの境界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+INGEST_BUCKETS = (0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+CHUNK_COUNT_BUCKETS = (1, 2, 3, 4, 5, 6, 8, 10, 12, 15, 20)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    """ラベル値のエスケープ（Prometheusテキスト形式）"""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    """ラベルを {a="x",b="y"} の形にする"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{_escape(extra[1])}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    """ラベルごとに値を持つメトリクスの共通部分"""
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def collect(self) -> List[str]:
+        """テキスト形式の行（HELP・TYPEつき）"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(key, value))
+        return lines
+
+    def _samples(self, key, value) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"]
+
+
+class Counter(_Metric):
+    """増えるだけのカウンター"""
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        if amount < 0:
+            raise ValueError("Counter can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    """いまの値（関数を渡すとスクレイプのたびに呼んで値を取る）"""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def collect(self) -> List[str]:
+        if self.function is not None:
+            try:
+                self.set(self.function())
+            except Exception as e:
+                print(f"❌ Gauge {self.name} error: {str(e)}")
+        return super().collect()
+
+
+class Histogram(_Metric):
+    """累積バケットつきのヒストグラム"""
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][index] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def _samples(self, key, state) -> List[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, ("le", _format_value(bound)))
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{labels} {state['count']}")
+        return lines
+
+
+class MetricsRegistry:
+    """メトリクスをまとめてPrometheusのテキスト形式で出す"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = (), function: Optional[Callable[[], float]] = None) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """全メトリクスをテキスト形式で出力"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+# セッションごとのDocumentProcessor（セッションが終われば消える）
+_sessions = weakref.WeakSet()
+
+
+def track_session(processor):
+    """セッションのDocumentProcessorを登録（セッション数とベクトルのメモリを出すため）"""
+    _sessions.add(processor)
+
+
+def _live_sessions() -> List:
+    # WeakSetは回している途中で消えると壊れるので先にリストにする
+    return list(_sessions)
+
+
+# グローバルインスタンス
+registry = MetricsRegistry()
+
+CHAT_LATENCY = registry.histogram("chatgal_chat_latency_seconds", "Chat turn latency", ["mode", "status"])
+SEARCH_LATENCY = registry.histogram("chatgal_search_latency_seconds", "Vector search latency including query embedding")
+CONTEXT_CHUNKS = registry.histogram("chatgal_context_chunks", "Chunks returned per search after the top-k cutoff", ["mode"], buckets=CHUNK_COUNT_BUCKETS)
+INGEST_LATENCY = registry.histogram("chatgal_ingest_latency_seconds", "PDF split and indexing latency per upload", buckets=INGEST_BUCKETS)
+LLM_TOKENS = registry.counter("chatgal_llm_tokens_total", "Chat model tokens from response usage metadata", ["type"])
+EMBEDDING_CALLS = registry.counter("chatgal_embedding_calls_total", "Embedding API calls", ["phase"])
+EMBEDDING_TOKENS = registry.counter("chatgal_embedding_tokens_total", "Estimated embedding input tokens", ["phase"])
+RATE_LIMITS = registry.counter("chatgal_rate_limit_errors_total", "429 responses from model endpoints", ["operation"])
+RETRIES = registry.counter("chatgal_retries_total", "Retried model calls", ["operation"])
+INGESTED_CHUNKS = registry.counter("chatgal_ingested_chunks_total", "Chunks added to vector stores")
+SESSIONS = registry.gauge("chatgal_sessions", "Live Streamlit sessions", function=lambda: len(_live_sessions()))
+VECTORSTORE_BYTES = registry.gauge(
+    "chatgal_vectorstore_bytes", "Vector payload bytes held by all sessions",
+    function=lambda: sum(processor.vectorstore_bytes() for processor in _live_sessions())
+)
+CHUNK_STORE_BYTES = registry.gauge(
+    "chatgal_chunk_store_bytes", "Chunk text and metadata column bytes held by all sessions",
+    function=lambda: sum(processor.chunk_store_bytes() for processor in _live_sessions())
+)
+VECTORSTORE_CHUNKS = registry.gauge(
+    "chatgal_vectorstore_chunks", "Chunks held by all sessions",
+    function=lambda: sum(processor.vectorstore_size() for processor in _live_sessions())
+)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # スクレイプのたびにログが出ないようにする
+        pass
+
+
+_server: Optional[ThreadingHTTPServer] = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = "0.0.0.0") -> Optional[ThreadingHTTPServer]:
+    """/metrics を返すHTTPサーバーを別スレッドで起動（プロセスで1回だけ。ポート未指定なら起動しない）"""
+    global _server
+    if port is None:
+        port = int(os.environ[METRICS_PORT_ENV]) if os.environ.get(METRICS_PORT_ENV) else None
+    if port is None:
+        return None
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, name="metrics-server", daemon=True).start()
+        return _server
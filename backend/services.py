@@ -0,0 +1,74 @@
+# backend/services.py
+import os
+import uuid
+
+import streamlit as st
+
+from config_manager import ConfigManager
+from backend.evaluation_capture import EvaluationCapture, evaluation_store
+from backend.metrics import track_session
+from backend.upload import DocumentProcessor
+from backend.usage import UsageLedger
+
+# 評価データのワークスペースを載せるURLパラメーター名
+WORKSPACE_QUERY_PARAM = "workspace"
+# 全員で1つのワークスペースを使うときの固定ID（空ならURLのパラメーターで分ける）
+WORKSPACE_ENV = "EVALUATION_WORKSPACE"
+
+
+def resolve_workspace_id() -> str:
+    """評価データのワークスペースID（環境変数 > URLの?workspace= > 新しく作る）"""
+    workspace_id = os.environ.get(WORKSPACE_ENV, "").strip() or st.query_params.get(WORKSPACE_QUERY_PARAM, "")
+    return workspace_id or uuid.uuid4().hex
+
+
+class ServiceContainer:
+    """1セッションぶんのサービス一式（モデル設定・トークン使用量・ドキュメント処理・チャット・評価）
+
+    セッション状態に1回だけ作ってしまっておくので、ユーザー同士で設定や検索対象が混ざらないし、
+    再実行のたびに作り直すこともないよ。
+    評価データはセッションではなくワークスペースの持ち物なので、リロードしても同じURLなら続きが見られる。
+    """
+
+    def __init__(self):
+        self.config = ConfigManager()
+        self.usage = UsageLedger()
+        self.document_processor = DocumentProcessor(self.config, usage=self.usage)
+        self.workspace_id = resolve_workspace_id()
+        track_session(self.document_processor)
+        self._chat_service = None
+        self._evaluation_service = None
+
+    @property
+    def chat_service(self):
+        """このセッションのチャットサービス"""
+        if self._chat_service is None:
+            from backend.chat import ChatService
+            # 評価データはこのワークスペースの行として保存する
+            capture = EvaluationCapture(self.config, store=evaluation_store.for_workspace(self.workspace_id), usage=self.usage)
+            self._chat_service = ChatService(self.document_processor, self.config, evaluation_service=capture, usage=self.usage)
+        return self._chat_service
+
+    @property
+    def evaluation_service(self):
+        """このセッションのモデルで採点する評価サービス（ストアはこのワークスペースの行だけのビュー、キャッシュはプロセスで共有）
+
+        ragas・pandasは重いので、最初に使うときに読み込む
+        """
+        if self._evaluation_service is None:
+            from backend.evaluation import evaluation_service_for
+            self._evaluation_service = evaluation_service_for(self.config, self.usage, self.workspace_id)
+        return self._evaluation_service
+
+
+def get_services() -> ServiceContainer:
+    """このセッションのサービス一式を取得（初回だけ作ってセッション状態にしまう）"""
+    if 'services' not in st.session_state:
+        st.session_state.services = ServiceContainer()
+    services = st.session_state.services
+    # ページを移ってもURLにワークスペースを残す（リロード・ブックマークで同じ履歴を開ける）
+    if not os.environ.get(WORKSPACE_ENV, "").strip() and st.query_params.get(WORKSPACE_QUERY_PARAM) != services.workspace_id:
+        st.query_params[WORKSPACE_QUERY_PARAM] = services.workspace_id
+    # タイムアウトは再実行ごとに確認する
+    services.document_processor._check_session_timeout()
+    return services
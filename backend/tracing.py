@@ -0,0 +1,171 @@
+# backend/tracing.py
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+# 1ターンごとのトレースを追記するJSONLファイル（空ならファイルには書かない）
+TRACE_PATH_ENV = "CHAT_TRACE_PATH"
+
+
+@dataclass
+class Span:
+    """処理1区間の時間と属性"""
+    name: str
+    depth: int
+    start_ms: float
+    duration_ms: float = 0.0
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **attributes):
+        """属性（トークン数や件数など）を追加"""
+        self.attributes.update(attributes)
+
+
+@dataclass
+class Trace:
+    """チャット1ターンぶんのスパンの集まり"""
+    name: str
+    trace_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    started_at: datetime = field(default_factory=datetime.now)
+    duration_ms: float = 0.0
+    spans: List[Span] = field(default_factory=list)
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    _origin: float = field(default_factory=time.perf_counter, repr=False)
+
+    def set(self, **attributes):
+        """トレース全体の属性を追加"""
+        self.attributes.update(attributes)
+
+    def breakdown(self) -> Dict[str, float]:
+        """スパン名ごとの合計時間（ms）"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.name] = totals.get(span.name, 0.0) + span.duration_ms
+        return totals
+
+    def token_usage(self) -> Dict[str, int]:
+        """スパンに記録したトークン数の合計"""
+        usage: Dict[str, int] = {}
+        for span in self.spans:
+            for key in ("input_tokens", "output_tokens", "total_tokens", "embedding_tokens"):
+                if isinstance(span.attributes.get(key), int):
+                    usage[key] = usage.get(key, 0) + span.attributes[key]
+        return usage
+
+    def to_dict(self) -> Dict[str, Any]:
+        """JSONに書ける形に変換"""
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": self.started_at.isoformat(timespec="milliseconds"),
+            "duration_ms": round(self.duration_ms, 3),
+            "attributes": self.attributes,
+            "tokens": self.token_usage(),
+            "spans": [
+                {
+                    "name": span.name,
+                    "depth": span.depth,
+                    "start_ms": round(span.start_ms, 3),
+                    "duration_ms": round(span.duration_ms, 3),
+                    "attributes": span.attributes,
+                }
+                for span in self.spans
+            ],
+        }
+
+
+class JsonlTraceSink:
+    """トレースを1行1ターンでJSONLに追記する（スレッドセーフ）"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def write(self, trace: Trace):
+        """トレースを追記"""
+        line = json.dumps(trace.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("chat_trace", default=None)
+_current_depth: contextvars.ContextVar[int] = contextvars.ContextVar("chat_span_depth", default=0)
+_sinks: List[JsonlTraceSink] = []
+
+if os.environ.get(TRACE_PATH_ENV):
+    _sinks.append(JsonlTraceSink(os.environ[TRACE_PATH_ENV]))
+
+
+def add_sink(sink):
+    """トレースの書き出し先を追加（writeメソッドを持つオブジェクト）"""
+    _sinks.append(sink)
+
+
+def current_trace() -> Optional[Trace]:
+    """いま記録中のトレース（なければNone）"""
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str, **attributes) -> Iterator[Trace]:
+    """1ターンのトレースを開始（すでに記録中ならそのトレースにスパンとして入れる）"""
+    parent = _current_trace.get()
+    if parent is not None:
+        with span(name, **attributes):
+            yield parent
+        return
+
+    trace = Trace(name=name, attributes=dict(attributes))
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        trace.duration_ms = (time.perf_counter() - trace._origin) * 1000
+        _current_trace.reset(token)
+        for sink in _sinks:
+            try:
+                sink.write(trace)
+            except Exception as e:
+                print(f"❌ Trace sink error: {str(e)}")
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[Optional[Span]]:
+    """処理区間の時間を記録（トレース中でなければ何もしない）"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    depth = _current_depth.get()
+    started = time.perf_counter()
+    record = Span(name=name, depth=depth, start_ms=(started - trace._origin) * 1000, attributes=dict(attributes))
+    # 開始順に並ぶように先に追加しておく
+    trace.spans.append(record)
+    token = _current_depth.set(depth + 1)
+    try:
+        yield record
+    except Exception as e:
+        record.set(error=type(e).__name__)
+        raise
+    finally:
+        _current_depth.reset(token)
+        record.duration_ms = (time.perf_counter() - started) * 1000
+
+
+def record_llm_usage(record: Optional[Span], response):
+    """LLMの応答のusage_metadataからトークン数をスパンに記録"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    if record is not None and usage:
+        record.set(**{key: usage[key] for key in ("input_tokens", "output_tokens", "total_tokens") if key in usage})
@@ -1,20 +1,208 @@
 # upload.py
+import abc
+import hashlib
+import importlib.util
+import logging
 import time
 import tempfile
 import os
 import uuid
 import streamlit as st
-from typing import List, Optional
+from typing import Any, Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
-from langchain_community.document_loaders import PyPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_core.vectorstores import InMemoryVectorStore
-from langchain.schema import Document
+from langchain_core.documents import Document
 
+from backend.metrics import CONTEXT_CHUNKS, EMBEDDING_CALLS, EMBEDDING_TOKENS, INGEST_LATENCY, INGESTED_CHUNKS, RATE_LIMITS, RETRIES, SEARCH_LATENCY
+from backend.tracing import span
+from backend.usage import TokenBudgetExceeded
 from config_manager import config_manager
 
+logger = logging.getLogger(__name__)
+
+# チャンク分割の設定（ベンチマークで変えて比べられるように引数でも渡せる）
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# PDF読み取りのバックエンド（PDF_EXTRACTOR環境変数。autoならファイルサイズで選ぶ）
+DEFAULT_PDF_EXTRACTOR = os.environ.get("PDF_EXTRACTOR", "auto")
+# autoのときにこのサイズ以上のPDFは速いバックエンドで読む
+PDF_LARGE_FILE_BYTES = int(os.environ.get("PDF_LARGE_FILE_MB", 5)) * 1024 * 1024
+
+class PdfExtractor(abc.ABC):
+    """PDFからページごとのテキストを取り出すバックエンドの共通部分
+
+    ページごとに PyPDFLoader と同じメタデータ（source / page / page_label / total_pages）の
+    Documentを返すので、後ろの分割やチャンクIDはどのバックエンドでも同じように動くよ。
+    """
+    name = ""
+    label = ""
+    # 必要なモジュール（入っていなければ選べない）
+    requires: Tuple[str, ...] = ()
+    
+    @classmethod
+    def is_available(cls) -> bool:
+        return all(importlib.util.find_spec(module) is not None for module in cls.requires)
+    
+    @abc.abstractmethod
+    def extract_pages(self, file_path: str) -> List[Tuple[str, str]]:
+        """(ページラベル, テキスト) のリスト"""
+    
+    def load(self, file_path: str) -> List[Document]:
+        pages = self.extract_pages(file_path)
+        return [
+            Document(
+                # PyPDFLoaderと同じく前後の空白を落とす（チャンクIDが読み取り方で変わらないように）
+                page_content=text.strip(),
+                metadata={
+                    'source': file_path,
+                    'page': index,
+                    'page_label': page_label,
+                    'total_pages': len(pages),
+                    'extractor': self.name,
+                }
+            )
+            for index, (page_label, text) in enumerate(pages)
+        ]
+
+class PypdfExtractor(PdfExtractor):
+    """pypdfでページごとに読む（PyPDFLoaderと同じ抽出。langchain_communityは読み込まない）"""
+    name = "pypdf"
+    label = "pypdf（標準）"
+    requires = ("pypdf",)
+    
+    def extract_pages(self, file_path: str) -> List[Tuple[str, str]]:
+        from pypdf import PdfReader
+        
+        reader = PdfReader(file_path)
+        labels = reader.page_labels
+        return [
+            (labels[index] if index < len(labels) else str(index + 1), page.extract_text(extraction_mode="plain"))
+            for index, page in enumerate(reader.pages)
+        ]
+
+class PdfminerExtractor(PdfExtractor):
+    """pdfminer.sixのレイアウト解析で読む（遅いけど段組みや縦横の混ざった文書に強い）"""
+    name = "pdfminer"
+    label = "pdfminer（レイアウト重視）"
+    requires = ("pdfminer",)
+    
+    def extract_pages(self, file_path: str) -> List[Tuple[str, str]]:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+        
+        return [
+            (str(index + 1), "".join(element.get_text() for element in page if isinstance(element, LTTextContainer)))
+            for index, page in enumerate(extract_pages(file_path))
+        ]
+
+class PdfiumExtractor(PdfExtractor):
+    """pypdfium2（PDFiumのバインディング）で読む（大きいPDFでいちばん速い）"""
+    name = "pypdfium2"
+    label = "pypdfium2（高速）"
+    requires = ("pypdfium2",)
+    
+    def extract_pages(self, file_path: str) -> List[Tuple[str, str]]:
+        import pypdfium2 as pdfium
+        
+        pdf = pdfium.PdfDocument(file_path)
+        try:
+            pages = []
+            for index in range(len(pdf)):
+                page = pdf[index]
+                textpage = page.get_textpage()
+                try:
+                    pages.append((pdf.get_page_label(index) or str(index + 1), textpage.get_text_bounded()))
+                finally:
+                    textpage.close()
+                    page.close()
+            return pages
+        finally:
+            pdf.close()
+
+PDF_EXTRACTORS: Dict[str, type] = {
+    extractor.name: extractor for extractor in (PypdfExtractor, PdfminerExtractor, PdfiumExtractor)
+}
+
+def available_pdf_extractors() -> List[str]:
+    """いまの環境で使えるバックエンド名"""
+    return [name for name, extractor in PDF_EXTRACTORS.items() if extractor.is_available()]
+
+def select_pdf_extractor(file_size: int, name: Optional[str] = None) -> PdfExtractor:
+    """バックエンドを選ぶ（autoなら大きいPDFだけ速いバックエンド、なければpypdf）"""
+    name = name or DEFAULT_PDF_EXTRACTOR
+    if name == "auto":
+        name = "pypdf"
+        if file_size >= PDF_LARGE_FILE_BYTES and PdfiumExtractor.is_available():
+            name = PdfiumExtractor.name
+    if name not in PDF_EXTRACTORS:
+        raise ValueError(f"Unknown PDF extractor: {name}")
+    extractor = PDF_EXTRACTORS[name]
+    if not extractor.is_available():
+        raise ImportError(
+            f"PDF extractor `{name}` requires {', '.join(extractor.requires)}. "
+            f"Install it with `pip install {'pdfminer.six' if name == 'pdfminer' else name}`."
+        )
+    return extractor()
+
+# 検索結果数の決め方（fixed: スライダーのkそのまま / threshold: 類似度のしきい値以上 / gap: スコアがいちばん大きく落ちるところまで）
+K_MODES = ("fixed", "threshold", "gap")
+DEFAULT_K_MODE = os.environ.get("RETRIEVAL_K_MODE", "fixed")
+# 可変のときでも最低これだけは文脈に入れる
+DEFAULT_MIN_K = int(os.environ.get("RETRIEVAL_MIN_K", 2))
+# thresholdのときの類似度のしきい値（埋め込みモデルで分布が違うので要調整）
+DEFAULT_SCORE_THRESHOLD = float(os.environ.get("RETRIEVAL_SCORE_THRESHOLD", 0.75))
+
+def select_adaptive_k(scores: List[float], mode: str = "fixed", min_k: int = DEFAULT_MIN_K, threshold: float = DEFAULT_SCORE_THRESHOLD) -> int:
+    """スコアの高い順に並んだ検索結果のうち、文脈に入れる件数を決める（min_k〜len(scores)の範囲）"""
+    max_k = len(scores)
+    if not max_k:
+        return 0
+    min_k = max(1, min(min_k, max_k))
+    if mode == "threshold":
+        k = sum(1 for score in scores if score >= threshold)
+    elif mode == "gap":
+        # min_k件目以降で、次の結果とのスコアの差がいちばん大きいところで切る
+        gaps = [scores[i] - scores[i + 1] for i in range(min_k - 1, max_k - 1)]
+        k = min_k + gaps.index(max(gaps)) if gaps else max_k
+    else:
+        k = max_k
+    return max(min_k, min(k, max_k))
+
+def select_adaptive_docs(docs: List[Document], mode: str = "fixed", min_k: int = DEFAULT_MIN_K, threshold: float = DEFAULT_SCORE_THRESHOLD) -> List[Document]:
+    """検索結果から文脈に入れるものを選ぶ（並び順はそのまま）
+
+    thresholdは類似度（metadataのscore）がしきい値以上のものだけを残して、min_kに足りなければ上から足す。
+    言い換え検索ではRRFの順に並んでいて類似度の順とは限らないので、先頭から何件という切り方はしない。
+    gapは並び順を決めたスコア（言い換え検索ならRRFスコア）の段差で切る。
+    """
+    if not docs or mode not in ("threshold", "gap"):
+        return docs
+    if mode == "gap":
+        scores = [doc.metadata.get('rrf_score', doc.metadata['score']) for doc in docs]
+        return docs[:select_adaptive_k(scores, mode, min_k, threshold)]
+    min_k = max(1, min(min_k, len(docs)))
+    chosen = {index for index, doc in enumerate(docs) if doc.metadata['score'] >= threshold}
+    for index in range(len(docs)):
+        if len(chosen) >= min_k:
+            break
+        chosen.add(index)
+    return [doc for index, doc in enumerate(docs) if index in chosen]
+
+def make_chunk_id(content: str, source_file: str = "", page: Any = "") -> str:
+    """チャンクの安定IDを作成（同じファイル・ページ・本文なら何度取り込んでも同じID）"""
+    payload = f"{source_file}\x00{page}\x00{content}"
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()[:16]
+
 class DocumentProcessor:
-    def __init__(self):
+    def __init__(self, config=None, usage=None):
+        # このセッションのモデル設定（省略時はCLI・ベンチマーク用のグローバル設定）
+        self.config = config or config_manager
+        # このセッションのトークン使用量（UsageLedger。Noneなら記録も予算チェックもしない）
+        self.usage = usage
+        # このセッションのベクトルストアとリトリーバー（サービス一式と一緒にセッションに1つ。メトリクスのスレッドからも読める）
+        self.vectorstore = None
+        self.retriever = None
+        
         # セッションIDを生成（より確実な分離のため）
         if 'session_id' not in st.session_state:
             st.session_state.session_id = str(uuid.uuid4())
@@ -23,11 +211,6 @@ class DocumentProcessor:
         if 'session_start' not in st.session_state:
             st.session_state.session_start = datetime.now()
         
-        # ベクトルストアをセッション状態で管理
-        if 'vectorstore' not in st.session_state:
-            st.session_state.vectorstore = None
-        if 'retriever' not in st.session_state:
-            st.session_state.retriever = None
         if 'processed_files' not in st.session_state:
             st.session_state.processed_files = []
         
@@ -49,33 +232,36 @@ class DocumentProcessor:
         return {
             'session_id': st.session_state.get('session_id', 'Unknown'),
             'session_start': st.session_state.get('session_start'),
-            'has_data': st.session_state.vectorstore is not None,
+            'has_data': self.vectorstore is not None,
             'file_count': len(st.session_state.processed_files)
         }
         
     def update_retriever_params(self, k):
         """リトリーバーのパラメーターを更新"""
-        st.session_state.retriever = st.session_state.vectorstore.as_retriever(
+        self.retriever = self.vectorstore.as_retriever(
             search_type='similarity',
             search_kwargs={"k": k}
         )
     
     def initialize_vectorstore(self):
         """ベクトルストアを初期化"""
-        embedding = config_manager.get_embedding()
+        from backend.vector_index import VectorIndex
+        
+        embedding = self.config.get_embedding()
         if not embedding:
             raise ValueError("Embedding model is not configured")
         
         # セッション状態から設定を取得
         params = st.session_state['search_params']
 
-        st.session_state.vectorstore = InMemoryVectorStore(embedding)
-        st.session_state.retriever = st.session_state.vectorstore.as_retriever(
-            search_type="similarity",
-            search_kwargs={"k": params['k']}
-        )
+        self.set_vectorstore(VectorIndex(embedding), params['k'])
     
-    def load_pdf(self, uploaded_file) -> List[Document]:
+    def set_vectorstore(self, vectorstore, k: int):
+        """ベクトルストアをこのセッションの検索対象にして、k件返すリトリーバーを作る"""
+        self.vectorstore = vectorstore
+        self.update_retriever_params(k)
+    
+    def load_pdf(self, uploaded_file, extractor: Optional[str] = None) -> List[Document]:
         """PDFファイルを読み込んでDocumentオブジェクトのリストを返す"""
         # 一時ファイルとして保存
         with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp_file:
@@ -83,36 +269,57 @@ class DocumentProcessor:
             tmp_file_path = tmp_file.name
         
         try:
-            # PDFを読み込み
-            loader = PyPDFLoader(tmp_file_path)
-            documents = loader.load()
-            
-            # ドキュメントにメタデータを追加
-            for doc in documents:
-                doc.metadata['source_file'] = uploaded_file.name
-                doc.metadata['file_size'] = uploaded_file.size
-                doc.metadata['session_id'] = st.session_state.session_id  # セッションIDを追加
-            
-            return documents
+            return self.load_pdf_path(tmp_file_path, uploaded_file.name, uploaded_file.size, extractor)
             
         finally:
             # 一時ファイルを削除
             os.unlink(tmp_file_path)
     
-    def split_documents(self, documents: List[Document]) -> List[Document]:
+    def load_pdf_path(self, file_path: str, file_name: Optional[str] = None, file_size: Optional[int] = None, extractor: Optional[str] = None) -> List[Document]:
+        """ローカルのPDFファイルを読み込んでDocumentオブジェクトのリストを返す
+
+        extractor でバックエンドを選べる（省略時はPDF_EXTRACTOR環境変数、autoならサイズで選ぶ）
+        """
+        file_size = file_size if file_size is not None else os.path.getsize(file_path)
+        
+        # PDFを読み込み
+        pdf_extractor = select_pdf_extractor(file_size, extractor)
+        with span("extract_pdf", extractor=pdf_extractor.name):
+            documents = pdf_extractor.load(file_path)
+        
+        # ドキュメントにメタデータを追加
+        for doc in documents:
+            doc.metadata['source_file'] = file_name or os.path.basename(file_path)
+            doc.metadata['file_size'] = file_size
+            doc.metadata['session_id'] = st.session_state.session_id  # セッションIDを追加
+        
+        return documents
+    
+    def split_documents(self, documents: List[Document], chunk_size: int = CHUNK_SIZE, chunk_overlap: int = CHUNK_OVERLAP) -> List[Document]:
         """ドキュメントを分割"""
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+        
         text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
+            chunk_size=chunk_size,
+            chunk_overlap=chunk_overlap,
             length_function=len,
         )
-        return text_splitter.split_documents(documents)
+        splits = text_splitter.split_documents(documents)
+        
+        # ベクトルストアと評価データで共通に使うチャンクIDを振る
+        for doc in splits:
+            doc.id = make_chunk_id(doc.page_content, doc.metadata.get('source_file', ''), doc.metadata.get('page', ''))
+            doc.metadata['chunk_id'] = doc.id
+        
+        return splits
     
     def add_documents_to_vectorstore(self, split_docs: List[Document], progress_callback=None):
         """ドキュメントをベクトルストアに追加（バッチ処理）"""
-        if not st.session_state.retriever:
+        if not self.retriever:
             self.initialize_vectorstore()
         
+        from backend.local_models import estimate_tokens
+        
         tmp_list = []
         c = 0
         limit_c = 100000
@@ -126,21 +333,29 @@ class DocumentProcessor:
                 if progress_callback:
                     progress_callback(f"Adding {i+1} documents of {total_docs} to retriever")
                 
+                EMBEDDING_CALLS.inc(phase="ingest")
+                EMBEDDING_TOKENS.inc(sum(estimate_tokens(doc.page_content) for doc in tmp_list), phase="ingest")
+                if self.usage is not None:
+                    self.usage.record_embedding("ingest", [doc.page_content for doc in tmp_list])
                 try:
-                    st.session_state.retriever.add_documents(tmp_list)
+                    self.retriever.add_documents(tmp_list)
                 except Exception as e:
                     if '429' in str(e):
+                        RATE_LIMITS.inc(operation="ingest")
+                        RETRIES.inc(operation="ingest")
                         if progress_callback:
                             progress_callback("Rate limit exceeded, waiting 60 seconds...")
                         time.sleep(60)
-                        st.session_state.retriever.add_documents(tmp_list)
+                        EMBEDDING_CALLS.inc(phase="ingest")
+                        self.retriever.add_documents(tmp_list)
                     else:
                         raise e
+                INGESTED_CHUNKS.inc(len(tmp_list))
                 
                 tmp_list = []
                 c = 0
     
-    def process_uploaded_files(self, uploaded_files, progress_callback=None) -> dict:
+    def process_uploaded_files(self, uploaded_files, progress_callback=None, extractor: Optional[str] = None) -> dict:
         """アップロードされたファイルを処理"""
         try:
             all_documents = []
@@ -152,68 +367,188 @@ class DocumentProcessor:
                     progress_callback(f"Processing: {uploaded_file.name}")
                 
                 # PDFを読み込み
-                documents = self.load_pdf(uploaded_file)
+                documents = self.load_pdf(uploaded_file, extractor)
                 all_documents.extend(documents)
                 
                 file_info.append({
                     'name': uploaded_file.name,
                     'size': uploaded_file.size,
-                    'pages': len(documents)
+                    'pages': len(documents),
+                    'extractor': documents[0].metadata['extractor'] if documents else None
                 })
             
-            if all_documents:
-                # テキストを分割
-                if progress_callback:
-                    progress_callback("Splitting documents...")
-                
-                splits = self.split_documents(all_documents)
+            return self._index_documents(all_documents, file_info, progress_callback)
                 
-                # ベクトルDBに格納
+        except Exception as e:
+            return {
+                'success': False,
+                'message': f'Error processing files: {str(e)}'
+            }
+    
+    def process_pdf_paths(self, pdf_paths: List[str], progress_callback=None, extractor: Optional[str] = None) -> dict:
+        """ローカルのPDFファイルを処理（CLI・ベンチマーク用）"""
+        try:
+            all_documents = []
+            file_info = []
+            
+            for pdf_path in pdf_paths:
                 if progress_callback:
-                    progress_callback("Adding to vector database...")
-                
-                self.add_documents_to_vectorstore(splits, progress_callback)
-                
-                # 処理済みファイル情報をセッション状態に保存
-                st.session_state.processed_files.extend(file_info)
+                    progress_callback(f"Processing: {pdf_path}")
                 
-                return {
-                    'success': True,
-                    'message': f'Successfully processed {len(uploaded_files)} PDF files',
-                    'file_count': len(uploaded_files),
-                    'chunk_count': len(splits),
-                    'file_info': file_info
-                }
-            else:
-                return {
-                    'success': False,
-                    'message': 'No documents found in uploaded files'
-                }
+                documents = self.load_pdf_path(pdf_path, extractor=extractor)
+                all_documents.extend(documents)
                 
+                file_info.append({
+                    'name': os.path.basename(pdf_path),
+                    'size': os.path.getsize(pdf_path),
+                    'pages': len(documents),
+                    'extractor': documents[0].metadata['extractor'] if documents else None
+                })
+            
+            return self._index_documents(all_documents, file_info, progress_callback)
+        
         except Exception as e:
             return {
                 'success': False,
                 'message': f'Error processing files: {str(e)}'
             }
     
-    def search_documents(self, query: str) -> List[Document]:
+    def _index_documents(self, all_documents: List[Document], file_info: List[dict], progress_callback=None) -> dict:
+        """読み込んだドキュメントを分割してベクトルDBに格納"""
+        if all_documents:
+            start = time.perf_counter()
+            # テキストを分割
+            if progress_callback:
+                progress_callback("Splitting documents...")
+            
+            splits = self.split_documents(all_documents)
+            
+            # 埋め込む前にセッションの予算で足りるか確認
+            if self.usage is not None:
+                from backend.local_models import estimate_tokens
+                try:
+                    self.usage.check("ingest", sum(estimate_tokens(doc.page_content) for doc in splits))
+                except TokenBudgetExceeded as e:
+                    return {
+                        'success': False,
+                        'message': str(e)
+                    }
+            
+            # ベクトルDBに格納
+            if progress_callback:
+                progress_callback("Adding to vector database...")
+            
+            self.add_documents_to_vectorstore(splits, progress_callback)
+            INGEST_LATENCY.observe(time.perf_counter() - start)
+            
+            # 処理済みファイル情報をセッション状態に保存
+            st.session_state.processed_files.extend(file_info)
+            
+            return {
+                'success': True,
+                'message': f'Successfully processed {len(file_info)} PDF files',
+                'file_count': len(file_info),
+                'chunk_count': len(splits),
+                'file_info': file_info
+            }
+        else:
+            return {
+                'success': False,
+                'message': 'No documents found in uploaded files'
+            }
+    
+    def search_documents(self, query: str, source_files: Optional[List[str]] = None, variants: Optional[List[str]] = None) -> List[Document]:
         """ドキュメントを検索"""
-        if not st.session_state.retriever:
-            print("❌ Retriever is None")
-            return []
+        return self.search_documents_with_vectors(query, source_files, variants)[0]
+    
+    def search_documents_with_vectors(self, query: str, source_files: Optional[List[str]] = None, variants: Optional[List[str]] = None) -> Tuple[List[Document], Optional[List[float]], Optional[List[List[float]]]]:
+        """ドキュメントを検索して、質問とヒットしたチャンクのベクトルも一緒に返す
+
+        source_files を渡すとそのファイルのチャンクだけから探す（空やNoneなら全部）
+        variants（質問の言い換え）を渡すと、全部を1回で埋め込んで1回の行列積で検索し、順位の逆数の和でまとめる
+        """
+        if not self.retriever:
+            logger.warning("Search skipped: retriever is not initialized")
+            return [], None, None
         
         try:
-            result = st.session_state.retriever.invoke(query)
-            return result
+            start = time.perf_counter()
+            vectorstore = self.vectorstore
+            k = self.retriever.search_kwargs.get('k', 4)
+            queries = list(dict.fromkeys([query] + [variant for variant in (variants or []) if variant]))
+            with span("embed_query", queries=len(queries)) as record:
+                from backend.local_models import estimate_tokens
+                if len(queries) == 1:
+                    query_vectors = [vectorstore.embeddings.embed_query(query)]
+                else:
+                    # 言い換えも一緒に1回の呼び出しで埋め込む
+                    query_vectors = vectorstore.embeddings.embed_documents(queries)
+                query_vector = query_vectors[0]
+                query_tokens = sum(estimate_tokens(text) for text in queries)
+                EMBEDDING_CALLS.inc(phase="query")
+                EMBEDDING_TOKENS.inc(query_tokens, phase="query")
+                if self.usage is not None:
+                    self.usage.record_embedding("chat", queries)
+                if record is not None:
+                    record.set(embedding_tokens=query_tokens)
+            with span("similarity_search", k=k, chunks=len(getattr(vectorstore, 'store', {}))) as record:
+                result_lists = self._similarity_search(vectorstore, query_vectors, k, source_files, record)
+            
+            # メタデータはストア内のものと共有なのでコピーしてから類似度を付ける
+            docs = []
+            if len(result_lists) == 1:
+                for doc, score in result_lists[0]:
+                    doc.metadata = {**doc.metadata, 'score': float(score)}
+                    docs.append(doc)
+            else:
+                from backend.vector_index import reciprocal_rank_fusion
+                # 類似度はどれかの言い換えでいちばん近かったときの値にする
+                for doc, fused_score, score in reciprocal_rank_fusion(result_lists, k):
+                    doc.metadata = {**doc.metadata, 'score': float(score), 'rrf_score': fused_score}
+                    docs.append(doc)
+            
+            # 関連度に合わせて文脈に入れる件数を決める（kは上限）
+            params = st.session_state.get('search_params', {})
+            k_mode = params.get('k_mode', DEFAULT_K_MODE)
+            docs = select_adaptive_docs(
+                docs, k_mode,
+                params.get('min_k', DEFAULT_MIN_K),
+                params.get('score_threshold', DEFAULT_SCORE_THRESHOLD)
+            )
+            CONTEXT_CHUNKS.observe(len(docs), mode=k_mode)
+            if record is not None:
+                record.set(k_mode=k_mode, chosen_k=len(docs), scores=[round(doc.metadata['score'], 3) for doc in docs])
+            
+            # 取り込み済みのベクトルがあれば埋め込み直さずに使う
+            context_vectors = None
+            if hasattr(vectorstore, 'get_vectors'):
+                context_vectors = vectorstore.get_vectors([doc.id for doc in docs])
+            else:
+                stored = getattr(vectorstore, 'store', {})
+                if all(doc.id in stored for doc in docs):
+                    context_vectors = [stored[doc.id]['vector'] for doc in docs]
+            SEARCH_LATENCY.observe(time.perf_counter() - start)
+            return docs, query_vector, context_vectors
         
         except Exception as e:
-            # より詳細なエラー情報を表示
-            import traceback
-            print(f"❌ Search error: {str(e)}")
-            print(f"❌ Error type: {type(e).__name__}")
-            print(f"❌ Traceback:")
-            traceback.print_exc()
-            return []
+            if '429' in str(e):
+                RATE_LIMITS.inc(operation="search")
+            logger.exception("Search error")
+            st.error(f"❌ 資料の検索でエラーが出ちゃった💦: {str(e)}")
+            return [], None, None
+    
+    def _similarity_search(self, vectorstore, query_vectors: List[List[float]], k: int, source_files: Optional[List[str]] = None, record=None) -> List[List[Tuple[Document, float]]]:
+        """質問ベクトルごとの上位k件（VectorIndexなら索引で行を絞って1回の行列積で計算）"""
+        if hasattr(vectorstore, 'search_many_by_vector'):
+            if source_files and record is not None:
+                record.set(files=len(source_files), candidates=len(vectorstore.select_rows(source_files)))
+            return vectorstore.search_many_by_vector(query_vectors, k=k, source_files=source_files or None)
+        
+        search_filter = None
+        if source_files:
+            wanted = set(source_files)
+            search_filter = lambda doc: doc.metadata.get('source_file') in wanted
+        return [vectorstore.similarity_search_with_score_by_vector(vector, k=k, filter=search_filter) for vector in query_vectors]
     
     def get_context_from_search(self, query: str) -> str:
         """検索結果から文脈を取得"""
@@ -222,10 +557,29 @@ class DocumentProcessor:
     
     def clear_vectorstore(self):
         """ベクトルストアをクリア"""
-        st.session_state.vectorstore = None
-        st.session_state.retriever = None
+        self.vectorstore = None
+        self.retriever = None
         st.session_state.processed_files = []
     
+    def vectorstore_size(self) -> int:
+        """このセッションのベクトルストアのチャンク数"""
+        return len(getattr(self.vectorstore, 'store', {}))
+    
+    def vectorstore_bytes(self) -> int:
+        """このセッションのベクトル本体のサイズ（VectorIndexなら行列の実サイズ、それ以外はfloat64換算のバイト数）"""
+        if hasattr(self.vectorstore, 'nbytes'):
+            return self.vectorstore.nbytes
+        store = getattr(self.vectorstore, 'store', {})
+        if not store:
+            return 0
+        dimensions = len(next(iter(store.values()))['vector'])
+        return len(store) * dimensions * 8
+    
+    def chunk_store_bytes(self) -> int:
+        """このセッションのチャンク本文とメタデータ列のバイト数（VectorIndexのときだけ）"""
+        chunks = getattr(self.vectorstore, 'chunks', None)
+        return chunks.nbytes if chunks is not None else 0
+    
     def get_stats(self) -> dict:
         """統計情報を取得"""
         # 常に存在チェック
@@ -236,6 +590,3 @@ class DocumentProcessor:
             'processed_files': st.session_state.processed_files,
             'total_files': len(st.session_state.processed_files)
         }
-
-# グローバルインスタンス
-document_processor = DocumentProcessor()
\ No newline at end of file
@@ -0,0 +1,149 @@
+# backend/usage.py
+import os
+import threading
+from dataclasses import dataclass, replace
+from typing import Dict, Iterable, Optional
+
+# トークンを使う機能（表示名）
+FEATURES = {
+    'chat': 'チャット',
+    'ingest': '資料の取り込み',
+    'evaluation': 'LLM採点',
+    'fast_metrics': '高速スコア',
+}
+
+# 予算の何割を超えたら節約モード（チャットの文脈を減らす）にするか
+THROTTLE_RATIO = float(os.environ.get('SESSION_TOKEN_THROTTLE_RATIO', 0.8))
+
+# 節約モードのときにプロンプトに入れる文脈の最大数
+THROTTLED_CONTEXT_DOCS = 3
+
+# 1000トークンあたりの料金（0なら料金は出さない）
+TOKEN_PRICES = {
+    'prompt': float(os.environ.get('TOKEN_PRICE_PROMPT_PER_1K', 0)),
+    'completion': float(os.environ.get('TOKEN_PRICE_COMPLETION_PER_1K', 0)),
+    'embedding': float(os.environ.get('TOKEN_PRICE_EMBEDDING_PER_1K', 0)),
+}
+
+
+def _env_budget(name: str) -> Optional[int]:
+    value = os.environ.get(name, '').strip()
+    return int(value) if value and int(value) > 0 else None
+
+
+def default_budgets() -> Dict[Optional[str], Optional[int]]:
+    """環境変数のセッションごとのトークン予算（Noneキーが全体、空なら無制限）"""
+    budgets = {None: _env_budget('SESSION_TOKEN_BUDGET')}
+    for feature in FEATURES:
+        budgets[feature] = _env_budget(f'SESSION_TOKEN_BUDGET_{feature.upper()}')
+    return budgets
+
+
+class TokenBudgetExceeded(Exception):
+    """セッションのトークン予算を超えるので処理を断った"""
+
+
+@dataclass
+class FeatureUsage:
+    """機能ごとのトークン使用量"""
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_tokens: int = 0
+    # 応答にusageがなく見積もりで数えた呼び出しがあったか
+    estimated: bool = False
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens + self.embedding_tokens
+
+    @property
+    def cost(self) -> float:
+        return (
+            self.prompt_tokens * TOKEN_PRICES['prompt']
+            + self.completion_tokens * TOKEN_PRICES['completion']
+            + self.embedding_tokens * TOKEN_PRICES['embedding']
+        ) / 1000
+
+
+class UsageLedger:
+    """1セッションのトークン使用量を機能ごとに集計して、予算で節約・拒否を判断する
+
+    評価はバックグラウンドのスレッドから書き込むのでロックで守るよ。
+    """
+
+    def __init__(self, budgets: Optional[Dict[Optional[str], Optional[int]]] = None, throttle_ratio: float = THROTTLE_RATIO):
+        self.budgets = budgets if budgets is not None else default_budgets()
+        self.throttle_ratio = throttle_ratio
+        self._usage: Dict[str, FeatureUsage] = {feature: FeatureUsage() for feature in FEATURES}
+        self._lock = threading.Lock()
+
+    def record(self, feature: str, prompt_tokens: int = 0, completion_tokens: int = 0, embedding_tokens: int = 0, calls: int = 1, estimated: bool = False):
+        """使用量を記録"""
+        with self._lock:
+            usage = self._usage.setdefault(feature, FeatureUsage())
+            usage.calls += calls
+            usage.prompt_tokens += int(prompt_tokens)
+            usage.completion_tokens += int(completion_tokens)
+            usage.embedding_tokens += int(embedding_tokens)
+            usage.estimated = usage.estimated or estimated
+
+    def record_llm_usage(self, feature: str, usage_metadata: Optional[dict], prompt_text: str = "", completion_text: str = ""):
+        """LLMの応答のusage_metadataを記録（なければ本文から見積もる）"""
+        if usage_metadata:
+            self.record(feature, usage_metadata.get('input_tokens', 0), usage_metadata.get('output_tokens', 0))
+            return
+        from backend.local_models import estimate_tokens
+        self.record(feature, estimate_tokens(prompt_text), estimate_tokens(completion_text), estimated=True)
+
+    def record_embedding(self, feature: str, texts: Iterable[str], calls: int = 1):
+        """埋め込みの入力トークンを記録（埋め込みの応答にはusageがないので見積もり）"""
+        from backend.local_models import estimate_tokens
+        self.record(feature, embedding_tokens=sum(estimate_tokens(text) for text in texts), calls=calls, estimated=True)
+
+    def usage(self, feature: Optional[str] = None) -> FeatureUsage:
+        """機能ごと（Noneなら全体）の使用量のコピー"""
+        with self._lock:
+            if feature is not None:
+                return replace(self._usage.get(feature, FeatureUsage()))
+            total = FeatureUsage()
+            for usage in self._usage.values():
+                total.calls += usage.calls
+                total.prompt_tokens += usage.prompt_tokens
+                total.completion_tokens += usage.completion_tokens
+                total.embedding_tokens += usage.embedding_tokens
+                total.estimated = total.estimated or usage.estimated
+            return total
+
+    def remaining(self, feature: Optional[str] = None) -> Optional[int]:
+        """残りのトークン予算（全体と機能ごとの小さいほう。予算がなければNone）"""
+        candidates = []
+        if self.budgets.get(None) is not None:
+            candidates.append(self.budgets[None] - self.usage().total_tokens)
+        if feature is not None and self.budgets.get(feature) is not None:
+            candidates.append(self.budgets[feature] - self.usage(feature).total_tokens)
+        return max(0, min(candidates)) if candidates else None
+
+    def status(self, feature: Optional[str] = None) -> str:
+        """予算の状態（ok / throttled / exceeded）"""
+        ratios = []
+        for key in ((None, feature) if feature else (None,)):
+            budget = self.budgets.get(key)
+            if budget is not None:
+                ratios.append(self.usage(key).total_tokens / budget)
+        worst = max(ratios, default=0.0)
+        if worst >= 1:
+            return 'exceeded'
+        if worst >= self.throttle_ratio:
+            return 'throttled'
+        return 'ok'
+
+    def check(self, feature: str, estimated_tokens: int = 0):
+        """予算内で実行できるか確認（足りなければTokenBudgetExceeded）"""
+        remaining = self.remaining(feature)
+        if remaining is None:
+            return
+        if remaining <= 0 or estimated_tokens > remaining:
+            raise TokenBudgetExceeded(
+                f"{FEATURES.get(feature, feature)}のトークン予算が足りないよ（残り{remaining:,}、必要な見積もり{estimated_tokens:,}）"
+            )
@@ -0,0 +1,261 @@
+# backend/vector_index.py
+import uuid
+from collections.abc import Mapping
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.vectorstores import InMemoryVectorStore
+
+from backend.chunk_store import ChunkStore
+
+# 行列の最初の確保行数（足りなくなったら倍々に広げる）
+INITIAL_CAPACITY = 256
+# Reciprocal Rank Fusionの定数（大きいほど下位の結果も効く）
+RRF_K = 60
+
+
+@dataclass
+class FileEntry:
+    """1ファイルぶんのチャンクが行列のどの行にあるか"""
+    source_file: str
+    uploaded_at: datetime
+    # [start, end) の行範囲（同じファイルのチャンクはまとめて追加されるのでふつうは1つ）
+    ranges: List[Tuple[int, int]] = field(default_factory=list)
+    # ページラベルごとの行範囲
+    pages: Dict[str, List[Tuple[int, int]]] = field(default_factory=dict)
+
+    @property
+    def chunk_count(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+
+def _append_row(ranges: List[Tuple[int, int]], row: int):
+    """行を範囲のリストに追加（直前の範囲の続きなら伸ばす）"""
+    if ranges and ranges[-1][1] == row:
+        ranges[-1] = (ranges[-1][0], row + 1)
+    else:
+        ranges.append((row, row + 1))
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[Sequence[Tuple[Document, float]]], k: int, rrf_k: int = RRF_K) -> List[Tuple[Document, float, float]]:
+    """複数の検索結果を順位の逆数の和でまとめる（(Document, RRFスコア, いちばん高い類似度) の上位k件）"""
+    fused: Dict[str, list] = {}
+    for results in result_lists:
+        for rank, (doc, score) in enumerate(results, 1):
+            entry = fused.setdefault(doc.id, [doc, 0.0, score])
+            entry[1] += 1 / (rrf_k + rank)
+            entry[2] = max(entry[2], score)
+    return [tuple(entry) for entry in sorted(fused.values(), key=lambda entry: entry[1], reverse=True)[:k]]
+
+
+def _rows_from_ranges(ranges: Iterable[Tuple[int, int]]) -> np.ndarray:
+    ranges = list(ranges)
+    if not ranges:
+        return np.empty(0, dtype=np.int64)
+    return np.concatenate([np.arange(start, end, dtype=np.int64) for start, end in ranges])
+
+
+class StoreView(Mapping):
+    """VectorIndexの中身をInMemoryVectorStoreのstoreと同じ形で見せる読み取り専用のビュー
+
+    要素（{id, vector, text, metadata}）は引いたときにだけ作るよ。
+    """
+
+    def __init__(self, index: "VectorIndex"):
+        self._index = index
+
+    def __getitem__(self, doc_id: str) -> Dict[str, Any]:
+        row = self._index._row_of[doc_id]
+        return {
+            "id": doc_id,
+            "vector": self._index._matrix[row].tolist(),
+            "text": self._index.chunks.text(row),
+            "metadata": self._index.chunks.metadata(row),
+        }
+
+    def __contains__(self, doc_id: object) -> bool:
+        return doc_id in self._index._row_of
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._index._ids))
+
+    def __len__(self) -> int:
+        return len(self._index._ids)
+
+
+class VectorIndex(InMemoryVectorStore):
+    """ベクトルをfloat32の行列に並べて持ち、ファイル・ページ・アップロード時刻で絞ってから類似度を計算するベクトルストア
+
+    InMemoryVectorStoreは検索のたびに全チャンクのベクトルを行列に組み直してから類似度を計算し、
+    filterはDocumentを1件ずつ作って判定するけど、こっちは追加のときに行列とメタデータの索引を作っておいて、
+    選んだファイルの行だけを取り出して計算するよ。本文とメタデータはChunkStoreに詰めて持ち、
+    Documentは検索結果の上位k件だけ作る。storeはInMemoryVectorStoreと同じ形のビューなので、
+    リトリーバーやチャンクIDからの参照はそのまま使える。
+    """
+
+    def __init__(self, embedding, chunks: Optional[ChunkStore] = None, **kwargs: Any):
+        super().__init__(embedding, **kwargs)
+        self._reset_index(chunks)
+        self.store = StoreView(self)
+
+    def _reset_index(self, chunks: Optional[ChunkStore] = None):
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._norms = np.empty(0, dtype=np.float32)
+        self._ids: List[str] = []
+        self._row_of: Dict[str, int] = {}
+        self.chunks = chunks if chunks is not None else ChunkStore.from_env()
+        self.files: Dict[str, FileEntry] = {}
+
+    @property
+    def nbytes(self) -> int:
+        """行列と索引の配列が確保しているバイト数"""
+        return int(self._matrix.nbytes + self._norms.nbytes)
+
+    def _ensure_capacity(self, rows: int, dimensions: int):
+        if self._matrix.shape[1] != dimensions:
+            if self._ids:
+                raise ValueError(f"Embedding dimensions changed from {self._matrix.shape[1]} to {dimensions}")
+            self._matrix = np.empty((0, dimensions), dtype=np.float32)
+        if rows <= len(self._matrix):
+            return
+        capacity = max(INITIAL_CAPACITY, len(self._matrix))
+        while capacity < rows:
+            capacity *= 2
+        matrix = np.empty((capacity, dimensions), dtype=np.float32)
+        matrix[:len(self._ids)] = self._matrix[:len(self._ids)]
+        norms = np.empty(capacity, dtype=np.float32)
+        norms[:len(self._ids)] = self._norms[:len(self._ids)]
+        self._matrix, self._norms = matrix, norms
+
+    def _index_row(self, row: int, metadata: Dict[str, Any], uploaded_at: datetime):
+        """行をファイル・ページの索引に追加"""
+        source_file = metadata.get("source_file") or metadata.get("source") or ""
+        file_entry = self.files.get(source_file)
+        if file_entry is None:
+            file_entry = self.files[source_file] = FileEntry(source_file, uploaded_at)
+        _append_row(file_entry.ranges, row)
+        _append_row(file_entry.pages.setdefault(str(metadata.get("page_label", "")), []), row)
+
+    def _add(self, documents: List[Document], vectors: List[List[float]], ids: Optional[List[str]] = None) -> List[str]:
+        """埋め込み済みのチャンクを行列・ChunkStore・索引に追加（同じIDは行を上書き）"""
+        if ids and len(ids) != len(documents):
+            raise ValueError(f"ids must be the same length as texts. Got {len(ids)} ids and {len(documents)} texts.")
+        ids_ = [doc_id or doc.id or str(uuid.uuid4()) for doc, doc_id in zip(documents, ids or [None] * len(documents))]
+        if not ids_:
+            return ids_
+        matrix = np.asarray(vectors, dtype=np.float32)
+        new_ids = {doc_id for doc_id in ids_ if doc_id not in self._row_of}
+        self._ensure_capacity(len(self._ids) + len(new_ids), matrix.shape[1])
+
+        uploaded_at = datetime.now()
+        for doc, doc_id, vector in zip(documents, ids_, matrix):
+            row = self._row_of.get(doc_id)
+            if row is None:
+                row = self._row_of[doc_id] = self.chunks.append(doc.page_content, doc.metadata)
+                self._ids.append(doc_id)
+                self._index_row(row, doc.metadata or {}, uploaded_at)
+            else:
+                self.chunks.replace(row, doc.page_content, doc.metadata)
+            self._matrix[row] = vector
+            self._norms[row] = np.linalg.norm(vector)
+        return ids_
+
+    def add_documents(self, documents: List[Document], ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        vectors = self.embedding.embed_documents([doc.page_content for doc in documents])
+        return self._add(documents, vectors, ids)
+
+    async def aadd_documents(self, documents: List[Document], ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        vectors = await self.embedding.aembed_documents([doc.page_content for doc in documents])
+        return self._add(documents, vectors, ids)
+
+    def get_vectors(self, ids: Sequence[str]) -> Optional[List[List[float]]]:
+        """チャンクIDのベクトル（ないIDが1つでもあればNone）"""
+        if not all(doc_id in self._row_of for doc_id in ids):
+            return None
+        return self._matrix[[self._row_of[doc_id] for doc_id in ids]].tolist()
+
+    def delete(self, ids: Optional[Sequence[str]] = None, **kwargs: Any) -> None:
+        """チャンクを削除して行列・ChunkStore・索引を詰め直す"""
+        removed = {doc_id for doc_id in ids or [] if doc_id in self._row_of}
+        if not removed:
+            return
+        keep = [row for row, doc_id in enumerate(self._ids) if doc_id not in removed]
+        ids_ = [self._ids[row] for row in keep]
+        matrix, norms = self._matrix[keep], self._norms[keep]
+        uploaded_at = {name: entry.uploaded_at for name, entry in self.files.items()}
+        chunks = self.chunks.compact(keep)
+        self.chunks.close()
+
+        self._reset_index(chunks)
+        self._ensure_capacity(len(ids_), matrix.shape[1])
+        self._matrix[:len(ids_)], self._norms[:len(ids_)] = matrix, norms
+        self._ids = ids_
+        self._row_of = {doc_id: row for row, doc_id in enumerate(ids_)}
+        now = datetime.now()
+        for row in range(len(ids_)):
+            metadata = {key: chunks.value(row, key) for key in ("source_file", "source", "page_label") if chunks.value(row, key) is not None}
+            source_file = metadata.get("source_file") or metadata.get("source") or ""
+            self._index_row(row, metadata, uploaded_at.get(source_file, now))
+
+    async def adelete(self, ids: Optional[Sequence[str]] = None, **kwargs: Any) -> None:
+        self.delete(ids, **kwargs)
+
+    def select_rows(self, source_files: Optional[Iterable[str]] = None, page_labels: Optional[Iterable[str]] = None, uploaded_after: Optional[datetime] = None) -> Optional[np.ndarray]:
+        """条件に合うチャンクの行番号（条件がなければNone＝全部）"""
+        if source_files is None and page_labels is None and uploaded_after is None:
+            return None
+        entries = self.files.values() if source_files is None else [self.files[name] for name in source_files if name in self.files]
+        if uploaded_after is not None:
+            entries = [entry for entry in entries if entry.uploaded_at >= uploaded_after]
+        if page_labels is None:
+            return _rows_from_ranges(row_range for entry in entries for row_range in entry.ranges)
+        labels = [str(label) for label in page_labels]
+        return _rows_from_ranges(
+            row_range for entry in entries for label in labels for row_range in entry.pages.get(label, [])
+        )
+
+    def search_by_vector(self, embedding: Sequence[float], k: int = 4, source_files: Optional[Iterable[str]] = None, page_labels: Optional[Iterable[str]] = None, uploaded_after: Optional[datetime] = None) -> List[Tuple[Document, float]]:
+        """絞り込んだチャンクだけでコサイン類似度の上位k件を検索"""
+        return self.search_many_by_vector([embedding], k, source_files, page_labels, uploaded_after)[0]
+
+    def search_many_by_vector(self, embeddings: Sequence[Sequence[float]], k: int = 4, source_files: Optional[Iterable[str]] = None, page_labels: Optional[Iterable[str]] = None, uploaded_after: Optional[datetime] = None) -> List[List[Tuple[Document, float]]]:
+        """複数の質問ベクトルを1回の行列積でまとめて検索（質問ごとの上位k件のリスト）"""
+        rows = self.select_rows(source_files, page_labels, uploaded_after)
+        return [[(doc, score) for doc, score, _ in results] for results in self._search_rows(embeddings, k, rows)]
+
+    def _search_rows(self, embeddings: Sequence[Sequence[float]], k: int, rows: Optional[np.ndarray]) -> List[List[Tuple[Document, float, List[float]]]]:
+        size = len(self._ids)
+        if rows is None:
+            matrix, norms = self._matrix[:size], self._norms[:size]
+        else:
+            matrix, norms = self._matrix[rows], self._norms[rows]
+        if not len(matrix) or k <= 0:
+            return [[] for _ in embeddings]
+
+        # (チャンク数, 質問数) の類似度をまとめて計算
+        queries = np.asarray(embeddings, dtype=np.float32).reshape(len(embeddings), -1)
+        denominator = norms[:, None] * np.linalg.norm(queries, axis=1)[None, :]
+        scores = np.divide(matrix @ queries.T, denominator, out=np.zeros(denominator.shape, dtype=np.float32), where=denominator > 0)
+        k = min(k, len(matrix))
+
+        result_lists = []
+        for column in scores.T:
+            top = np.argpartition(-column, k - 1)[:k]
+            top = top[np.argsort(-column[top], kind="stable")]
+            results = []
+            for index in top:
+                # Documentを作るのは上位k件だけ
+                row = int(index if rows is None else rows[index])
+                results.append((self.chunks.document(row, self._ids[row]), float(column[index]), self._matrix[row].tolist()))
+            result_lists.append(results)
+        return result_lists
+
+    def _similarity_search_with_score_by_vector(self, embedding: List[float], k: int = 4, filter=None) -> List[Tuple[Document, float, List[float]]]:  # noqa: A002
+        # 任意の関数のfilterは1件ずつDocumentを作って判定するしかないので、通った行だけで計算する
+        if filter is not None:
+            rows = np.array([row for row, doc_id in enumerate(self._ids) if filter(self.chunks.document(row, doc_id))], dtype=np.int64)
+            return self._search_rows([embedding], k, rows)[0]
+        return self._search_rows([embedding], k, None)[0]
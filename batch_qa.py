@@ -0,0 +1,157 @@
+# batch_qa.py
+"""質問セットをまとめてRAGパイプラインに流すCLI
+
+使い方:
+    python batch_qa.py --pdf-dir ./docs --questions questions.jsonl --output results.jsonl --concurrency 8
+
+質問ファイルは JSONL（{"id": ..., "question": ...}）か CSV（id, question 列）だよ。
+評価データはWebアプリのとは混ぜずに、出力ファイルの横の <output>.evaluations.sqlite3 に保存するよ（--no-evaluation で保存しない）。
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+
+import streamlit as st
+
+from config_manager import config_manager
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Run a question set through the ChatGAL RAG pipeline")
+    parser.add_argument("--pdf-dir", required=True, help="取り込むPDFのフォルダ")
+    parser.add_argument("--questions", required=True, help="質問ファイル（.jsonl / .csv）")
+    parser.add_argument("--output", required=True, help="結果を書き出すJSONLファイル")
+    parser.add_argument("--concurrency", type=int, default=4, help="同時に投げる質問数の上限")
+    parser.add_argument("--k", type=int, default=10, help="検索結果数（k-modeがfixed以外なら上限）")
+    parser.add_argument("--k-mode", choices=["fixed", "threshold", "gap"], default="fixed", help="検索結果数の決め方")
+    parser.add_argument("--min-k", type=int, default=2, help="k-modeがfixed以外のときの最低件数")
+    parser.add_argument("--score-threshold", type=float, default=0.75, help="k-modeがthresholdのときの類似度のしきい値")
+    parser.add_argument("--retries", type=int, default=2, help="429のときのリトライ回数")
+    parser.add_argument("--provider", choices=["env", "stub"], default="env", help="env: .envのAzure設定 / stub: ローカルスタブ")
+    parser.add_argument("--pdf-extractor", default=None, help="PDFの読み取り方（auto / pypdf / pdfminer / pypdfium2）")
+    parser.add_argument("--evaluation-store", help="評価データを保存するSQLiteファイル（省略すると <output>.evaluations.sqlite3）")
+    parser.add_argument("--no-evaluation", action="store_true", help="回答を評価データとして保存しない")
+    return parser.parse_args()
+
+
+def quiet_streamlit():
+    """CLIにはScriptRunContextがないので、session_stateを触るたびに出る警告を消す"""
+    logging.getLogger("streamlit.runtime.scriptrunner_utils.script_run_context").setLevel(logging.ERROR)
+
+
+def read_questions(path: str):
+    """質問ファイルを1件ずつ読み込む"""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            for i, row in enumerate(csv.DictReader(f)):
+                yield row.get("id") or str(i), row["question"]
+    else:
+        with open(path, encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                item = json.loads(line)
+                yield str(item.get("id", i)), item["question"]
+
+
+def answer_question(chat_service, question_id: str, question: str, retries: int) -> dict:
+    """1つの質問をRAGで回答（429はバックオフしてリトライ）"""
+    start = time.perf_counter()
+    for attempt in range(retries + 1):
+        result = chat_service.chat_with_rag([{"role": "user", "content": question}], question)
+        if result["success"] or "429" not in result["message"] or attempt == retries:
+            break
+        time.sleep(2 ** attempt)
+
+    return {
+        "id": question_id,
+        "question": question,
+        "success": result["success"],
+        "message": result["message"],
+        "answer": result["response"],
+        "latency_ms": round((time.perf_counter() - start) * 1000, 1),
+        "attempts": attempt + 1,
+        "usage": result.get("usage", {}),
+        "timings_ms": {name: round(ms, 1) for name, ms in result["trace"].breakdown().items()},
+        "sources": [
+            {"source_file": doc.metadata.get("source_file"), "page_label": doc.metadata.get("page_label"), "score": doc.metadata.get("score")}
+            for doc in result["context_docs"]
+        ]
+    }
+
+
+def main():
+    args = parse_args()
+    quiet_streamlit()
+
+    if args.provider == "stub":
+        config_manager.configure_local_stub()
+    else:
+        config_manager.configure_from_env()
+    st.session_state.search_params = {"k": args.k, "k_mode": args.k_mode, "min_k": args.min_k, "score_threshold": args.score_threshold}
+
+    # stの初期化後にインポートする
+    from backend.upload import DocumentProcessor
+    from backend.chat import ChatService
+
+    document_processor = DocumentProcessor()
+
+    pdf_paths = sorted(str(path) for path in Path(args.pdf_dir).glob("*.pdf"))
+    if not pdf_paths:
+        sys.exit(f"No PDF files found in {args.pdf_dir}")
+
+    start = time.perf_counter()
+    ingest_result = document_processor.process_pdf_paths(pdf_paths, progress_callback=lambda m: print(m, file=sys.stderr), extractor=args.pdf_extractor)
+    if not ingest_result["success"]:
+        sys.exit(ingest_result["message"])
+    print(f"ingested {ingest_result['file_count']} files / {ingest_result['chunk_count']} chunks "
+          f"in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+    if args.no_evaluation:
+        chat_service = ChatService(document_processor, capture_evaluations=False)
+    else:
+        from backend.evaluation_capture import ChatEvaluation, EvaluationCapture
+        from backend.evaluation_store import EvaluationStore
+        store_path = args.evaluation_store or f"{os.path.splitext(args.output)[0]}.evaluations.sqlite3"
+        store = EvaluationStore(item_factory=ChatEvaluation, path=store_path)
+        chat_service = ChatService(document_processor, evaluation_service=EvaluationCapture(store=store))
+        print(f"evaluation data -> {os.path.abspath(store_path)}", file=sys.stderr)
+    completed = 0
+    failed = 0
+    start = time.perf_counter()
+
+    # 実行中の質問数をconcurrencyで抑えつつ、終わったものから順に書き出す
+    with open(args.output, "w", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        pending = set()
+
+        def drain(return_when):
+            nonlocal pending, completed, failed
+            done, pending = wait(pending, return_when=return_when)
+            for future in done:
+                record = future.result()
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                completed += 1
+                failed += not record["success"]
+            out.flush()
+
+        for question_id, question in read_questions(args.questions):
+            if len(pending) >= args.concurrency:
+                drain(FIRST_COMPLETED)
+            pending.add(executor.submit(answer_question, chat_service, question_id, question, args.retries))
+
+        while pending:
+            drain(FIRST_COMPLETED)
+
+    elapsed = time.perf_counter() - start
+    print(f"answered {completed} questions ({failed} failed) in {elapsed:.1f}s "
+          f"({completed / elapsed if elapsed else 0:.2f} q/s) -> {os.path.abspath(args.output)}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/chat_render_benchmark.py
+"""チャット履歴の長さごとの再実行時間の計測
+
+使い方:
+    python -m benchmarks.chat_render_benchmark
+    python -m benchmarks.chat_render_benchmark --history 0 100 1000 5000 --reruns 10 --output runs/chat_render.json
+
+AppTestでチャットページを開いて、履歴をN件入れた状態で何回か再実行して時間を測るよ。
+最新のぶんだけ吹き出しで描画するので、履歴が増えても再実行時間はほぼ横ばいになるはず。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure chat page rerun latency against chat history length")
+    parser.add_argument("--history", type=int, nargs="+", default=[0, 100, 1000, 5000], help="履歴のメッセージ数")
+    parser.add_argument("--reruns", type=int, default=10, help="履歴の長さごとの再実行回数")
+    parser.add_argument("--message-chars", type=int, default=400, help="1メッセージの文字数")
+    parser.add_argument("--open-page", action="store_true", help="過去ログの一番古いページも開いた状態で測る")
+    parser.add_argument("--output", help="結果JSONの出力先")
+    return parser.parse_args()
+
+
+def make_history(count: int, chars: int):
+    """ユーザーとアシスタントが交互に話した履歴"""
+    from benchmarks.synthetic import PDF_VOCABULARY
+    body = ("".join(PDF_VOCABULARY) * (chars // len("".join(PDF_VOCABULARY)) + 1))[:chars]
+    return [
+        {"role": "user" if i % 2 == 0 else "assistant", "content": f"**{i}** {body}"}
+        for i in range(count)
+    ]
+
+
+def measure(history_size: int, args) -> dict:
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(os.path.join(ROOT, "app.py"), default_timeout=120).run()
+    at.session_state["messages"] = make_history(history_size, args.message_chars)
+    at.run()
+    if args.open_page and at.selectbox:
+        at.selectbox(key="chat_history_page").set_value(0).run()
+
+    timings = []
+    for _ in range(args.reruns):
+        start = time.perf_counter()
+        at.run()
+        timings.append(time.perf_counter() - start)
+    return {
+        "history": history_size,
+        "median_ms": statistics.median(timings) * 1000,
+        "max_ms": max(timings) * 1000,
+        "elements": len(at.markdown),
+        "exceptions": [str(e.value) for e in at.exception],
+    }
+
+
+def main():
+    args = parse_args()
+    os.environ.setdefault("LLM_PROVIDER", "stub")
+    os.environ.setdefault("RAGAS_DO_NOT_TRACK", "true")
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+
+    results = []
+    print(f"{'history':>8} {'median ms':>10} {'max ms':>10} {'markdown':>9}")
+    for history_size in args.history:
+        result = measure(history_size, args)
+        results.append(result)
+        print(f"{result['history']:>8} {result['median_ms']:>10.1f} {result['max_ms']:>10.1f} {result['elements']:>9}")
+        if result["exceptions"]:
+            print(f"❌ exceptions: {result['exceptions']}")
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created_at": datetime.now().isoformat(), "args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"📝 wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
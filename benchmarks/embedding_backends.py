@@ -0,0 +1,160 @@
+# benchmarks/embedding_backends.py
+"""埋め込みバックエンドごとのクエリレイテンシと検索品質を同じコーパスで比較する
+
+使い方:
+    python -m benchmarks.embedding_backends --backends ngram stub
+    python -m benchmarks.embedding_backends --pdf-dir ./samples --backends azure ngram onnx
+
+azure を含めると、他のバックエンドの上位k件がAzureの上位k件とどれだけ一致するかも出すよ。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+
+from benchmarks.synthetic import make_documents
+from config_manager import config_manager, AZURE_EMBEDDING_VARS
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare embedding backends on the same corpus")
+    parser.add_argument("--backends", nargs="+", default=["ngram", "stub"], help="azure / ngram / onnx / stub")
+    parser.add_argument("--pdf-dir", help="PDFのフォルダ（省略すると合成コーパス）")
+    parser.add_argument("--docs", type=int, default=20, help="合成コーパスのファイル数")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--output", help="結果JSONの出力先")
+    return parser.parse_args()
+
+
+def load_chunks(args):
+    """PDFフォルダまたは合成コーパスをアプリと同じ設定でチャンク化"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
+    if args.pdf_dir:
+        from langchain_community.document_loaders import PyPDFLoader
+        documents = []
+        for pdf_path in sorted(Path(args.pdf_dir).glob("*.pdf")):
+            documents.extend(PyPDFLoader(str(pdf_path)).load())
+    else:
+        documents = make_documents(args.docs)
+
+    splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=200, length_function=len)
+    return [doc.page_content for doc in splitter.split_documents(documents)]
+
+
+def make_golden_set(chunks, n_queries, seed=0):
+    """チャンクから1文を抜き出して（質問, 正解チャンク）のペアを作る"""
+    rng = random.Random(seed)
+    golden = []
+    for chunk_index in rng.sample(range(len(chunks)), min(n_queries, len(chunks))):
+        sentences = [s for s in re.split(r"(?<=[。．.!?！？])", chunks[chunk_index]) if len(s.strip()) > 10]
+        if sentences:
+            golden.append((rng.choice(sentences).strip(), chunk_index))
+    return golden
+
+
+def build_embedding(backend):
+    """バックエンド名から埋め込みモデルを作成"""
+    if backend == "azure":
+        missing = [var for var in AZURE_EMBEDDING_VARS if not os.environ.get(var)]
+        if missing:
+            raise ValueError(f"missing environment variables: {', '.join(missing)}")
+        from langchain_openai import AzureOpenAIEmbeddings
+        return AzureOpenAIEmbeddings(
+            azure_endpoint=os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"],
+            api_key=os.environ["AZURE_OPENAI_EMBEDDING_API_KEY"],
+            api_version=os.environ["AZURE_OPENAI_EMBEDDING_API_VERSION"],
+            azure_deployment=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
+            model=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]
+        )
+    if backend == "stub":
+        config_manager.configure_local_stub(embedding_backend="azure")
+        return config_manager.get_embedding()
+    return config_manager._build_local_embedding(backend)
+
+
+def run_backend(backend, chunks, golden, k):
+    """1つのバックエンドでインデックス作成と検索を計測"""
+    embedding = build_embedding(backend)
+
+    start = time.perf_counter()
+    matrix = np.asarray(embedding.embed_documents(chunks), dtype=np.float32)
+    index_seconds = time.perf_counter() - start
+    matrix /= np.clip(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12, None)
+
+    query_latencies = []
+    search_latencies = []
+    rankings = []
+    for question, _ in golden:
+        start = time.perf_counter()
+        query = np.asarray(embedding.embed_query(question), dtype=np.float32)
+        query_latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        scores = matrix @ query
+        top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+        top = top[np.argsort(-scores[top])]
+        search_latencies.append(time.perf_counter() - start)
+        rankings.append(top.tolist())
+
+    reciprocal_ranks = []
+    hits = 0
+    for (_, relevant), ranking in zip(golden, rankings):
+        if relevant in ranking:
+            hits += 1
+            reciprocal_ranks.append(1 / (ranking.index(relevant) + 1))
+        else:
+            reciprocal_ranks.append(0.0)
+
+    return {
+        "index_seconds": index_seconds,
+        "chunks_per_sec": len(chunks) / index_seconds if index_seconds else None,
+        "query_embed_ms_p50": float(np.percentile(query_latencies, 50) * 1000),
+        "query_embed_ms_p95": float(np.percentile(query_latencies, 95) * 1000),
+        "search_ms_p50": float(np.percentile(search_latencies, 50) * 1000),
+        f"recall@{k}": hits / len(golden),
+        "mrr": float(np.mean(reciprocal_ranks)),
+    }, rankings
+
+
+def main():
+    args = parse_args()
+    chunks = load_chunks(args)
+    golden = make_golden_set(chunks, args.queries)
+    print(f"corpus: {len(chunks)} chunks, golden queries: {len(golden)}")
+
+    results = {}
+    rankings = {}
+    for backend in args.backends:
+        try:
+            results[backend], rankings[backend] = run_backend(backend, chunks, golden, args.k)
+        except Exception as e:
+            print(f"skip {backend}: {e}")
+
+    # Azureの上位k件との一致率（同じコーパス・同じ質問での品質の近さ）
+    if "azure" in rankings:
+        for backend, backend_rankings in rankings.items():
+            overlaps = [
+                len(set(a) & set(b)) / args.k
+                for a, b in zip(rankings["azure"], backend_rankings)
+            ]
+            results[backend][f"overlap@{args.k}_with_azure"] = float(np.mean(overlaps))
+
+    for backend, result in results.items():
+        print(f"\n[{backend}]")
+        for name, value in result.items():
+            print(f"  {name:>24}: {value:.4f}" if isinstance(value, float) else f"  {name:>24}: {value}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"chunks": len(chunks), "queries": len(golden), "k": args.k, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
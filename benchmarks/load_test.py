@@ -0,0 +1,349 @@
+# benchmarks/load_test.py
+"""複数セッションの負荷テスト（AppTestでapp.pyと3ページをローカルスタブで動かす）
+
+使い方:
+    python -m benchmarks.load_test
+    python -m benchmarks.load_test --concurrency 1 2 4 8 --sessions 4 --chats 5 --output runs/load.json
+    python -m benchmarks.load_test --pdf-dir ./samples --evaluate --baseline runs/load.json
+
+1セッション = 1つのAppTest。PDFの取り込み → チャット → 採点ページ → 高速スコア（--evaluateならLLM採点も）を流すよ。
+
+AppTestは実行中にプロセス共通のRuntimeを差し替えるので、1プロセスの中では同時に動かせないんだ。
+だから同時実行数はワーカープロセスの数で増やして、各ワーカーは--sessionsぶんのセッションを
+生かしたまま順番に再実行する（セッションが増えたときのメモリの増え方はワーカーの中で測るよ）。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# アップロードUIの代わりにPDFのパスから取り込んでからapp.pyを実行するドライバー
+# （AppTestはファイルアップローダーを操作できないため。ページのパスがずれないようにリポジトリ直下に置く）
+DRIVER_SCRIPT = '''
+import runpy
+import streamlit as st
+
+pdf_paths = st.session_state.pop("load_test_pdf_paths", None)
+if pdf_paths:
+    from backend.services import get_services
+    st.session_state.load_test_upload = get_services().document_processor.process_pdf_paths(pdf_paths)
+
+runpy.run_path({app_path!r}, run_name="__main__")
+'''
+
+QUESTIONS = [
+    "What is vector search?",
+    "How does the cache affect latency?",
+    "Explain chunk and embedding.",
+    "What improves throughput?",
+    "How is recall measured?",
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Multi-session load test with AppTest and the local stub model")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4], help="同時に動かすワーカープロセス数（段階ごとに計測）")
+    parser.add_argument("--sessions", type=int, default=2, help="ワーカー1つあたりのセッション数")
+    parser.add_argument("--chats", type=int, default=3, help="セッションごとのチャット回数")
+    parser.add_argument("--pdf-dir", help="取り込むPDFのフォルダ（省略すると合成PDF）")
+    parser.add_argument("--pdfs", type=int, default=2, help="合成PDFのファイル数")
+    parser.add_argument("--evaluate", action="store_true", help="LLM採点（バックグラウンドジョブ）も流す")
+    parser.add_argument("--llm-latency-ms", type=int, default=300, help="スタブLLMの遅延")
+    parser.add_argument("--embedding", default="ngram", choices=["stub", "ngram"], help="埋め込みバックエンド")
+    parser.add_argument("--timeout", type=float, default=300, help="1回の再実行のタイムアウト（秒）")
+    parser.add_argument("--output", help="結果JSONの出力先")
+    parser.add_argument("--baseline", help="比べる過去の結果JSON")
+    # ワーカープロセス用（内部で使う）
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--pdf-paths", nargs="*", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def current_rss_mb() -> float:
+    """いまの常駐メモリ（MB）。/procがなければ最大値で代用"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 ** 2
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def percentiles(values):
+    """p50/p95/p99と平均（ms）"""
+    if not values:
+        return {}
+    ordered = sorted(values)
+    pick = lambda q: ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))] * 1000
+    return {"count": len(values), "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99), "mean_ms": statistics.fmean(values) * 1000}
+
+
+def child_env(args, store_dir):
+    """ワーカーの環境（ローカルスタブで、評価データは使い捨てのフォルダに書く）"""
+    env = dict(os.environ)
+    env.update({
+        "LLM_PROVIDER": "stub",
+        "EMBEDDING_BACKEND": "azure" if args.embedding == "stub" else args.embedding,
+        "LOCAL_STUB_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "RAGAS_DO_NOT_TRACK": "true",
+        "EVALUATION_STORE_PATH": os.path.join(store_dir, "evaluations.sqlite3"),
+        "EVALUATION_CACHE_PATH": os.path.join(store_dir, "evaluation_cache.sqlite3"),
+    })
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+class SessionDriver:
+    """1セッションぶんのAppTestと、再実行ごとのレイテンシ"""
+
+    def __init__(self, driver_path: str, timeout: float):
+        self.driver_path = driver_path
+        self.timeout = timeout
+        self.at = None
+        self.latencies = {}
+        self.errors = []
+
+    def step(self, action: str, operate=None):
+        """1回再実行してレイテンシを記録（operateで先にウィジェットを操作する）"""
+        from streamlit.testing.v1 import AppTest
+
+        start = time.perf_counter()
+        try:
+            if self.at is None:
+                self.at = AppTest.from_file(self.driver_path, default_timeout=self.timeout).run()
+            else:
+                (operate(self.at) if operate else self.at).run()
+        except Exception as e:
+            self.errors.append(f"{action}: {type(e).__name__}: {e}")
+            return
+        self.latencies.setdefault(action, []).append(time.perf_counter() - start)
+        self.errors.extend(f"{action}: {exception.value}" for exception in self.at.exception)
+
+    def click(self, label: str):
+        """ラベルを含むボタンを押す操作"""
+        def operate(at):
+            for button in at.button:
+                if label in button.label:
+                    return button.click()
+            raise LookupError(f"button not found: {label}")
+        return operate
+
+
+def run_worker(args):
+    """ワーカー: セッションを生かしたまま、ステップごとに全セッションを順番に再実行"""
+    from streamlit.testing.v1 import AppTest
+
+    baseline_rss = current_rss_mb()
+    with tempfile.NamedTemporaryFile("w", dir=ROOT, prefix=".load_test_driver_", suffix=".py", delete=False) as f:
+        f.write(DRIVER_SCRIPT.format(app_path=os.path.join(ROOT, "app.py")))
+        driver_path = f.name
+
+    try:
+        def upload(at):
+            at.session_state["load_test_pdf_paths"] = args.pdf_paths
+            return at
+
+        sessions = [SessionDriver(driver_path, args.timeout) for _ in range(args.sessions)]
+        steps = [("open", None), ("upload", upload)]
+        for index in range(args.chats):
+            question = QUESTIONS[index % len(QUESTIONS)]
+            steps.append(("chat", lambda at, question=question: at.chat_input[0].set_value(question)))
+        steps.append(("evaluation_page", lambda at: at.switch_page("pages/3_evaluation_page.py")))
+        steps.append(("fast_metrics", "⚡ 高速スコアを計算"))
+        if args.evaluate:
+            steps.append(("evaluate", "評価スタート"))
+
+        # 遅延インポートのぶんをセッションのメモリやレイテンシに数えないように、1セッションぶん先に流しておく
+        warmup = SessionDriver(driver_path, args.timeout)
+        for action, operate in steps:
+            warmup.step(action, warmup.click(operate) if isinstance(operate, str) else operate)
+        del warmup
+        warm_rss = current_rss_mb()
+
+        start = time.perf_counter()
+        rss_per_step = []
+        for action, operate in steps:
+            for session in sessions:
+                session.step(action, session.click(operate) if isinstance(operate, str) else operate)
+            rss_per_step.append(current_rss_mb())
+        # LLM採点はワーカースレッドで進むので、終わるまで再実行して待つ
+        evaluation_seconds = None
+        if args.evaluate:
+            from backend.evaluation_worker import evaluation_worker
+            eval_start = time.perf_counter()
+            job_ids = [
+                session.at.session_state["evaluation_job_id"]
+                for session in sessions if session.at and "evaluation_job_id" in session.at.session_state
+            ]
+            while any((job := evaluation_worker.get_job(job_id)) and job.is_active for job_id in job_ids):
+                time.sleep(0.5)
+            evaluation_seconds = time.perf_counter() - eval_start
+            for session in sessions:
+                session.step("evaluation_poll")
+        elapsed = time.perf_counter() - start
+        final_rss = current_rss_mb()
+    finally:
+        os.unlink(driver_path)
+
+    return {
+        "sessions": args.sessions,
+        "elapsed_seconds": elapsed,
+        "evaluation_seconds": evaluation_seconds,
+        "latencies": {
+            action: [latency for session in sessions for latency in session.latencies.get(action, [])]
+            for action in dict.fromkeys(action for session in sessions for action in session.latencies)
+        },
+        "errors": [error for session in sessions for error in session.errors],
+        "rss_mb": {"baseline": baseline_rss, "warm": warm_rss, "final": final_rss, "steps": rss_per_step},
+        "uploads": [
+            {key: session.at.session_state["load_test_upload"].get(key) for key in ("success", "file_count", "chunk_count")}
+            for session in sessions if session.at and "load_test_upload" in session.at.session_state
+        ],
+    }
+
+
+def run_level(args, concurrency: int, pdf_paths, store_dir):
+    """同時実行数ぶんのワーカーを一斉に起動して結果をまとめる"""
+    command = [
+        sys.executable, "-m", "benchmarks.load_test", "--worker",
+        "--sessions", str(args.sessions), "--chats", str(args.chats), "--timeout", str(args.timeout),
+        "--pdf-paths", *pdf_paths,
+    ]
+    if args.evaluate:
+        command.append("--evaluate")
+
+    start = time.perf_counter()
+    processes = [
+        subprocess.Popen(command, cwd=ROOT, env=child_env(args, os.path.join(store_dir, f"c{concurrency}_w{index}")),
+                         stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+        for index in range(concurrency)
+    ]
+    workers = []
+    for process in processes:
+        stdout, stderr = process.communicate()
+        if process.returncode != 0:
+            raise RuntimeError(f"worker failed:\n{stderr[-2000:]}")
+        workers.append(json.loads(stdout.strip().splitlines()[-1]))
+    wall = time.perf_counter() - start
+
+    latencies = {}
+    for worker in workers:
+        for action, values in worker["latencies"].items():
+            latencies.setdefault(action, []).extend(values)
+    reruns = sum(len(values) for values in latencies.values())
+    total_sessions = concurrency * args.sessions
+    growth = [(worker["rss_mb"]["final"] - worker["rss_mb"]["warm"]) / args.sessions for worker in workers]
+    return {
+        "concurrency": concurrency,
+        "sessions": total_sessions,
+        "wall_seconds": wall,
+        "reruns_per_sec": reruns / wall if wall else None,
+        "chats_per_sec": len(latencies.get("chat", [])) / wall if wall else None,
+        "rerun": percentiles([value for values in latencies.values() for value in values]),
+        "actions": {action: percentiles(values) for action, values in latencies.items()},
+        "rss_growth_mb_per_session": statistics.fmean(growth),
+        "worker_rss_mb": statistics.fmean(worker["rss_mb"]["final"] for worker in workers),
+        "evaluation_seconds": max((worker["evaluation_seconds"] or 0) for worker in workers) if args.evaluate else None,
+        "errors": [error for worker in workers for error in worker["errors"]][:20],
+        "uploads": [upload for worker in workers for upload in worker["uploads"]][:1],
+    }
+
+
+def print_level(level):
+    print(f"\nconcurrency {level['concurrency']} ({level['sessions']} sessions): "
+          f"{level['wall_seconds']:.1f}s, {level['reruns_per_sec']:.2f} reruns/s, {level['chats_per_sec']:.2f} chats/s, "
+          f"RSS +{level['rss_growth_mb_per_session']:.1f} MB/session (worker {level['worker_rss_mb']:.0f} MB)")
+    for action, stats in level["actions"].items():
+        print(f"  {action:>16}: p50 {stats['p50_ms']:8.1f} ms  p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms  (n={stats['count']})")
+    if level["evaluation_seconds"] is not None:
+        print(f"  {'llm evaluation':>16}: {level['evaluation_seconds']:.1f}s")
+    for error in level["errors"]:
+        print(f"  ❌ {error}")
+
+
+def print_comparison(results, baseline):
+    """過去の結果との差分を表示（同じ同時実行数どうし）"""
+    print(f"\ncompared with {baseline.get('revision')} ({baseline.get('created_at')}):")
+    before_levels = {level["concurrency"]: level for level in baseline.get("levels", [])}
+    for level in results["levels"]:
+        before = before_levels.get(level["concurrency"])
+        if not before:
+            continue
+        for name, value, old in [
+            ("rerun p95_ms", level["rerun"].get("p95_ms"), before["rerun"].get("p95_ms")),
+            ("chats_per_sec", level["chats_per_sec"], before["chats_per_sec"]),
+            ("rss_mb_per_session", level["rss_growth_mb_per_session"], before["rss_growth_mb_per_session"]),
+        ]:
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)):
+                change = f" ({(value - old) / old * 100:+.1f}%)" if old else ""
+                print(f"  c={level['concurrency']} {name:>20}: {old:10.2f} -> {value:10.2f}{change}")
+
+
+def git_revision():
+    """計測したコードのコミット（比較用）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        print(json.dumps(run_worker(args)))
+        return
+
+    from pathlib import Path
+    from benchmarks.synthetic import make_pdf_files
+
+    with tempfile.TemporaryDirectory(prefix="chatgal_load_") as work_dir:
+        if args.pdf_dir:
+            pdf_paths = sorted(str(path.resolve()) for path in Path(args.pdf_dir).glob("*.pdf"))
+        else:
+            os.makedirs(os.path.join(work_dir, "pdfs"))
+            pdf_paths = make_pdf_files(os.path.join(work_dir, "pdfs"), args.pdfs)
+
+        levels = []
+        for concurrency in args.concurrency:
+            level = run_level(args, concurrency, pdf_paths, work_dir)
+            print_level(level)
+            levels.append(level)
+
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "params": {
+            "sessions_per_worker": args.sessions,
+            "chats": args.chats,
+            "pdfs": len(pdf_paths),
+            "evaluate": args.evaluate,
+            "llm_latency_ms": args.llm_latency_ms,
+            "embedding": args.embedding,
+        },
+        "levels": levels,
+    }
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
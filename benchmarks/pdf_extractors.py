@@ -0,0 +1,208 @@
+# benchmarks/pdf_extractors.py
+"""PDF読み取りバックエンドごとの速さ・ピークメモリ・テキストの正確さを比べる
+
+使い方:
+    python -m benchmarks.pdf_extractors
+    python -m benchmarks.pdf_extractors --extractors pypdf pypdfium2 --runs 5 --output runs/pdf_extractors.json
+    python -m benchmarks.pdf_extractors --pdf-dir ./samples --reference pypdfium2
+
+合成サンプル（固定シードで毎回同じPDF）なら書き込んだ本文と比べ、--pdf-dir なら --reference のバックエンドの結果と比べるよ。
+メモリはバックエンドごとに新しいプロセスで測るので、前のバックエンドの読み込みに影響されないよ。
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import datetime
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 固定のサンプルセット: (名前, ファイル数, 1ファイルのページ数, 1ページの単語数)
+SAMPLE_SET = [
+    ("small", 5, 5, 350),
+    ("large", 1, 300, 600),
+]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compare PDF extraction backends")
+    parser.add_argument("--extractors", nargs="+", help="比べるバックエンド（省略すると使えるもの全部）")
+    parser.add_argument("--pdf-dir", help="PDFのフォルダ（省略すると合成サンプル）")
+    parser.add_argument("--reference", default="pypdf", help="--pdf-dirのときに正解とみなすバックエンド")
+    parser.add_argument("--runs", type=int, default=3, help="計測の回数（中央値を使う）")
+    parser.add_argument("--output", help="結果JSONの出力先")
+    parser.add_argument("--worker", help=argparse.SUPPRESS)
+    parser.add_argument("--files", nargs="*", help=argparse.SUPPRESS)
+    parser.add_argument("--texts-path", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def current_rss_mb() -> float:
+    """いまの常駐メモリ（MB）"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def peak_rss_mb() -> float:
+    """プロセスのピーク常駐メモリ（MB）"""
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024)
+
+
+def run_worker(args):
+    """1つのバックエンドでファイルを全部読んで、時間・メモリ・本文をJSONで返す（子プロセス）"""
+    from backend.upload import select_pdf_extractor
+
+    extractor = select_pdf_extractor(0, args.worker)
+    # インポートと初期化を済ませてからメモリの基準を取る
+    extractor.load(args.files[0])
+    baseline_rss = current_rss_mb()
+
+    timings = []
+    texts = {}
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        for file_path in args.files:
+            texts[file_path] = [doc.page_content for doc in extractor.load(file_path)]
+        timings.append(time.perf_counter() - start)
+
+    with open(args.texts_path, "w", encoding="utf-8") as f:
+        json.dump(texts, f, ensure_ascii=False)
+    print(json.dumps({
+        "seconds": statistics.median(timings),
+        "pages": sum(len(pages) for pages in texts.values()),
+        "peak_rss_mb": max(0.0, peak_rss_mb() - baseline_rss),
+    }))
+
+
+def make_samples(directory: str):
+    """固定シードの合成PDFを書き出す（{サンプル名: [(パス, ページ本文のリスト)]}）"""
+    from benchmarks.synthetic import PDF_VOCABULARY, write_pdf
+
+    rng = random.Random(0)
+    samples = {}
+    for name, n_files, pages_per_file, words_per_page in SAMPLE_SET:
+        files = []
+        for file_index in range(n_files):
+            pages = [
+                " ".join(rng.choice(PDF_VOCABULARY) for _ in range(words_per_page)) + "."
+                for _ in range(pages_per_file)
+            ]
+            path = os.path.join(directory, f"{name}_{file_index:03d}.pdf")
+            write_pdf(path, pages)
+            files.append((path, pages))
+        samples[name] = files
+    return samples
+
+
+def bigram_f1(expected: str, actual: str) -> float:
+    """空白を除いた文字バイグラムのF1（日本語でも単語分割なしで比べられる）"""
+    def bigrams(text):
+        text = "".join(text.split())
+        return Counter(text[i:i + 2] for i in range(len(text) - 1))
+
+    expected_bigrams, actual_bigrams = bigrams(expected), bigrams(actual)
+    overlap = sum((expected_bigrams & actual_bigrams).values())
+    if not overlap:
+        return 1.0 if not expected_bigrams and not actual_bigrams else 0.0
+    precision = overlap / sum(actual_bigrams.values())
+    recall = overlap / sum(expected_bigrams.values())
+    return 2 * precision * recall / (precision + recall)
+
+
+def fidelity(expected_pages, actual_pages) -> dict:
+    """ファイル1つぶんの正確さ（ページ数が合っているかと本文のバイグラムF1）"""
+    return {
+        "page_count_match": len(expected_pages) == len(actual_pages),
+        "bigram_f1": bigram_f1("".join(expected_pages), "".join(actual_pages)),
+    }
+
+
+def run_extractor(args, extractor: str, files, work_dir: str) -> dict:
+    """バックエンドを子プロセスで動かして結果と本文を受け取る"""
+    texts_path = os.path.join(work_dir, f"{extractor}.json")
+    command = [
+        sys.executable, "-m", "benchmarks.pdf_extractors", "--worker", extractor,
+        "--runs", str(args.runs), "--texts-path", texts_path, "--files", *files,
+    ]
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    completed = subprocess.run(command, cwd=ROOT, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(completed.stderr.strip().splitlines()[-1] if completed.stderr.strip() else "worker failed")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    with open(texts_path, encoding="utf-8") as f:
+        result["texts"] = json.load(f)
+    return result
+
+
+def main():
+    args = parse_args()
+    if args.worker:
+        run_worker(args)
+        return
+
+    sys.path.insert(0, ROOT)
+    from backend.upload import available_pdf_extractors
+
+    extractors = args.extractors or available_pdf_extractors()
+    results = {"created_at": datetime.now().isoformat(), "args": vars(args), "samples": {}}
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if args.pdf_dir:
+            paths = sorted(str(path) for path in Path(args.pdf_dir).glob("*.pdf"))
+            if not paths:
+                sys.exit(f"No PDF files found in {args.pdf_dir}")
+            reference = run_extractor(args, args.reference, paths, work_dir)["texts"]
+            samples = {"pdf_dir": [(path, reference[path]) for path in paths]}
+            print(f"📏 正解: {args.reference}")
+        else:
+            samples = make_samples(work_dir)
+
+        for sample_name, files in samples.items():
+            paths = [path for path, _ in files]
+            size_mb = sum(os.path.getsize(path) for path in paths) / 1024 ** 2
+            print(f"\n📚 {sample_name}: {len(paths)} files, {size_mb:.1f} MB")
+            print(f"{'extractor':>10} {'pages/s':>9} {'peak MB':>8} {'F1':>6} {'pages ok':>9}")
+            rows = []
+            for extractor in extractors:
+                try:
+                    result = run_extractor(args, extractor, paths, work_dir)
+                except Exception as e:
+                    print(f"{extractor:>10} ❌ {e}")
+                    rows.append({"extractor": extractor, "error": str(e)})
+                    continue
+                scores = [fidelity(expected, result["texts"].get(path, [])) for path, expected in files]
+                row = {
+                    "extractor": extractor,
+                    "pages": result["pages"],
+                    "seconds": result["seconds"],
+                    "pages_per_second": result["pages"] / result["seconds"] if result["seconds"] else 0.0,
+                    "peak_rss_mb": result["peak_rss_mb"],
+                    "bigram_f1": statistics.fmean(score["bigram_f1"] for score in scores),
+                    "page_count_match": all(score["page_count_match"] for score in scores),
+                }
+                rows.append(row)
+                print(f"{extractor:>10} {row['pages_per_second']:>9.1f} {row['peak_rss_mb']:>8.1f} "
+                      f"{row['bigram_f1']:>6.3f} {'yes' if row['page_count_match'] else 'no':>9}")
+            results["samples"][sample_name] = {"files": len(paths), "size_mb": size_mb, "results": rows}
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"\n📝 wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
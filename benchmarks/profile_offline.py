@@ -0,0 +1,109 @@
+# benchmarks/profile_offline.py
+"""ローカルスタブでアップロード・チャット・評価をオフラインでプロファイルする
+
+使い方:
+    python -m benchmarks.profile_offline --docs 10 --queries 20 --evaluate
+"""
+import argparse
+import cProfile
+import io
+import os
+import pstats
+import time
+from contextlib import contextmanager
+
+import streamlit as st
+
+from benchmarks.synthetic import make_documents, make_questions
+from config_manager import config_manager
+
+# オフライン計測なのでragasのテレメトリ送信を止める
+os.environ.setdefault("RAGAS_DO_NOT_TRACK", "true")
+
+
+@contextmanager
+def phase(name: str, timings: dict):
+    """フェーズごとの経過時間を記録"""
+    start = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - start
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Profile ChatGAL offline with the local stub provider")
+    parser.add_argument("--docs", type=int, default=10, help="合成ドキュメント（ファイル）数")
+    parser.add_argument("--pages", type=int, default=5, help="1ファイルあたりのページ数")
+    parser.add_argument("--queries", type=int, default=20, help="RAGチャットの質問数")
+    parser.add_argument("--k", type=int, default=10, help="検索結果数")
+    parser.add_argument("--evaluate", action="store_true", help="RAGAS評価もプロファイルする")
+    parser.add_argument("--metrics", nargs="+", default=["context_precision", "faithfulness"])
+    parser.add_argument("--llm-latency-ms", type=float, default=300)
+    parser.add_argument("--tokens-per-sec", type=float, default=50)
+    parser.add_argument("--embedding-latency-ms", type=float, default=120)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--top", type=int, default=25, help="表示する関数の数")
+    parser.add_argument("--profile-out", help="pstatsファイルの出力先")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    config_manager.configure_local_stub(
+        llm_latency_ms=args.llm_latency_ms,
+        tokens_per_second=args.tokens_per_sec,
+        embedding_latency_ms=args.embedding_latency_ms,
+        failure_rate=args.failure_rate,
+        rate_limit_rate=args.rate_limit_rate
+    )
+    st.session_state.search_params = {"k": args.k}
+
+    # stの初期化後にインポートする
+    from backend.upload import DocumentProcessor
+    from backend.chat import ChatService
+    from backend.evaluation import evaluation_service
+
+    document_processor = DocumentProcessor()
+
+    documents = make_documents(args.docs, pages_per_doc=args.pages)
+    questions = make_questions(args.queries)
+    chat_service = ChatService(document_processor)
+    timings = {}
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+
+    with phase("split", timings):
+        splits = document_processor.split_documents(documents)
+    with phase("ingest", timings):
+        document_processor.add_documents_to_vectorstore(splits)
+        st.session_state.processed_files.extend(
+            {"name": f"synthetic_{i:03d}.pdf", "size": 0, "pages": args.pages} for i in range(args.docs)
+        )
+    with phase("chat", timings):
+        failures = 0
+        for question in questions:
+            result = chat_service.chat_with_rag([{"role": "user", "content": question}], question)
+            failures += not result["success"]
+    if args.evaluate:
+        with phase("evaluate", timings):
+            evaluation_service.evaluate_all_chats(args.metrics)
+
+    profiler.disable()
+
+    print(f"documents: {len(documents)} pages -> {len(splits)} chunks, queries: {len(questions)}, chat failures: {failures}")
+    for name, elapsed in timings.items():
+        print(f"{name:>10}: {elapsed:8.3f} s")
+
+    stream = io.StringIO()
+    pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(args.top)
+    print(stream.getvalue())
+
+    if args.profile_out:
+        profiler.dump_stats(args.profile_out)
+        print(f"profile saved to {args.profile_out}")
+
+
+if __name__ == "__main__":
+    main()
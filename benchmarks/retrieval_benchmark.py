@@ -0,0 +1,260 @@
+# benchmarks/retrieval_benchmark.py
+"""チャンク分割・k・ベクトルストアを変えたときの検索品質と速度をオフラインで計測する
+
+使い方:
+    python -m benchmarks.retrieval_benchmark --embedding ngram --output runs/base.json
+    python -m benchmarks.retrieval_benchmark --embedding ngram --chunk-size 600 --baseline runs/base.json
+    python -m benchmarks.retrieval_benchmark --pdf-dir ./samples --save-golden golden.jsonl
+    python -m benchmarks.retrieval_benchmark --pdf-dir ./samples --golden golden.jsonl --k 5 10 20
+    python -m benchmarks.retrieval_benchmark --embedding azure --multi-query 3 --baseline runs/base.json
+
+正解は「どのファイルの、どの文を含むチャンクか」で持つので、チャンク分割を変えても同じ正解セットで比べられるよ。
+"""
+import argparse
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+import streamlit as st
+
+from benchmarks.synthetic import make_documents
+from config_manager import config_manager
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion and retrieval quality/latency offline")
+    parser.add_argument("--pdf-dir", help="PDFのフォルダ（省略すると合成コーパス）")
+    parser.add_argument("--docs", type=int, default=20, help="合成コーパスのファイル数")
+    parser.add_argument("--pages", type=int, default=5, help="合成コーパスの1ファイルあたりのページ数")
+    parser.add_argument("--golden", help="正解セットのJSONL（question, source_file, evidence）")
+    parser.add_argument("--save-golden", help="作った正解セットをJSONLで保存する")
+    parser.add_argument("--queries", type=int, default=200, help="正解セットを作るときの質問数")
+    parser.add_argument("--k", type=int, nargs="+", default=[1, 5, 10, 20], help="recall@kを出すk（最大のkで検索する）")
+    parser.add_argument("--chunk-size", type=int, help="split_documentsのchunk_size")
+    parser.add_argument("--chunk-overlap", type=int, help="split_documentsのchunk_overlap")
+    parser.add_argument("--embedding", default="ngram", choices=["stub", "ngram", "onnx", "azure"], help="埋め込みバックエンド")
+    parser.add_argument("--k-mode", choices=["fixed", "threshold", "gap"], default="fixed", help="検索結果数の決め方（fixed以外なら最大のkが上限）")
+    parser.add_argument("--min-k", type=int, default=2, help="k-modeがfixed以外のときの最低件数")
+    parser.add_argument("--score-threshold", type=float, default=0.75, help="k-modeがthresholdのときの類似度のしきい値")
+    parser.add_argument("--multi-query", type=int, default=0, help="言い換え検索の言い換え数（0なら使わない。azure以外ではLLMがスタブなので速度だけの参考）")
+    parser.add_argument("--trace-memory", action="store_true", help="tracemallocでPython側のピークメモリも測る（計測中は遅くなるよ）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="結果JSONの出力先")
+    parser.add_argument("--baseline", help="比べる過去の結果JSON")
+    return parser.parse_args()
+
+
+def configure_embedding(backend: str):
+    """埋め込みバックエンドを設定（LLMは使わないのでスタブ）"""
+    if backend == "azure":
+        config_manager.configure_from_env(embedding_backend="azure")
+    elif backend == "stub":
+        config_manager.configure_local_stub(embedding_backend="azure", embedding_latency_ms=0)
+    else:
+        config_manager.configure_local_stub(embedding_backend=backend)
+
+
+def load_documents(args, document_processor):
+    """PDFフォルダまたは合成コーパスをページ単位のDocumentとして読み込む"""
+    if not args.pdf_dir:
+        return make_documents(args.docs, pages_per_doc=args.pages, seed=args.seed)
+    documents = []
+    for pdf_path in sorted(Path(args.pdf_dir).glob("*.pdf")):
+        documents.extend(document_processor.load_pdf_path(str(pdf_path)))
+    return documents
+
+
+def make_golden_set(documents, n_queries: int, seed: int = 0):
+    """ページから1文を抜き出して、その文を質問・根拠にした正解セットを作る"""
+    rng = random.Random(seed)
+    golden = []
+    for _ in range(n_queries):
+        document = documents[rng.randrange(len(documents))]
+        sentences = [s.strip() for s in re.split(r"(?<=[。．.!?！？])", document.page_content) if len(s.strip()) > 10]
+        if sentences:
+            sentence = rng.choice(sentences)
+            golden.append({
+                "question": sentence,
+                "source_file": document.metadata.get("source_file"),
+                "evidence": sentence,
+            })
+    return golden
+
+
+def is_relevant(doc, case) -> bool:
+    """検索結果のチャンクが正解の根拠を含んでいるか"""
+    if case.get("source_file") and doc.metadata.get("source_file") != case["source_file"]:
+        return False
+    return case["evidence"] in doc.page_content
+
+
+def percentile_ms(values, q):
+    return float(np.percentile(values, q) * 1000) if values else None
+
+
+def git_revision():
+    """計測したコードのコミット（比較用）"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_comparison(results, baseline):
+    """過去の結果との差分を表示"""
+    print(f"\ncompared with {baseline.get('revision')} ({baseline.get('created_at')}):")
+    for section in ("ingest", "search", "quality", "memory"):
+        for name, value in results[section].items():
+            before = baseline.get(section, {}).get(name)
+            if isinstance(value, (int, float)) and isinstance(before, (int, float)):
+                change = f" ({(value - before) / before * 100:+.1f}%)" if before else ""
+                print(f"  {section}.{name:>22}: {before:10.4f} -> {value:10.4f}{change}")
+
+
+def main():
+    args = parse_args()
+    configure_embedding(args.embedding)
+    max_k = max(args.k)
+    st.session_state.search_params = {"k": max_k, "k_mode": args.k_mode, "min_k": args.min_k, "score_threshold": args.score_threshold}
+
+    # stの初期化後にインポートする
+    from backend.upload import CHUNK_OVERLAP, CHUNK_SIZE, DocumentProcessor
+
+    document_processor = DocumentProcessor()
+
+    chunk_size = args.chunk_size or CHUNK_SIZE
+    chunk_overlap = args.chunk_overlap if args.chunk_overlap is not None else CHUNK_OVERLAP
+
+    if args.trace_memory:
+        tracemalloc.start()
+
+    start = time.perf_counter()
+    documents = load_documents(args, document_processor)
+    load_seconds = time.perf_counter() - start
+
+    if args.golden:
+        with open(args.golden, encoding="utf-8") as f:
+            golden = [json.loads(line) for line in f if line.strip()]
+    else:
+        golden = make_golden_set(documents, args.queries, args.seed)
+    if args.save_golden:
+        with open(args.save_golden, "w", encoding="utf-8") as f:
+            for case in golden:
+                f.write(json.dumps(case, ensure_ascii=False) + "\n")
+
+    start = time.perf_counter()
+    splits = document_processor.split_documents(documents, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    split_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    document_processor.add_documents_to_vectorstore(splits)
+    index_seconds = time.perf_counter() - start
+    ingest_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    tracemalloc.reset_peak()
+
+    chat_service = None
+    if args.multi_query:
+        from backend.chat import ChatService
+        chat_service = ChatService(document_processor)
+
+    latencies = []
+    expansion_latencies = []
+    first_hits = []
+    returned = []
+    for case in golden:
+        variants = None
+        if chat_service:
+            start = time.perf_counter()
+            variants = chat_service.generate_query_variants(case["question"], args.multi_query)
+            expansion_latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        results = document_processor.search_documents(case["question"], variants=variants)
+        latencies.append(time.perf_counter() - start)
+        returned.append(len(results))
+        first_hits.append(next((rank for rank, doc in enumerate(results, 1) if is_relevant(doc, case)), None))
+
+    search_peak = tracemalloc.get_traced_memory()[1] if args.trace_memory else None
+    tracemalloc.stop()
+
+    ingest_seconds = load_seconds + split_seconds + index_seconds
+    results = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "params": {
+            "corpus": args.pdf_dir or f"synthetic:{args.docs}x{args.pages}",
+            "embedding": args.embedding,
+            "chunk_size": chunk_size,
+            "chunk_overlap": chunk_overlap,
+            "k": args.k,
+            "k_mode": args.k_mode,
+            "min_k": args.min_k,
+            "score_threshold": args.score_threshold,
+            "multi_query": args.multi_query,
+            "queries": len(golden),
+            "seed": args.seed,
+        },
+        "ingest": {
+            "pages": len(documents),
+            "chunks": len(splits),
+            "load_seconds": load_seconds,
+            "split_seconds": split_seconds,
+            "index_seconds": index_seconds,
+            "pages_per_sec": len(documents) / ingest_seconds if ingest_seconds else None,
+            "chunks_per_sec": len(splits) / ingest_seconds if ingest_seconds else None,
+        },
+        "search": {
+            "p50_ms": percentile_ms(latencies, 50),
+            "p95_ms": percentile_ms(latencies, 95),
+            "mean_ms": float(np.mean(latencies) * 1000) if latencies else None,
+            # 言い換えを作るLLM呼び出し（検索の時間には含めない）
+            "expansion_p50_ms": percentile_ms(expansion_latencies, 50),
+        },
+        "quality": {
+            **{
+                f"recall@{k}": float(np.mean([rank is not None and rank <= k for rank in first_hits])) if first_hits else None
+                for k in sorted(args.k)
+            },
+            "mrr": float(np.mean([1 / rank if rank else 0.0 for rank in first_hits])) if first_hits else None,
+            # 1回の検索で文脈に入る平均件数（プロンプトの大きさの目安）
+            "mean_chunks": float(np.mean(returned)) if returned else None,
+        },
+        "memory": {
+            "ingest_peak_mb": ingest_peak / 1024 ** 2 if ingest_peak is not None else None,
+            "search_peak_mb": search_peak / 1024 ** 2 if search_peak is not None else None,
+            # Linuxではキロバイト、macOSではバイト
+            "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024),
+        },
+    }
+
+    print(f"corpus: {len(documents)} pages -> {len(splits)} chunks, golden queries: {len(golden)}")
+    for section in ("ingest", "search", "quality", "memory"):
+        for name, value in results[section].items():
+            print(f"  {section}.{name:>22}: {value:.4f}" if isinstance(value, float) else f"  {section}.{name:>22}: {value}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            print_comparison(results, json.load(f))
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
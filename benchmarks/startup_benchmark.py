@@ -0,0 +1,197 @@
+# benchmarks/startup_benchmark.py
+"""コールドスタートの計測（ページごとのインポート時間・初回描画・最初のチャット1ターンまでの時間）
+
+使い方:
+    python -m benchmarks.startup_benchmark
+    python -m benchmarks.startup_benchmark --runs 5 --output runs/startup.json --raw-dir runs/importtime
+    python -m benchmarks.startup_benchmark --baseline runs/startup.json
+
+毎回新しいPythonプロセスで計測するので、2回目以降のインポートキャッシュに惑わされないよ。
+最初のチャットは合成資料を入れた状態でRAGの1ターンを流して、遅れて読み込まれる重いモジュールのぶんも測るよ。
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ページを開いたときに読み込まれるモジュール（app.pyのサイドバー + 各ページ）
+PAGE_IMPORTS = {
+    "chat_page": "import config_manager, search_settings, ui.chat_ui",
+    "upload_page": "import config_manager, search_settings, ui.upload_ui",
+    "evaluation_page": "import config_manager, search_settings, ui.evaluation_ui",
+}
+
+# AppTestでapp.py（最初のページ＝チャット）を1回描画するスクリプト
+FIRST_RENDER_SCRIPT = """
+import json, time
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+imported = time.perf_counter()
+at = AppTest.from_file("app.py", default_timeout=120).run()
+done = time.perf_counter()
+print(json.dumps({"harness_seconds": imported - start, "first_render_seconds": done - imported, "exceptions": [str(e.value) for e in at.exception]}))
+"""
+
+# 合成資料を入れて最初のチャット1ターン（RAG + 評価データの保存）を流すスクリプト
+FIRST_CHAT_SCRIPT = """
+import json, os, sys, time
+from streamlit.testing.v1 import AppTest
+from benchmarks.synthetic import make_documents
+at = AppTest.from_file("app.py", default_timeout=120).run()
+from backend.vector_index import VectorIndex
+services = at.session_state["services"]
+vectorstore = VectorIndex(services.config.get_embedding())
+vectorstore.add_documents(make_documents(2))
+services.document_processor.set_vectorstore(vectorstore, 3)
+at.session_state["processed_files"] = [{"name": "synthetic_000.pdf", "size": 1, "pages": 5}]
+at.run()
+modules = set(sys.modules)
+start = time.perf_counter()
+at.chat_input[0].set_value("ベクトル検索って何？").run()
+done = time.perf_counter()
+with open(os.environ["CHAT_TRACE_PATH"], encoding="utf-8") as f:
+    spans = json.loads(f.readlines()[-1])["spans"]
+print(json.dumps({
+    "first_chat_seconds": done - start,
+    "evaluation_capture_ms": sum(span["duration_ms"] for span in spans if span["name"] == "evaluation_capture"),
+    "heavy_modules_loaded": sorted(name for name in ("ragas", "pandas", "pyarrow") if name in sys.modules and name not in modules),
+    "exceptions": [str(e.value) for e in at.exception],
+}))
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Measure cold-start import time and first render latency")
+    parser.add_argument("--runs", type=int, default=3, help="計測の回数（中央値を使う）")
+    parser.add_argument("--top", type=int, default=15, help="表示する重いモジュールの数")
+    parser.add_argument("--raw-dir", help="-X importtimeの生ログを保存するフォルダ")
+    parser.add_argument("--output", help="結果JSONの出力先")
+    parser.add_argument("--baseline", help="比べる過去の結果JSON")
+    return parser.parse_args()
+
+
+def child_env():
+    """子プロセスの環境（Azureに繋がないようにローカルスタブで起動）"""
+    env = dict(os.environ)
+    env.setdefault("LLM_PROVIDER", "stub")
+    env.setdefault("RAGAS_DO_NOT_TRACK", "true")
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    return env
+
+
+def run_importtime(statement: str):
+    """新しいプロセスで-X importtimeを取り、(自分の時間, 累積時間, 深さ, モジュール名)の一覧を返す"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            rows.append((int(self_us), int(cumulative_us), len(indent) // 2, name))
+    return rows, result.stderr
+
+
+def run_first_render():
+    """新しいプロセスでapp.pyを1回描画して時間を測る"""
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_RENDER_SCRIPT],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def run_first_chat(work_dir: str):
+    """新しいプロセスで最初のチャット1ターンを流して時間を測る（評価データとトレースは作業フォルダに書く）"""
+    env = child_env()
+    env.update({
+        "LOCAL_STUB_LLM_LATENCY_MS": "0",
+        "LOCAL_STUB_TOKENS_PER_SEC": "0",
+        "CHAT_TRACE_PATH": os.path.join(work_dir, "traces.jsonl"),
+        "EVALUATION_STORE_PATH": os.path.join(work_dir, "evaluations.sqlite3"),
+        "EVALUATION_CACHE_PATH": os.path.join(work_dir, "evaluation_cache.sqlite3"),
+    })
+    result = subprocess.run(
+        [sys.executable, "-c", FIRST_CHAT_SCRIPT],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    args = parse_args()
+    if args.raw_dir:
+        os.makedirs(args.raw_dir, exist_ok=True)
+
+    results = {"created_at": datetime.now().isoformat(timespec="seconds"), "imports": {}, "heaviest": {}}
+    for page, statement in PAGE_IMPORTS.items():
+        totals = []
+        for run in range(args.runs):
+            rows, raw = run_importtime(statement)
+            # 一番外側のインポートの累積時間を足すと全体になる
+            totals.append(sum(cumulative for _, cumulative, depth, _ in rows if depth == 0) / 1e6)
+            if args.raw_dir and run == 0:
+                with open(os.path.join(args.raw_dir, f"{page}.log"), "w", encoding="utf-8") as f:
+                    f.write(raw)
+        results["imports"][f"{page}_seconds"] = statistics.median(totals)
+        heaviest = sorted(rows, key=lambda row: row[0], reverse=True)[:args.top]
+        results["heaviest"][page] = [{"module": name, "self_ms": self_us / 1000, "cumulative_ms": cumulative_us / 1000} for self_us, cumulative_us, _, name in heaviest]
+
+    renders = [run_first_render() for _ in range(args.runs)]
+    results["first_render"] = {
+        "first_render_seconds": statistics.median(render["first_render_seconds"] for render in renders),
+        "harness_seconds": statistics.median(render["harness_seconds"] for render in renders),
+    }
+    exceptions = [message for render in renders for message in render["exceptions"]]
+    if exceptions:
+        results["first_render"]["exceptions"] = exceptions
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        chats = [run_first_chat(work_dir) for _ in range(args.runs)]
+    results["first_chat"] = {
+        "first_chat_seconds": statistics.median(chat["first_chat_seconds"] for chat in chats),
+        "evaluation_capture_seconds": statistics.median(chat["evaluation_capture_ms"] for chat in chats) / 1000,
+        "heavy_modules_loaded": sorted({name for chat in chats for name in chat["heavy_modules_loaded"]}),
+    }
+    exceptions = [message for chat in chats for message in chat["exceptions"]]
+    if exceptions:
+        results["first_chat"]["exceptions"] = exceptions
+
+    for name, value in {**results["imports"], **results["first_render"], **results["first_chat"]}.items():
+        print(f"{name:>24}: {value:.3f} s" if isinstance(value, float) else f"{name:>24}: {value}")
+    print(f"\nheaviest modules on the chat page (self time):")
+    for row in results["heaviest"]["chat_page"]:
+        print(f"  {row['self_ms']:8.1f} ms  (cumulative {row['cumulative_ms']:8.1f} ms)  {row['module']}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\ncompared with {baseline.get('created_at')}:")
+        for section in ("imports", "first_render", "first_chat"):
+            for name, value in results[section].items():
+                before = baseline.get(section, {}).get(name)
+                if isinstance(value, float) and isinstance(before, (int, float)) and before:
+                    print(f"  {name:>24}: {before:.3f} -> {value:.3f} s ({(value - before) / before * 100:+.1f}%)")
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+# benchmarks/synthetic.py
+import random
+from typing import List
+
+from langchain.schema import Document
+
+# 合成コーパス用の語彙（それっぽい日本語の技術文書になるように）
+VOCABULARY = [
+    "ベクトル検索", "埋め込み", "チャンク", "評価指標", "レイテンシ", "スループット",
+    "メモリ", "キャッシュ", "インデックス", "クエリ", "トークン", "プロンプト",
+    "データセット", "モデル", "推論", "学習", "精度", "再現率", "適合率", "文書",
+    "セッション", "ストリーミング", "バッチ処理", "並列化", "非同期", "スケジューラ",
+]
+PARTICLES = ["は", "が", "を", "に", "で", "と", "の"]
+ENDINGS = ["です。", "である。", "となる。", "を示す。", "が重要だ。"]
+
+
+def make_sentence(rng: random.Random, n_words: int = 6) -> str:
+    """ランダムな文を1つ生成"""
+    words = []
+    for _ in range(n_words):
+        words.append(rng.choice(VOCABULARY))
+        words.append(rng.choice(PARTICLES))
+    return "".join(words[:-1]) + rng.choice(ENDINGS)
+
+
+def make_documents(n_docs: int, pages_per_doc: int = 5, chars_per_page: int = 2000, seed: int = 0) -> List[Document]:
+    """PDFを読み込んだ後と同じ形（1ページ1Document）の合成ドキュメントを生成"""
+    rng = random.Random(seed)
+    documents = []
+    for doc_index in range(n_docs):
+        file_name = f"synthetic_{doc_index:03d}.pdf"
+        for page in range(pages_per_doc):
+            sentences = []
+            length = 0
+            while length < chars_per_page:
+                sentence = make_sentence(rng)
+                sentences.append(sentence)
+                length += len(sentence)
+            documents.append(Document(
+                page_content="".join(sentences),
+                metadata={
+                    "source": file_name,
+                    "page": page,
+                    "page_label": str(page + 1),
+                    "source_file": file_name,
+                    "file_size": chars_per_page * pages_per_doc * 3,
+                }
+            ))
+    return documents
+
+
+def make_questions(n_questions: int, seed: int = 1) -> List[str]:
+    """合成の質問文を生成"""
+    rng = random.Random(seed)
+    return [f"{rng.choice(VOCABULARY)}と{rng.choice(VOCABULARY)}の関係を教えて？" for _ in range(n_questions)]
+
+
+# 合成PDF用の語彙（標準フォントで書けるように英語）
+PDF_VOCABULARY = [
+    "vector", "search", "embedding", "chunk", "latency", "throughput", "memory", "cache",
+    "index", "query", "token", "prompt", "dataset", "model", "inference", "recall",
+    "precision", "document", "session", "streaming", "batch", "parallel", "async", "scheduler",
+]
+
+
+def write_pdf(path: str, pages: List[str], line_length: int = 80):
+    """テキストだけの最小限のPDFを書き出す（PyPDFLoaderで読める形）"""
+    objects = {
+        1: "<< /Type /Catalog /Pages 2 0 R >>",
+        3: "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    }
+    kids = []
+    next_id = 4
+    for text in pages:
+        text = text.replace("\\", "").replace("(", "").replace(")", "")
+        lines = [text[i:i + line_length] for i in range(0, len(text), line_length)]
+        stream = "BT /F1 10 Tf 40 780 Td 12 TL " + " ".join(f"({line}) '" for line in lines) + " ET"
+        content_id, page_id = next_id, next_id + 1
+        next_id += 2
+        objects[content_id] = f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream"
+        objects[page_id] = (
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Contents {content_id} 0 R /Resources << /Font << /F1 3 0 R >> >> >>"
+        )
+        kids.append(page_id)
+    objects[2] = f"<< /Type /Pages /Kids [{' '.join(f'{kid} 0 R' for kid in kids)}] /Count {len(kids)} >>"
+
+    output = b"%PDF-1.4\n"
+    offsets = {}
+    for object_id in sorted(objects):
+        offsets[object_id] = len(output)
+        output += f"{object_id} 0 obj\n{objects[object_id]}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    for object_id in sorted(objects):
+        output += f"{offsets[object_id]:010d} 00000 n \n".encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    with open(path, "wb") as f:
+        f.write(output)
+
+
+def make_pdf_files(directory: str, n_files: int, pages_per_file: int = 5, words_per_page: int = 350, seed: int = 0) -> List[str]:
+    """合成のPDFファイルを書き出してパスの一覧を返す"""
+    rng = random.Random(seed)
+    paths = []
+    for file_index in range(n_files):
+        pages = [
+            " ".join(rng.choice(PDF_VOCABULARY) for _ in range(words_per_page)) + "."
+            for _ in range(pages_per_file)
+        ]
+        path = f"{directory}/synthetic_{file_index:03d}.pdf"
+        write_pdf(path, pages)
+        paths.append(path)
+    return paths
@@ -1,15 +1,39 @@
 # config_manager.py
 import streamlit as st
-from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
 from dotenv import load_dotenv
 import os
 
+# langchain_openaiやローカルモデルは読み込みが重いので、モデルを作るときに読み込む（起動を速くするため）
+
 load_dotenv()
 
+# 設定方法の選択肢（LLM_PROVIDER環境変数でデフォルトを切り替えられる）
+CONFIG_METHODS = ["手動で入力", "環境変数から読み込み", "ローカルスタブ"]
+PROVIDER_DEFAULTS = {"manual": 0, "env": 1, "stub": 2}
+
+# 埋め込みバックエンド（EMBEDDING_BACKEND環境変数でデプロイごとに切り替えられる）
+EMBEDDING_BACKENDS = {
+    "azure": "Azure OpenAI",
+    "ngram": "文字n-gramハッシュ (CPU)",
+    "onnx": "ONNXモデル (CPU)"
+}
+
+AZURE_EMBEDDING_VARS = [
+    "AZURE_OPENAI_EMBEDDING_ENDPOINT",
+    "AZURE_OPENAI_EMBEDDING_API_KEY",
+    "AZURE_OPENAI_EMBEDDING_API_VERSION",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"
+]
+
+# ONNXモデルの読み込みは重いので、セッションをまたいで使い回す
+_local_embeddings = {}
+
 class ConfigManager:
     def __init__(self):
         self.embedding = None
         self.llm = None
+        # いま適用している設定（同じ設定なら再実行のたびにクライアントを作り直さない）
+        self._applied = None
     
     def render_sidebar_config(self):
         """サイドバーに設定UIを表示"""
@@ -18,52 +42,35 @@ class ConfigManager:
         # 設定方法の選択
         config_method = st.sidebar.radio(
             "設定方法を選んでね〜💕",
-            ["手動で入力", "環境変数から読み込み",],
+            CONFIG_METHODS,
+            index=PROVIDER_DEFAULTS.get(os.environ.get("LLM_PROVIDER", "manual"), 0),
             help="Azure OpenAIのモデルを設定するよ〜",
-            captions=["Azure OpenAIの値を設定してね", ".envファイルをおいてローカルで立ち上げてね"]
+            captions=[
+                "Azure OpenAIの値を設定してね",
+                ".envファイルをおいてローカルで立ち上げてね",
+                "Azureなしのオフライン動作だよ（ベンチマーク・CI用）"
+            ]
         )
         
         if config_method == "手動で入力":
             return self._load_from_sidebar()
-        else:
+        elif config_method == "環境変数から読み込み":
             return self._load_from_env()
+        else:
+            return self._load_local_stub()
     
     def _load_from_env(self):
         """環境変数から設定を読み込み"""
+        embedding_backend = self._render_embedding_backend_selector()
+        
         try:
-            required_vars = [
-                "AZURE_OPENAI_EMBEDDING_ENDPOINT",
-                "AZURE_OPENAI_EMBEDDING_API_KEY",
-                "AZURE_OPENAI_EMBEDDING_API_VERSION",
-                "AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME",
-                "AZURE_OPENAI_CHAT_ENDPOINT",
-                "AZURE_OPENAI_CHAT_API_KEY",
-                "AZURE_OPENAI_CHAT_API_VERSION",
-                "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"
-            ]
-            
-            missing_vars = [var for var in required_vars if not os.environ.get(var)]
+            missing_vars = self.get_missing_env_vars(embedding_backend)
             
             if missing_vars:
                 st.sidebar.error(f"❌ 環境変数が足りないよ〜: {', '.join(missing_vars)}")
                 return False
             
-            self.embedding = AzureOpenAIEmbeddings(
-                azure_endpoint=os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"],
-                api_key=os.environ["AZURE_OPENAI_EMBEDDING_API_KEY"],
-                api_version=os.environ["AZURE_OPENAI_EMBEDDING_API_VERSION"],
-                azure_deployment=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
-                model=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]
-            )
-            
-            self.llm = AzureChatOpenAI(
-                azure_endpoint=os.environ["AZURE_OPENAI_CHAT_ENDPOINT"],
-                api_key=os.environ["AZURE_OPENAI_CHAT_API_KEY"],
-                api_version=os.environ["AZURE_OPENAI_CHAT_API_VERSION"],
-                azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-                model=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
-                temperature=0
-            )
+            self._apply_once(("env", embedding_backend), lambda: self.configure_from_env(embedding_backend))
             
             st.sidebar.success("✅ 環境変数から読み込み完了〜")
             return True
@@ -72,6 +79,49 @@ class ConfigManager:
             st.sidebar.error(f"❌ 環境変数の読み込みエラー: {str(e)}")
             return False
     
+    def get_missing_env_vars(self, embedding_backend="azure"):
+        """足りない環境変数の一覧を取得"""
+        required_vars = [
+            "AZURE_OPENAI_CHAT_ENDPOINT",
+            "AZURE_OPENAI_CHAT_API_KEY",
+            "AZURE_OPENAI_CHAT_API_VERSION",
+            "AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"
+        ]
+        if embedding_backend == "azure":
+            required_vars = AZURE_EMBEDDING_VARS + required_vars
+        
+        return [var for var in required_vars if not os.environ.get(var)]
+    
+    def configure_from_env(self, embedding_backend=None):
+        """環境変数からモデルを設定（UIなしでも使える）"""
+        from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
+        
+        embedding_backend = embedding_backend or os.environ.get("EMBEDDING_BACKEND", "azure")
+        missing_vars = self.get_missing_env_vars(embedding_backend)
+        if missing_vars:
+            raise ValueError(f"Missing environment variables: {', '.join(missing_vars)}")
+        
+        if embedding_backend == "azure":
+            self.embedding = AzureOpenAIEmbeddings(
+                azure_endpoint=os.environ["AZURE_OPENAI_EMBEDDING_ENDPOINT"],
+                api_key=os.environ["AZURE_OPENAI_EMBEDDING_API_KEY"],
+                api_version=os.environ["AZURE_OPENAI_EMBEDDING_API_VERSION"],
+                azure_deployment=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"],
+                model=os.environ["AZURE_OPENAI_EMBEDDING_DEPLOYMENT_NAME"]
+            )
+        else:
+            self.embedding = self._build_local_embedding(embedding_backend)
+        
+        self.llm = AzureChatOpenAI(
+            azure_endpoint=os.environ["AZURE_OPENAI_CHAT_ENDPOINT"],
+            api_key=os.environ["AZURE_OPENAI_CHAT_API_KEY"],
+            api_version=os.environ["AZURE_OPENAI_CHAT_API_VERSION"],
+            azure_deployment=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
+            model=os.environ["AZURE_OPENAI_CHAT_DEPLOYMENT_NAME"],
+            temperature=0
+        )
+        return True
+    
     def _load_from_sidebar(self):
         """サイドバーから手動入力で設定"""
         st.sidebar.subheader("📝 埋め込みモデル設定")
@@ -83,30 +133,34 @@ class ConfigManager:
         if "connection_tested" not in st.session_state:
             st.session_state.connection_tested = False
         
-        # Embedding設定
-        embedding_endpoint = st.sidebar.text_input(
-            "埋め込みモデルエンドポイント",
-            value=st.session_state.azure_config.get("embedding_endpoint", ""),
-            help="https://sample.openai.azure.com/"
-        )
+        embedding_backend = self._render_embedding_backend_selector()
         
-        embedding_api_key = st.sidebar.text_input(
-            "埋め込みモデルAPIキー",
-            value=st.session_state.azure_config.get("embedding_api_key", ""),
-            type="password"
-        )
-        
-        embedding_api_version = st.sidebar.text_input(
-            "埋め込みモデルAPIバージョン",
-            value=st.session_state.azure_config.get("embedding_api_version", ""),
-            help="2023-05-15"
-        )
-        
-        embedding_deployment = st.sidebar.text_input(
-            "埋め込みモデルデプロイ名",
-            value=st.session_state.azure_config.get("embedding_deployment", ""),
-            help="sample-embedding-3-large"
-        )
+        # Embedding設定（ローカルバックエンドのときはAzureの入力は不要）
+        embedding_endpoint = embedding_api_key = embedding_api_version = embedding_deployment = ""
+        if embedding_backend == "azure":
+            embedding_endpoint = st.sidebar.text_input(
+                "埋め込みモデルエンドポイント",
+                value=st.session_state.azure_config.get("embedding_endpoint", ""),
+                help="https://sample.openai.azure.com/"
+            )
+            
+            embedding_api_key = st.sidebar.text_input(
+                "埋め込みモデルAPIキー",
+                value=st.session_state.azure_config.get("embedding_api_key", ""),
+                type="password"
+            )
+            
+            embedding_api_version = st.sidebar.text_input(
+                "埋め込みモデルAPIバージョン",
+                value=st.session_state.azure_config.get("embedding_api_version", ""),
+                help="2023-05-15"
+            )
+            
+            embedding_deployment = st.sidebar.text_input(
+                "埋め込みモデルデプロイ名",
+                value=st.session_state.azure_config.get("embedding_deployment", ""),
+                help="sample-embedding-3-large"
+            )
         
         st.sidebar.subheader("💬 チャットモデル設定")
         
@@ -147,34 +201,26 @@ class ConfigManager:
             "chat_deployment": chat_deployment
         })
         
+        st.session_state.azure_config["embedding_backend"] = embedding_backend
+        
         # 接続テストボタン
-        if all(var for var in st.session_state.azure_config.values()) and st.session_state.connection_tested == False:
+        config_keys = ["chat_endpoint", "chat_api_key", "chat_api_version", "chat_deployment"]
+        if embedding_backend == "azure":
+            config_keys += ["embedding_endpoint", "embedding_api_key", "embedding_api_version", "embedding_deployment"]
+        if all(st.session_state.azure_config[key] for key in config_keys) and st.session_state.connection_tested == False:
             if st.sidebar.button("🔌 接続テスト", type="primary"):
                 return self._test_connection()
         
         # 全ての必須フィールドが入力されているかチェック
-        required_fields = [
-            embedding_endpoint, embedding_api_key, embedding_deployment,
-            chat_endpoint, chat_api_key, chat_deployment
-        ]
+        required_fields = [chat_endpoint, chat_api_key, chat_deployment]
+        if embedding_backend == "azure":
+            required_fields += [embedding_endpoint, embedding_api_key, embedding_deployment]
         
         if all(field.strip() for field in required_fields):
             try:
-                self.embedding = AzureOpenAIEmbeddings(
-                    azure_endpoint=embedding_endpoint,
-                    api_key=embedding_api_key,
-                    api_version=embedding_api_version,
-                    azure_deployment=embedding_deployment,
-                    model=embedding_deployment
-                )
-                
-                self.llm = AzureChatOpenAI(
-                    azure_endpoint=chat_endpoint,
-                    api_key=chat_api_key,
-                    api_version=chat_api_version,
-                    azure_deployment=chat_deployment,
-                    model=chat_deployment,
-                    temperature=0
+                self._apply_once(
+                    ("manual", embedding_backend, *(st.session_state.azure_config[key] for key in config_keys)),
+                    lambda: self._configure_manual(embedding_backend, st.session_state.azure_config)
                 )
                 
                 if st.session_state.connection_tested:
@@ -191,8 +237,44 @@ class ConfigManager:
             st.sidebar.warning("⚠️ 全ての項目を入力してね〜")
             return False
     
+    def _configure_manual(self, embedding_backend, config):
+        """手動入力の値からモデルを設定"""
+        from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
+        
+        if embedding_backend == "azure":
+            self.embedding = AzureOpenAIEmbeddings(
+                azure_endpoint=config["embedding_endpoint"],
+                api_key=config["embedding_api_key"],
+                api_version=config["embedding_api_version"],
+                azure_deployment=config["embedding_deployment"],
+                model=config["embedding_deployment"]
+            )
+        else:
+            self.embedding = self._build_local_embedding(embedding_backend)
+        
+        self.llm = AzureChatOpenAI(
+            azure_endpoint=config["chat_endpoint"],
+            api_key=config["chat_api_key"],
+            api_version=config["chat_api_version"],
+            azure_deployment=config["chat_deployment"],
+            model=config["chat_deployment"],
+            temperature=0
+        )
+        return True
+    
+    def _apply_once(self, signature, configure):
+        """設定が前回と同じならモデルを作り直さない（再実行のたびのクライアント生成を省く）"""
+        if self._applied == signature and self.is_configured():
+            return True
+        self._applied = None
+        result = configure()
+        self._applied = signature
+        return result
+    
     def _test_connection(self):
         """接続テスト"""
+        from langchain_openai import AzureOpenAIEmbeddings, AzureChatOpenAI
+        
         try:
             config = st.session_state.azure_config
 
@@ -201,13 +283,16 @@ class ConfigManager:
             status_placeholder.info("🔄 接続テスト中...")
             
             # Embeddingテスト
-            test_embedding = AzureOpenAIEmbeddings(
-                azure_endpoint=config["embedding_endpoint"],
-                api_key=config["embedding_api_key"],
-                api_version=config["embedding_api_version"],
-                azure_deployment=config["embedding_deployment"],
-                model=config["embedding_deployment"]
-            )
+            if config.get("embedding_backend", "azure") == "azure":
+                test_embedding = AzureOpenAIEmbeddings(
+                    azure_endpoint=config["embedding_endpoint"],
+                    api_key=config["embedding_api_key"],
+                    api_version=config["embedding_api_version"],
+                    azure_deployment=config["embedding_deployment"],
+                    model=config["embedding_deployment"]
+                )
+            else:
+                test_embedding = self._build_local_embedding(config["embedding_backend"])
             
             # LLMテスト
             test_llm = AzureChatOpenAI(
@@ -231,6 +316,7 @@ class ConfigManager:
             # 成功したら設定を保存
             self.embedding = test_embedding
             self.llm = test_llm
+            self._applied = None
 
             # 接続成功状態を保存
             st.session_state.connection_tested = True
@@ -247,6 +333,100 @@ class ConfigManager:
             st.session_state.connection_tested = False
             return False
     
+    def _render_embedding_backend_selector(self):
+        """埋め込みバックエンドの選択UI（デフォルトはEMBEDDING_BACKEND環境変数）"""
+        backends = list(EMBEDDING_BACKENDS.keys())
+        default_backend = os.environ.get("EMBEDDING_BACKEND", "azure")
+        return st.sidebar.selectbox(
+            "🧬 埋め込みバックエンド",
+            backends,
+            index=backends.index(default_backend) if default_backend in backends else 0,
+            format_func=lambda backend: EMBEDDING_BACKENDS[backend],
+            help="ローカルバックエンドなら検索のたびのAzure往復がなくなるよ〜⚡"
+        )
+    
+    def _build_local_embedding(self, backend, **options):
+        """CPUローカルの埋め込みモデルを作成（同じ設定ならインスタンスを使い回す）"""
+        from backend.local_models import NgramHashingEmbeddings, OnnxEmbeddings
+        
+        if backend == "ngram":
+            dimensions = int(options.get("dimensions", os.environ.get("LOCAL_EMBEDDING_DIM", 2048)))
+            cache_key = (backend, dimensions)
+            if cache_key not in _local_embeddings:
+                _local_embeddings[cache_key] = NgramHashingEmbeddings(dimensions=dimensions)
+        elif backend == "onnx":
+            model_path = options.get("model_path", os.environ.get("LOCAL_EMBEDDING_MODEL_PATH"))
+            if not model_path:
+                raise ValueError("LOCAL_EMBEDDING_MODEL_PATH is not set")
+            cache_key = (backend, model_path)
+            if cache_key not in _local_embeddings:
+                _local_embeddings[cache_key] = OnnxEmbeddings(model_path)
+        else:
+            raise ValueError(f"Unknown embedding backend: {backend}")
+        
+        return _local_embeddings[cache_key]
+    
+    def _load_local_stub(self):
+        """ローカルスタブを設定（環境変数の値をデフォルトにしてサイドバーで調整）"""
+        with st.sidebar.expander("🧪 スタブの設定", expanded=False):
+            latency_ms = st.number_input(
+                "LLMの遅延 (ms)", min_value=0, value=int(os.environ.get("LOCAL_STUB_LLM_LATENCY_MS", 300))
+            )
+            tokens_per_second = st.number_input(
+                "トークンレート (tokens/sec)", min_value=0.0,
+                value=float(os.environ.get("LOCAL_STUB_TOKENS_PER_SEC", 50))
+            )
+            failure_rate = st.slider(
+                "エラー率", 0.0, 1.0, float(os.environ.get("LOCAL_STUB_FAILURE_RATE", 0.0))
+            )
+            rate_limit_rate = st.slider(
+                "429発生率", 0.0, 1.0, float(os.environ.get("LOCAL_STUB_RATE_LIMIT_RATE", 0.0))
+            )
+        
+        options = dict(
+            llm_latency_ms=latency_ms,
+            tokens_per_second=tokens_per_second,
+            failure_rate=failure_rate,
+            rate_limit_rate=rate_limit_rate
+        )
+        self._apply_once(("stub", *sorted(options.items())), lambda: self.configure_local_stub(**options))
+        st.sidebar.success("✅ ローカルスタブで動いてるよ〜（Azureには繋がないよ）")
+        return True
+    
+    def configure_local_stub(self, **options):
+        """ローカルスタブのモデルを設定（UIなしでも使える）"""
+        from backend.local_models import StubEmbeddings, StubChatModel
+        
+        def option(name, env_var, default, cast=float):
+            if name in options:
+                return cast(options[name])
+            return cast(os.environ.get(env_var, default))
+        
+        seed = option("seed", "LOCAL_STUB_SEED", 0, int)
+        
+        # ローカル埋め込みバックエンドが指定されていれば検索品質の出るそっちを使う
+        embedding_backend = option("embedding_backend", "EMBEDDING_BACKEND", "azure", str)
+        if embedding_backend in ("ngram", "onnx"):
+            self.embedding = self._build_local_embedding(embedding_backend)
+        else:
+            self.embedding = StubEmbeddings(
+                dimensions=option("embedding_dimensions", "LOCAL_STUB_EMBEDDING_DIM", 256, int),
+                latency_ms=option("embedding_latency_ms", "LOCAL_STUB_EMBEDDING_LATENCY_MS", 0),
+                per_text_latency_ms=option("embedding_per_text_latency_ms", "LOCAL_STUB_EMBEDDING_PER_TEXT_LATENCY_MS", 0),
+                rate_limit_rate=option("embedding_rate_limit_rate", "LOCAL_STUB_EMBEDDING_RATE_LIMIT_RATE", 0),
+                seed=seed
+            )
+        
+        self.llm = StubChatModel(
+            latency_ms=option("llm_latency_ms", "LOCAL_STUB_LLM_LATENCY_MS", 300),
+            tokens_per_second=option("tokens_per_second", "LOCAL_STUB_TOKENS_PER_SEC", 50),
+            response_tokens=option("response_tokens", "LOCAL_STUB_RESPONSE_TOKENS", 80, int),
+            failure_rate=option("failure_rate", "LOCAL_STUB_FAILURE_RATE", 0),
+            rate_limit_rate=option("rate_limit_rate", "LOCAL_STUB_RATE_LIMIT_RATE", 0),
+            seed=seed
+        )
+        return True
+    
     def is_configured(self):
         """設定が完了しているかチェック"""
         return self.embedding is not None and self.llm is not None
@@ -258,6 +438,13 @@ class ConfigManager:
     def get_llm(self):
         """LLMインスタンスを取得"""
         return self.llm
+    
+    def get_llm_name(self, llm=None):
+        """LLMのデプロイ名を取得（評価キャッシュのキーなどに使う）"""
+        llm = llm or self.llm
+        if llm is None:
+            return None
+        return getattr(llm, "deployment_name", None) or getattr(llm, "model_name", None) or llm._llm_type
 
 # グローバルインスタンス
 config_manager = ConfigManager()
\ No newline at end of file
@@ -1,5 +1,6 @@
 import streamlit as st
 from ui.chat_ui import render_chat_with_processor
-from backend.upload import document_processor
+from backend.services import get_services
 
-render_chat_with_processor(document_processor)
\ No newline at end of file
+services = get_services()
+render_chat_with_processor(services.document_processor, services.chat_service)
\ No newline at end of file
@@ -1,12 +1,21 @@
 import streamlit as st
-from backend.upload import document_processor
-from config_manager import config_manager
+from backend.services import get_services
+from backend.upload import DEFAULT_K_MODE, DEFAULT_MIN_K, DEFAULT_SCORE_THRESHOLD, K_MODES
+
+K_MODE_LABELS = {
+    "fixed": "いつも同じ数",
+    "threshold": "似てる度がしきい値以上だけ",
+    "gap": "スコアがガクッと下がるところまで",
+}
 
 def render_search_settings():
     st.sidebar.header("🔍 検索設定")
 
     if 'search_params' not in st.session_state:
-        st.session_state.search_params = {'k': 10}
+        st.session_state.search_params = {'k': 10, 'multi_query': False}
+    # あとから増えた設定は既定値で埋める
+    for key, value in (('k_mode', DEFAULT_K_MODE), ('min_k', DEFAULT_MIN_K), ('score_threshold', DEFAULT_SCORE_THRESHOLD)):
+        st.session_state.search_params.setdefault(key, value)
 
     current_params = st.session_state['search_params']
 
@@ -16,23 +25,57 @@ def render_search_settings():
         min_value=1,
         max_value=20,
         value=current_params['k'],
-        help="一度に取得する関連文書の数だよ〜。多いほど詳しく答えられるけど、処理が重くなるかも💦"
+        help="一度に取得する関連文書の数だよ〜。多いほど詳しく答えられるけど、処理が重くなるかも💦 数の決め方が「いつも同じ数」以外のときは上限になるよ"
+    )
+
+    # 検索結果数の決め方
+    k_mode = st.sidebar.selectbox(
+        "📏 数の決め方",
+        options=list(K_MODES),
+        index=list(K_MODES).index(current_params['k_mode']) if current_params['k_mode'] in K_MODES else 0,
+        format_func=lambda mode: K_MODE_LABELS[mode],
+        help="関係ありそうな資料だけに絞ると、プロンプトが短くなって答えが速く安くなるよ⚡"
     )
+    min_k = current_params['min_k']
+    score_threshold = current_params['score_threshold']
+    if k_mode != "fixed":
+        min_k = st.sidebar.slider("🔻 最低でも入れる数", min_value=1, max_value=k_value, value=min(min_k, k_value))
+    if k_mode == "threshold":
+        score_threshold = st.sidebar.slider(
+            "🎚️ 似てる度のしきい値", min_value=0.0, max_value=1.0, value=float(score_threshold), step=0.01,
+            help="埋め込みモデルによって似てる度の出方が違うから、処理時間の内訳のスコアを見ながら調整してね🔍"
+        )
+
+    # 言い換え検索の設定
+    multi_query = st.sidebar.checkbox(
+        "🔀 言い換えでも探す",
+        value=current_params.get('multi_query', False),
+        help="質問を何パターンか言い換えて一緒に探すよ〜。短い質問やあいまいな質問に強くなるけど、LLMの呼び出しが1回増えるよ💦"
+    )
+
+    new_params = {
+        'k': k_value,
+        'multi_query': multi_query,
+        'k_mode': k_mode,
+        'min_k': min_k,
+        'score_threshold': score_threshold,
+    }
 
     # 変更があるかチェック
-    has_changes = (k_value != current_params['k'])
+    has_changes = any(current_params.get(key) != value for key, value in new_params.items())
 
     if st.sidebar.button("✅ 設定を適用", type="primary", disabled=not has_changes):
-        if config_manager.is_configured():
+        if get_services().config.is_configured():
             apply_search_settings(k_value)
-            st.session_state.search_params = {'k': k_value}
+            st.session_state.search_params = new_params
         else:
             st.sidebar.error("⚠️ Azure OpenAI設定を先に行ってね")
 
 def apply_search_settings(k, silent=False):
     """検索設定を適用"""
     try:
-        if not st.session_state.retriever:
+        document_processor = get_services().document_processor
+        if not document_processor.retriever:
             document_processor.initialize_vectorstore()
 
         document_processor.update_retriever_params(k=k)
@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# リポジトリ直下をimportできるようにする（app.pyと同じくbackend/をトップから読む）
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
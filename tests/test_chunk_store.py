@@ -0,0 +1,68 @@
+# tests/test_chunk_store.py
+import pytest
+
+from backend.chunk_store import ChunkStore
+
+
+@pytest.fixture(params=["memory", "mmap"])
+def chunks(request, tmp_path):
+    store = ChunkStore(str(tmp_path) if request.param == "mmap" else None)
+    yield store
+    store.close()
+
+
+def test_append_and_read_back(chunks):
+    first = chunks.append("こんにちは", {"source_file": "a.pdf", "page": 1})
+    second = chunks.append("world", {"source_file": "a.pdf", "page": 2, "tags": ["x"]})
+
+    assert chunks.text(first) == "こんにちは"
+    assert chunks.metadata(second) == {"source_file": "a.pdf", "page": 2, "tags": ["x"]}
+    assert chunks.value(first, "page") == 1
+    assert chunks.value(first, "missing", "default") == "default"
+    assert chunks.document(second, "id-2").id == "id-2"
+
+
+def test_empty_text(chunks):
+    row = chunks.append("")
+    assert chunks.text(row) == ""
+    chunks.append("after")
+    assert chunks.text(row) == ""
+    assert chunks.text(row + 1) == "after"
+
+
+def test_replace_reuses_the_slot_when_the_text_fits(chunks):
+    row = chunks.append("hello world", {"page": 1})
+    other = chunks.append("other")
+    chunks.text(row)
+    size = chunks.nbytes
+
+    chunks.replace(row, "hey", {"page": 2})
+
+    assert chunks.text(row) == "hey"
+    assert chunks.text(other) == "other"
+    assert chunks.metadata(row) == {"page": 2}
+    assert chunks.nbytes == size
+
+
+def test_replace_appends_when_the_text_grows(chunks):
+    row = chunks.append("short")
+    other = chunks.append("other")
+    size = chunks.nbytes
+
+    chunks.replace(row, "a much longer text")
+
+    assert chunks.text(row) == "a much longer text"
+    assert chunks.text(other) == "other"
+    assert chunks.nbytes == size + len("a much longer text")
+
+
+def test_compact_keeps_only_selected_rows(chunks):
+    for index in range(3):
+        chunks.append(f"text {index}", {"page": index})
+
+    compacted = chunks.compact([2, 0])
+
+    assert len(compacted) == 2
+    assert [compacted.text(row) for row in range(2)] == ["text 2", "text 0"]
+    assert compacted.metadata(0) == {"page": 2}
+    compacted.close()
@@ -0,0 +1,49 @@
+# tests/test_evaluation_aggregates.py
+import math
+
+import numpy as np
+import pytest
+
+from backend.evaluation_aggregates import MetricsAggregate
+
+
+def test_confidence_interval_matches_sample_statistics():
+    scores = [0.2, 0.4, 0.6, 0.8]
+    aggregate = MetricsAggregate(["score"])
+    # 10件中4件だけ採点済み
+    aggregate.upsert_many(range(10), range(10), [[score] for score in scores] + [[None]] * 6)
+
+    low, high = aggregate.confidence_intervals(z=1.96)["score"]
+
+    mean = np.mean(scores)
+    margin = 1.96 * math.sqrt(np.var(scores, ddof=1) / 4 * (10 - 4) / (10 - 1))
+    assert low == pytest.approx(mean - margin)
+    assert high == pytest.approx(mean + margin)
+
+
+def test_confidence_interval_collapses_when_everything_is_scored():
+    aggregate = MetricsAggregate(["score"])
+    aggregate.upsert_many([1, 2, 3], [0, 1, 2], [[0.1], [0.5], [0.9]])
+
+    assert aggregate.confidence_intervals()["score"] == pytest.approx((0.5, 0.5))
+
+
+def test_confidence_interval_needs_two_scores():
+    aggregate = MetricsAggregate(["score", "other"])
+    aggregate.upsert_many([1, 2], [0, 1], [[0.3, 0.1], [None, 0.2]])
+
+    intervals = aggregate.confidence_intervals()
+    assert intervals["score"] is None
+    assert intervals["other"] is not None
+
+
+def test_upsert_replaces_previous_scores():
+    aggregate = MetricsAggregate(["score"])
+    aggregate.upsert_many([1, 2, 3], [0, 1, 2], [[0.1], [None], [0.3]])
+    aggregate.upsert_many([2, 3], [1, 2], [[0.5], [0.7]])
+
+    assert len(aggregate) == 3
+    assert aggregate.count("score") == 3
+    assert aggregate.averages()["score"] == pytest.approx((0.1 + 0.5 + 0.7) / 3)
+    low, high = aggregate.confidence_intervals()["score"]
+    assert low == pytest.approx(high)
@@ -0,0 +1,67 @@
+# tests/test_evaluation_migration.py
+import json
+import sqlite3
+import time
+
+from backend.evaluation_cache import EvaluationCache, make_cache_key
+from backend.evaluation_capture import ChatEvaluation
+from backend.evaluation_store import EvaluationStore
+from backend.upload import make_chunk_id
+
+# 文脈の本文を行ごとに持っていたころのテーブル
+INLINE_CONTEXTS_SCHEMA = (
+    "CREATE TABLE evaluations ("
+    "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+    "timestamp REAL NOT NULL, session_id TEXT, "
+    "question TEXT NOT NULL, answer TEXT NOT NULL, "
+    "contexts TEXT NOT NULL, source_files TEXT NOT NULL, "
+    "context_precision REAL, context_recall REAL, faithfulness REAL, "
+    "answer_relevancy REAL, overall_score REAL)"
+)
+
+
+def write_inline_store(path, contexts):
+    connection = sqlite3.connect(path)
+    connection.execute(INLINE_CONTEXTS_SCHEMA)
+    connection.execute(
+        "INSERT INTO evaluations (timestamp, question, answer, contexts, source_files) VALUES (?, ?, ?, ?, ?)",
+        (time.time(), "質問", "回答", json.dumps(contexts), json.dumps(["a.pdf"])),
+    )
+    connection.commit()
+    connection.close()
+
+
+def test_migration_uses_make_chunk_id(tmp_path):
+    path = str(tmp_path / "evaluations.sqlite3")
+    write_inline_store(path, ["文脈その1", "文脈その2"])
+
+    store = EvaluationStore(item_factory=ChatEvaluation, path=path)
+    item = store.scan()[0]
+
+    assert item.context_ids == [make_chunk_id("文脈その1"), make_chunk_id("文脈その2")]
+    assert store.get_chunk_texts(item.context_ids) == {
+        make_chunk_id("文脈その1"): "文脈その1",
+        make_chunk_id("文脈その2"): "文脈その2",
+    }
+    columns = {row[1] for row in store.connection.execute("PRAGMA table_info(evaluations)")}
+    assert "contexts" not in columns
+    store.connection.close()
+
+
+def test_judge_cache_written_before_migration_still_hits(tmp_path, monkeypatch):
+    from backend.evaluation import EvaluationService
+
+    path = str(tmp_path / "evaluations.sqlite3")
+    contexts = ["文脈その1", "文脈その2"]
+    write_inline_store(path, contexts)
+    # チャンクID参照にする前は本文のリストでキーを作っていた
+    cache = EvaluationCache(str(tmp_path / "cache.sqlite3"))
+    cache.put_many([(make_cache_key("質問", "回答", contexts, "context_precision", "judge"), "context_precision", "judge", 0.42)])
+
+    store = EvaluationStore(item_factory=ChatEvaluation, path=path)
+    service = EvaluationService(cache=cache, store=store)
+    monkeypatch.setattr(service.config, "get_llm_name", lambda llm=None: "judge")
+    service.evaluate_items(store.scan(), ["context_precision"])
+
+    assert store.scan()[0].context_precision == 0.42
+    store.connection.close()
@@ -0,0 +1,51 @@
+# tests/test_evaluation_sampling.py
+from datetime import datetime
+from types import SimpleNamespace
+
+from backend.evaluation_sampling import stratified_sample
+
+
+def _chat(source_file, fast_relevancy=None):
+    return SimpleNamespace(
+        timestamp=datetime(2024, 1, 1),
+        answer="回答",
+        source_files=[source_file],
+        fast_relevancy=fast_relevancy,
+        fast_grounding=None,
+    )
+
+
+def test_allocation_is_proportional_for_unequal_strata():
+    # 90件・4件・3件・2件・1件の層から10件だけ取る
+    sizes = {"a.pdf": 90, "b.pdf": 4, "c.pdf": 3, "d.pdf": 2, "e.pdf": 1}
+    items = [_chat(name) for name, size in sizes.items() for _ in range(size)]
+
+    sample = stratified_sample(items, [(1, 100)] * len(items), max_calls=10, seed=0)
+
+    counts = {key[0]: count for key, count in sample.allocation.items()}
+    assert len(sample.items) == 10
+    assert counts["a.pdf"] == 9
+    assert sum(counts.values()) - counts["a.pdf"] == 1
+
+
+def test_outlier_stratum_is_not_oversampled():
+    # 高速スコアの低い10件は外れ値の層になるけど、取る件数は全体に比例したまま
+    items = [_chat("a.pdf", 0.0) for _ in range(10)] + [_chat("a.pdf", 1.0) for _ in range(90)]
+
+    sample = stratified_sample(items, [(1, 100)] * len(items), max_calls=20, seed=0)
+
+    counts = {key[3]: count for key, count in sample.allocation.items()}
+    assert counts == {True: 2, False: 18}
+
+
+def test_budget_cut_keeps_strata_proportional():
+    # コストがばらついて予算の途中で打ち切っても、小さい層に偏らない
+    items = [_chat("a.pdf") for _ in range(80)] + [_chat("b.pdf") for _ in range(20)]
+    costs = [(1 if index % 2 else 3, 100) for index in range(80)] + [(2, 100)] * 20
+
+    for seed in range(8):
+        sample = stratified_sample(items, costs, max_calls=20, seed=seed)
+
+        counts = {key[0]: count for key, count in sample.allocation.items()}
+        assert sample.estimated_calls <= 20
+        assert counts["b.pdf"] <= 0.25 * len(sample.items)
@@ -0,0 +1,119 @@
+# tests/test_evaluation_store.py
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.evaluation_capture import ChatEvaluation
+from backend.evaluation_store import EvaluationStore
+
+
+def make_item(context_ids, overall_score=None, workspace_id=None, timestamp=None):
+    return ChatEvaluation(
+        timestamp=timestamp or datetime.now(),
+        question="質問",
+        answer="回答",
+        context_ids=list(context_ids),
+        source_files=["a.pdf"],
+        overall_score=overall_score,
+        workspace_id=workspace_id,
+    )
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = EvaluationStore(item_factory=ChatEvaluation, path=str(tmp_path / "evaluations.sqlite3"))
+    yield store
+    store.connection.close()
+
+
+def chunk_ids(store):
+    return [row[0] for row in store.connection.execute("SELECT id FROM chunks ORDER BY id")]
+
+
+def test_workspace_view_only_sees_its_own_rows(store):
+    alice = store.for_workspace("alice")
+    bob = store.for_workspace("bob")
+    alice.append(make_item(["c1", "c2"], 0.5), {"c1": "one", "c2": "two"})
+    bob.append(make_item(["c2", "c3"], 0.9), {"c2": "two", "c3": "three"})
+
+    assert alice.count() == 1
+    assert bob.count() == 1
+    assert store.count() == 2
+    assert [item.workspace_id for item in alice.scan()] == ["alice"]
+    assert [item.workspace_id for batch in bob.iter_batches() for item in batch] == ["bob"]
+    assert alice.averages()["overall_score"] == pytest.approx(0.5)
+    assert bob.averages()["overall_score"] == pytest.approx(0.9)
+    assert store.averages()["overall_score"] == pytest.approx(0.7)
+    # 他のワークスペースだけが参照しているチャンクの本文は引けない
+    assert alice.get_chunk_texts(["c1", "c2", "c3"]) == {"c1": "one", "c2": "two"}
+
+
+def test_workspace_view_cannot_update_other_sessions(store):
+    store.for_workspace("alice").append(make_item(["c1"]), {"c1": "one"})
+    bob = store.for_workspace("bob")
+    item = store.scan()[0]
+    item.overall_score = 1.0
+
+    bob.update_scores([item])
+
+    assert store.scan()[0].overall_score is None
+    assert bob.averages()["evaluated"] == 0
+
+
+def test_clear_workspace_keeps_other_workspaces_and_drops_orphan_chunks(store):
+    alice = store.for_workspace("alice")
+    bob = store.for_workspace("bob")
+    alice.append(make_item(["c1", "c2"], 0.5), {"c1": "one", "c2": "two"})
+    bob.append(make_item(["c2", "c3"], 0.9), {"c2": "two", "c3": "three"})
+    assert store.averages()["total"] == 2
+
+    alice.clear()
+
+    assert alice.count() == 0
+    assert bob.count() == 1
+    assert chunk_ids(store) == ["c2", "c3"]
+    assert store.averages()["total"] == 1
+    assert store.averages()["overall_score"] == pytest.approx(0.9)
+
+
+def test_rows_survive_reopening_the_store(tmp_path):
+    path = str(tmp_path / "evaluations.sqlite3")
+    store = EvaluationStore(item_factory=ChatEvaluation, path=path)
+    old = datetime.now() - timedelta(days=365)
+    store.for_workspace("alice").append(make_item(["c1"], 0.5, timestamp=old), {"c1": "one"})
+    store.flush()
+    store.connection.close()
+
+    # 新しいセッションでも同じワークスペースなら同じ履歴が見える
+    reopened = EvaluationStore(item_factory=ChatEvaluation, path=path)
+    alice = reopened.for_workspace("alice")
+    assert alice.count() == 1
+    assert alice.get_chunk_texts(["c1"]) == {"c1": "one"}
+    reopened.connection.close()
+
+
+def test_retention_is_opt_in(tmp_path):
+    path = str(tmp_path / "evaluations.sqlite3")
+    store = EvaluationStore(item_factory=ChatEvaluation, path=path)
+    expired = datetime.now() - timedelta(days=40)
+    store.for_workspace("alice").append(make_item(["old"], timestamp=expired), {"old": "old text"})
+    store.for_workspace("alice").append(make_item(["new"]), {"new": "new text"})
+    store.flush()
+    store.connection.close()
+
+    reopened = EvaluationStore(item_factory=ChatEvaluation, path=path, retention_days=30)
+    assert reopened.count() == 1
+    assert chunk_ids(reopened) == ["new"]
+    reopened.connection.close()
+
+
+def test_purge_older_than(store):
+    store.append(make_item(["cli"], timestamp=datetime.now() - timedelta(days=10)), {"cli": "cli text"})
+    store.for_workspace("alice").append(make_item(["c1"]), {"c1": "one"})
+    assert store.averages()["total"] == 2
+
+    store.purge_older_than(7)
+
+    assert [item.workspace_id for item in store.scan()] == ["alice"]
+    assert chunk_ids(store) == ["c1"]
+    assert store.averages()["total"] == 1
@@ -0,0 +1,103 @@
+# tests/test_retrieval.py
+import pytest
+from langchain_core.documents import Document
+
+from backend.upload import select_adaptive_docs, select_adaptive_k
+from backend.vector_index import RRF_K, reciprocal_rank_fusion
+
+
+def doc(doc_id):
+    return Document(id=doc_id, page_content=doc_id)
+
+
+def test_rrf_sums_reciprocal_ranks_across_queries():
+    fused = reciprocal_rank_fusion(
+        [
+            [(doc("a"), 0.9), (doc("b"), 0.8), (doc("c"), 0.7)],
+            [(doc("b"), 0.95), (doc("c"), 0.6)],
+        ],
+        k=3,
+    )
+
+    assert [d.id for d, _, _ in fused] == ["b", "c", "a"]
+    scores = {d.id: score for d, score, _ in fused}
+    assert scores["b"] == pytest.approx(1 / (RRF_K + 2) + 1 / (RRF_K + 1))
+    assert scores["c"] == pytest.approx(1 / (RRF_K + 3) + 1 / (RRF_K + 2))
+    assert scores["a"] == pytest.approx(1 / (RRF_K + 1))
+
+
+def test_rrf_keeps_best_similarity_and_truncates_to_k():
+    fused = reciprocal_rank_fusion(
+        [
+            [(doc("a"), 0.5), (doc("b"), 0.4)],
+            [(doc("a"), 0.7), (doc("c"), 0.3)],
+        ],
+        k=2,
+        rrf_k=0,
+    )
+
+    assert len(fused) == 2
+    first, rrf_score, similarity = fused[0]
+    assert first.id == "a"
+    assert rrf_score == pytest.approx(2.0)
+    assert similarity == pytest.approx(0.7)
+
+
+def test_rrf_with_no_results():
+    assert reciprocal_rank_fusion([[], []], k=5) == []
+
+
+SCORES = [0.9, 0.85, 0.8, 0.5, 0.45]
+
+
+def test_adaptive_k_fixed_uses_every_result():
+    assert select_adaptive_k(SCORES, "fixed") == 5
+
+
+def test_adaptive_k_threshold_keeps_scores_above_it():
+    assert select_adaptive_k(SCORES, "threshold", min_k=1, threshold=0.8) == 3
+    # しきい値を超えるのが少なくても min_k 件は残す
+    assert select_adaptive_k(SCORES, "threshold", min_k=2, threshold=0.88) == 2
+
+
+def test_adaptive_k_gap_cuts_at_the_largest_drop():
+    assert select_adaptive_k(SCORES, "gap", min_k=1) == 3
+    # min_k 件目より前の落ち込みは見ない
+    assert select_adaptive_k([0.9, 0.2, 0.19, 0.1], "gap", min_k=2) == 3
+
+
+def test_adaptive_k_clamps_min_k_to_the_results():
+    assert select_adaptive_k([0.3], "threshold", min_k=5, threshold=0.9) == 1
+    assert select_adaptive_k([0.9, 0.1], "gap", min_k=5) == 2
+    assert select_adaptive_k([], "gap") == 0
+
+
+def scored(doc_id, score, rrf_score=None):
+    metadata = {"score": score}
+    if rrf_score is not None:
+        metadata["rrf_score"] = rrf_score
+    return Document(id=doc_id, page_content=doc_id, metadata=metadata)
+
+
+def test_threshold_filters_by_similarity_when_rrf_order_disagrees():
+    # RRFの順（a, b, c, d）と類似度の順（c, a, d, b）がずれている
+    docs = [scored("a", 0.82, 0.033), scored("b", 0.40, 0.032), scored("c", 0.90, 0.031), scored("d", 0.78, 0.016)]
+
+    chosen = select_adaptive_docs(docs, "threshold", min_k=1, threshold=0.75)
+
+    assert [doc.id for doc in chosen] == ["a", "c", "d"]
+
+
+def test_threshold_pads_to_min_k_from_the_head_in_rrf_order():
+    docs = [scored("a", 0.50, 0.033), scored("b", 0.40, 0.032), scored("c", 0.90, 0.031), scored("d", 0.30, 0.016)]
+
+    chosen = select_adaptive_docs(docs, "threshold", min_k=3, threshold=0.75)
+
+    assert [doc.id for doc in chosen] == ["a", "b", "c"]
+
+
+def test_gap_uses_the_rrf_score_order():
+    docs = [scored("a", 0.5, 0.033), scored("b", 0.9, 0.032), scored("c", 0.8, 0.010)]
+
+    assert [doc.id for doc in select_adaptive_docs(docs, "gap", min_k=1)] == ["a", "b"]
+    assert select_adaptive_docs(docs, "fixed") == docs
@@ -0,0 +1,60 @@
+# tests/test_usage.py
+import pytest
+
+from backend.usage import TokenBudgetExceeded, UsageLedger
+
+
+def test_status_moves_from_ok_to_throttled_to_exceeded():
+    ledger = UsageLedger(budgets={None: 1000}, throttle_ratio=0.8)
+    assert ledger.status() == "ok"
+
+    ledger.record("chat", prompt_tokens=700, completion_tokens=99)
+    assert ledger.status() == "ok"
+    assert ledger.remaining() == 201
+
+    ledger.record("chat", completion_tokens=1)
+    assert ledger.status() == "throttled"
+
+    ledger.record("evaluation", prompt_tokens=150, embedding_tokens=50)
+    assert ledger.status() == "exceeded"
+    assert ledger.remaining() == 0
+
+
+def test_feature_budget_only_limits_that_feature():
+    ledger = UsageLedger(budgets={None: None, "evaluation": 100}, throttle_ratio=0.5)
+    ledger.record("chat", prompt_tokens=10_000)
+    assert ledger.status("chat") == "ok"
+    assert ledger.remaining("chat") is None
+
+    ledger.record("evaluation", prompt_tokens=60)
+    assert ledger.status("evaluation") == "throttled"
+    assert ledger.remaining("evaluation") == 40
+
+    ledger.record("evaluation", completion_tokens=40)
+    assert ledger.status("evaluation") == "exceeded"
+
+
+def test_remaining_uses_the_smaller_of_total_and_feature_budget():
+    ledger = UsageLedger(budgets={None: 500, "chat": 1000})
+    ledger.record("ingest", embedding_tokens=400)
+    assert ledger.remaining("chat") == 100
+
+
+def test_check_rejects_calls_over_the_remaining_budget():
+    ledger = UsageLedger(budgets={None: 100})
+    ledger.check("chat", estimated_tokens=100)
+    with pytest.raises(TokenBudgetExceeded):
+        ledger.check("chat", estimated_tokens=101)
+
+    ledger.record("chat", prompt_tokens=100)
+    with pytest.raises(TokenBudgetExceeded):
+        ledger.check("chat")
+
+
+def test_no_budget_never_throttles():
+    ledger = UsageLedger(budgets={None: None})
+    ledger.record("chat", prompt_tokens=10**9)
+    assert ledger.status() == "ok"
+    ledger.check("chat", estimated_tokens=10**9)
+    assert ledger.usage().total_tokens == 10**9
+    assert ledger.usage("chat").calls == 1
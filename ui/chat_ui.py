@@ -4,9 +4,16 @@ import random
 from typing import List
 from backend.chat import ChatService
 
+# 毎回チャット吹き出しで描画する最新メッセージの数（これより古いものは過去ログのページにまとめる）
+LIVE_MESSAGE_WINDOW = 20
+# 過去ログ1ページのメッセージ数
+HISTORY_PAGE_SIZE = 20
+
+ROLE_LABELS = {"user": "🙋 あなた", "assistant": "🦄 ChatGAL"}
+
 class ChatUI:
-    def __init__(self, document_processor=None):
-        self.chat_service = ChatService(document_processor)
+    def __init__(self, document_processor=None, chat_service=None):
+        self.chat_service = chat_service or ChatService(document_processor)
         self.document_processor = document_processor
 
     def get_contextual_thinking_message(self, has_documents: bool = False) -> str:
@@ -42,13 +49,52 @@ class ChatUI:
             st.session_state.messages = []
         if "show_context" not in st.session_state:
             st.session_state.show_context = False
+        if "show_trace" not in st.session_state:
+            st.session_state.show_trace = False
+        if "chat_history_cache" not in st.session_state:
+            st.session_state.chat_history_cache = {}
     
     def display_chat_messages(self):
-        """過去のチャットメッセージを表示"""
-        for message in st.session_state.messages:
+        """過去のチャットメッセージを表示（最新のぶんだけ吹き出しで、古いぶんは過去ログのページで）"""
+        messages = st.session_state.messages
+        live_start = max(0, len(messages) - LIVE_MESSAGE_WINDOW)
+        
+        if live_start:
+            self.display_history_pages(messages, live_start)
+        
+        for message in messages[live_start:]:
             with st.chat_message(message["role"]):
                 st.markdown(message["content"])
     
+    def display_history_pages(self, messages: List[dict], end: int):
+        """吹き出しに出さない古いメッセージを、選んだページだけ描画する
+
+        ウィジェットは履歴の長さによらずセレクトボックス1つだけなので、再実行の重さが増えないよ
+        """
+        # 新しいページが上に来るように並べる
+        starts = list(range(0, end, HISTORY_PAGE_SIZE))[::-1]
+        selected = st.selectbox(
+            f"📜 過去のおしゃべり（{end}件）",
+            options=[None] + starts,
+            format_func=lambda start: "閉じておく" if start is None else f"{start + 1}〜{min(start + HISTORY_PAGE_SIZE, end)}件目",
+            key="chat_history_page",
+        )
+        if selected is None:
+            return
+        with st.container(border=True):
+            st.markdown(self.render_history_page(messages, selected, min(selected + HISTORY_PAGE_SIZE, end)))
+    
+    def render_history_page(self, messages: List[dict], start: int, end: int) -> str:
+        """過去ログ1ページぶんのマークダウン（履歴は追記だけなのでページの先頭ごとにキャッシュして、終わりが変わったら作り直す）"""
+        cache = st.session_state.chat_history_cache
+        cached = cache.get(start)
+        if cached is None or cached[0] != end:
+            cached = cache[start] = (end, "\n\n---\n\n".join(
+                f"**{ROLE_LABELS.get(message['role'], message['role'])}**\n\n{message['content']}"
+                for message in messages[start:end]
+            ))
+        return cached[1]
+    
     def display_context_documents(self, context_docs: List, context: str):
         """参照した文書を表示"""
         if context_docs and st.session_state.get("show_context", False):
@@ -63,6 +109,21 @@ class ChatUI:
                     if i < len(context_docs) - 1:
                         st.divider()
     
+    def display_trace(self, trace):
+        """1ターンの処理時間の内訳とトークン数を表示（デバッグ用）"""
+        if trace is None or not st.session_state.get("show_trace", False):
+            return
+        with st.expander(f"⏱️ 処理時間の内訳だよ〜 (合計 {trace.duration_ms:,.0f} ms)", expanded=False):
+            tokens = trace.token_usage()
+            if tokens:
+                st.caption(" / ".join(f"{key}: {value:,}" for key, value in tokens.items()))
+            rows = ["| 処理 | 時間 (ms) | 割合 | 詳細 |", "| --- | ---: | ---: | --- |"]
+            for span in trace.spans:
+                share = span.duration_ms / trace.duration_ms * 100 if trace.duration_ms else 0
+                details = ", ".join(f"{key}={value}" for key, value in span.attributes.items())
+                rows.append(f"| {'└ ' * span.depth}{span.name} | {span.duration_ms:,.1f} | {share:.0f}% | {details} |")
+            st.markdown("\n".join(rows))
+    
     def handle_user_input(self, prompt: str):
         """ユーザー入力を処理"""
         # ユーザーメッセージをチャット履歴に追加
@@ -89,7 +150,9 @@ class ChatUI:
                 result = self.chat_service.generate_response(
                     st.session_state.messages, 
                     prompt, 
-                    use_rag=True
+                    use_rag=True,
+                    source_files=st.session_state.get("search_files") or None,
+                    multi_query=st.session_state.get("search_params", {}).get("multi_query", False)
                 )
                 
                 if result["success"]:
@@ -110,6 +173,9 @@ class ChatUI:
                         result.get("context", "")
                     )
                     
+                    # 処理時間の内訳を表示
+                    self.display_trace(result.get("trace"))
+                    
                 else:
                     error_message = f"あれれ〜エラーが起きちゃった💦: {result['message']}"
                     message_placeholder.error(error_message)
@@ -133,6 +199,7 @@ class ChatUI:
         with col1:
             if st.button("🗑️ 履歴リセット♪", help="チャット履歴をリセットするよ〜"):
                 st.session_state.messages = []
+                st.session_state.chat_history_cache = {}
                 st.rerun()
         
         with col2:
@@ -144,6 +211,29 @@ class ChatUI:
                     "でも新しいメッセージを送ったり、他のアクションをすると最新の資料が更新されちゃうから気をつけて〜"
                 )
             )
+        
+        with col3:
+            st.session_state.show_trace = st.checkbox(
+                "⏱️ 処理時間も見る？",
+                value=st.session_state.get("show_trace", False),
+                help="検索・プロンプト作成・LLM・評価データ保存のどこに時間がかかったかを表示するよ🔍"
+            )
+    
+    def render_file_filter(self, processed_files: List[dict]):
+        """検索する資料を絞り込むUI（選んだファイルのチャンクだけで類似度を計算するよ）"""
+        file_names = list(dict.fromkeys(file_info['name'] for file_info in processed_files))
+        if len(file_names) < 2:
+            st.session_state.search_files = []
+            return
+        # 資料を消したりアップし直したりして、もうないファイルが選ばれていたら外す
+        st.session_state.search_files = [name for name in st.session_state.get("search_files", []) if name in file_names]
+        st.multiselect(
+            "📂 この資料の中だけで探す",
+            options=file_names,
+            key="search_files",
+            placeholder="ぜんぶの資料から探すよ〜",
+            help="特定の資料について聞きたいときは選んでね💕 何も選ばなければ全部から探すよ"
+        )
     
     def render_chat_status(self):
         """チャットの状態を表示"""
@@ -152,6 +242,7 @@ class ChatUI:
             if stats['processed_files']:
                 st.success(f"✨ スマートモード: {stats['total_files']}個のファイルを参照中💎")
                 st.session_state.show_context = True
+                self.render_file_filter(stats['processed_files'])
             else:
                 st.warning("💭 ノーマルモード: 資料なしでお話し中")
         else:
@@ -182,7 +273,7 @@ class ChatUI:
         if prompt := st.chat_input("なんでも聞いて〜💖"):
             self.handle_user_input(prompt)
 
-def render_chat_with_processor(document_processor=None):
+def render_chat_with_processor(document_processor=None, chat_service=None):
     """ドキュメントプロセッサーを使用してチャットタブをレンダリング"""
-    chat_ui = ChatUI(document_processor)
+    chat_ui = ChatUI(document_processor, chat_service)
     chat_ui.render_chat()
\ No newline at end of file
@@ -1,15 +1,23 @@
 # ui/evaluation_ui.py
+import tempfile
 import streamlit as st
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime
-import pandas as pd
+from datetime import datetime, timedelta
 
-from backend.evaluation import evaluation_service
+from backend.evaluation_export import EXPORT_FORMATS, EXPORT_MAX_BYTES, EXPORT_MAX_MB
+from backend.evaluation_worker import evaluation_worker
+from backend.fast_metrics import FAST_METRIC_NAMES
+from backend.services import get_services
+
+# 詳細表示で1ページに出す件数
+DETAILS_PAGE_SIZE = 20
+# バックグラウンド評価中に進捗を見に行く間隔（秒）
+EVALUATION_POLL_SECONDS = 2
 
 class EvaluationUI:
     def __init__(self):
-        self.evaluation_service = evaluation_service
+        self.services = get_services()
+        self.evaluation_service = self.services.evaluation_service
+        self.evaluation_worker = evaluation_worker
 
         # メトリクス名のマッピング（表示名 → バックエンド名）
         self.metrics_mapping = {
@@ -21,6 +29,52 @@ class EvaluationUI:
         
         # 逆マッピング（バックエンド名 → 表示名）
         self.metrics_display_mapping = {v: k for k, v in self.metrics_mapping.items()}
+        
+        # 高速メトリクスの表示名
+        self.fast_metrics_display_mapping = {
+            "fast_relevancy": "質問↔回答の近さ",
+            "fast_grounding": "回答↔文脈の近さ",
+            "retrieval_top_score": "検索トップ類似度",
+            "retrieval_score_spread": "検索スコアの幅"
+        }
+    
+    def get_evaluation_job(self):
+        """このセッションで最後に投げた評価ジョブを取得"""
+        return self.evaluation_worker.get_job(st.session_state.get("evaluation_job_id"))
+    
+    def render_live_evaluation(self):
+        """評価の進捗とサマリーを表示（評価中は定期的にこの部分だけ再描画）"""
+        job = self.get_evaluation_job()
+        run_every = EVALUATION_POLL_SECONDS if job and job.is_active else None
+        st.fragment(self._render_live_evaluation, run_every=run_every)()
+    
+    def _render_live_evaluation(self):
+        """評価ジョブの状態とサマリー"""
+        job = self.get_evaluation_job()
+        
+        if job and job.is_active:
+            progress_col, stop_col = st.columns([4, 1])
+            with progress_col:
+                st.progress(job.progress, text=job.message or "評価の準備中だよ〜⏳")
+            with stop_col:
+                if st.button("⏹️ ストップ", help="今のチャンクが終わったところで止まるよ〜"):
+                    self.evaluation_worker.cancel(job.job_id)
+        
+        elif job:
+            # 終わったら1回だけページ全体を描き直してグラフや詳細も最新にする
+            if st.session_state.get("evaluation_job_refreshed") != job.job_id:
+                st.session_state.evaluation_job_refreshed = job.job_id
+                st.rerun(scope="app")
+            
+            if job.status == "done":
+                st.success(f"🎉 {job.done}件のチャットを評価したよ〜！")
+            elif job.status == "cancelled":
+                st.warning(f"⏹️ 途中で止めたよ（{job.done}/{job.total}件）")
+            else:
+                st.error(f"❌ 評価中にエラーが起きちゃった💦: {job.error}")
+        
+        # 評価中も書き込まれたスコアから途中経過を表示
+        self.render_evaluation_summary()
     
     def render_evaluation_summary(self):
         """評価サマリーを表示"""
@@ -52,42 +106,61 @@ class EvaluationUI:
             if summary.get("total_chats", 0) > 0:
                 evaluation_rate = summary.get("evaluated_chats", 0) / summary["total_chats"] * 100
             st.metric("評価率", f"{evaluation_rate:.1f}%")
+        
+        # 一部だけ採点しているときは、全チャットの平均がどのくらいの幅にありそうかを出す
+        intervals = [
+            f"{self.metrics_display_mapping.get(metric, '総合')}: {summary[f'ci_{metric}'][0]:.3f}〜{summary[f'ci_{metric}'][1]:.3f}"
+            for metric in ['overall_score', *self.metrics_display_mapping]
+            if f"ci_{metric}" in summary
+        ]
+        if intervals and summary.get("evaluated_chats", 0) < summary.get("total_chats", 0):
+            st.caption("📏 95%信頼区間（全チャットの平均の推定）: " + " / ".join(intervals))
+        
+        # 高速メトリクス（LLMなしで全チャットぶん）
+        fast_metrics = [metric for metric in FAST_METRIC_NAMES if f"avg_{metric}" in summary]
+        if fast_metrics:
+            st.caption("⚡ 高速スコア（埋め込みと検索スコアだけで全チャット計算してるよ〜）")
+            for column, metric in zip(st.columns(len(FAST_METRIC_NAMES)), fast_metrics):
+                with column:
+                    st.metric(self.fast_metrics_display_mapping[metric], f"{summary[f'avg_{metric}']:.3f}")
     
     def render_metrics_chart(self):
         """メトリクスのチャートを表示"""
-        if "evaluation_data" not in st.session_state:
-            return
-        
-        data = st.session_state.evaluation_data
-        evaluated_data = [item for item in data if item.overall_score is not None]
+        distribution = self.evaluation_service.get_metric_distribution()
         
-        if not evaluated_data:
+        if not distribution:
             return
         
+        # plotlyは重いので、グラフを描くときだけ読み込む
+        import plotly.graph_objects as go
+        
         st.subheader("📈 グラフで見てみよ〜")
         
-        # データを準備
-        metrics_data = []
-        for item in evaluated_data:
-            if item.context_precision is not None:
-                metrics_data.append({"metric": "Context Precision", "score": item.context_precision, "timestamp": item.timestamp})
-            if item.context_recall is not None:
-                metrics_data.append({"metric": "Context Recall", "score": item.context_recall, "timestamp": item.timestamp})
-            if item.faithfulness is not None:
-                metrics_data.append({"metric": "Faithfulness", "score": item.faithfulness, "timestamp": item.timestamp})
-            if item.answer_relevancy is not None:
-                metrics_data.append({"metric": "Answer Relevancy", "score": item.answer_relevancy, "timestamp": item.timestamp})
-        
-        if metrics_data:
-            df = pd.DataFrame(metrics_data)
-            
-            # ボックスプロット
-            fig = px.box(df, x="metric", y="score", title="メトリクスの分布💎")
-            st.plotly_chart(fig, use_container_width=True)
-            
-            # 時系列チャート
-            fig2 = px.line(df, x="timestamp", y="score", color="metric", title="時系列で見るメトリクスの変化✨")
-            st.plotly_chart(fig2, use_container_width=True)
+        # ボックスプロット（四分位数は集計済みのものを使う）
+        fig = go.Figure()
+        for metric, stats in distribution.items():
+            fig.add_trace(go.Box(
+                name=self.metrics_display_mapping[metric],
+                q1=[stats['q1']],
+                median=[stats['median']],
+                q3=[stats['q3']],
+                lowerfence=[stats['lowerfence']],
+                upperfence=[stats['upperfence']],
+                mean=[stats['mean']],
+            ))
+        fig.update_layout(title="メトリクスの分布💎", xaxis_title="metric", yaxis_title="score", showlegend=False)
+        st.plotly_chart(fig, use_container_width=True)
+        
+        # 時系列チャート（件数が多いときは時間で間引いた平均）
+        timestamps, series = self.evaluation_service.get_metric_time_series()
+        fig2 = go.Figure()
+        for metric, scores in series.items():
+            if metric in distribution:
+                fig2.add_trace(go.Scatter(
+                    x=timestamps, y=scores, mode="lines", name=self.metrics_display_mapping[metric], connectgaps=True
+                ))
+        fig2.update_layout(title="時系列で見るメトリクスの変化✨", xaxis_title="timestamp", yaxis_title="score", legend_title="metric")
+        st.plotly_chart(fig2, use_container_width=True)
     
     def render_evaluation_controls(self):
         """評価制御UI"""
@@ -121,74 +194,133 @@ class EvaluationUI:
 
             # バックエンド用に変換
             selected_metrics = [self.metrics_mapping[metric] for metric in selected_display_metrics]
+            
+            # RAGASの実行設定
+            with st.expander("⚙️ 実行設定", expanded=False):
+                defaults = self.evaluation_service.run_config_params
+                max_workers = st.number_input(
+                    "同時実行数 (max_workers)", min_value=1, max_value=64,
+                    value=defaults['max_workers'],
+                    help="全チャットをまとめて1回で評価するから、ここを増やすと速くなるよ〜⚡ 429が出るなら減らしてね"
+                )
+                timeout = st.number_input(
+                    "タイムアウト (秒)", min_value=10, max_value=1800,
+                    value=defaults['timeout'],
+                    help="1回のLLM呼び出しを待つ最大時間だよ〜"
+                )
+                force = st.checkbox(
+                    "🔁 採点済みも採点し直す",
+                    value=False,
+                    help="ふだんは採点済み・キャッシュ済みのスコアはスキップしてお財布にやさしくしてるよ💸"
+                )
+                use_sampling = st.checkbox(
+                    "🎯 予算内でサンプリングして採点",
+                    value=False,
+                    help="全部じゃなくて、ファイル・時間帯・回答の長さ・高速スコアの外れ値で層に分けてバランスよく選んだチャットだけ採点するよ〜"
+                )
+                max_calls = None
+                max_tokens = None
+                if use_sampling:
+                    budget_type = st.radio("予算の決め方", ["LLM呼び出し回数", "トークン数"], horizontal=True)
+                    if budget_type == "LLM呼び出し回数":
+                        max_calls = st.number_input("最大LLM呼び出し回数", min_value=1, value=200, step=50)
+                    else:
+                        max_tokens = st.number_input("最大トークン数（目安）", min_value=1000, value=300000, step=10000)
         
         with col2:
             st.write("") # スペース
             st.write("") # スペース
-            if st.button("🚀 評価スタート！", type="primary", disabled=not selected_metrics):
-                self.run_evaluation(selected_metrics)
+            job = self.get_evaluation_job()
+            is_running = bool(job and job.is_active)
+            if st.button("🚀 評価スタート！", type="primary", disabled=not selected_metrics or is_running):
+                run_config = self.evaluation_service.get_run_config(max_workers=max_workers, timeout=timeout)
+                self.run_evaluation(selected_metrics, run_config, force, max_calls, max_tokens)
+            
+            missing_fast = self.evaluation_service.count_missing_fast_metrics()
+            if st.button("⚡ 高速スコアを計算", disabled=not missing_fast, help="LLMを使わずに埋め込みだけで計算するよ〜。チャットのたびに自動で計算してるから、ふだんは押さなくて大丈夫💕"):
+                with st.spinner(f"{missing_fast}件ぶん計算してるよ〜"):
+                    try:
+                        self.evaluation_service.evaluate_fast_metrics()
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"高速スコアが計算できなかった💦: {str(e)}")
     
-    def run_evaluation(self, selected_metrics):
-        """評価を実行"""
-        if "evaluation_data" not in st.session_state or not st.session_state.evaluation_data:
+    def run_evaluation(self, selected_metrics, run_config=None, force=False, max_calls=None, max_tokens=None):
+        """評価をバックグラウンドで開始"""
+        if self.evaluation_service.count_evaluation_data() == 0:
             st.warning("評価するデータがないよ〜")
             return
         
-        progress_bar = st.progress(0)
-        status_text = st.empty()
-        
-        def progress_callback(message):
-            status_text.text(message)
+        # セッションのトークン予算を超えないように、残りを上限にしてサンプリングする
+        usage = self.services.usage
+        if usage.status("evaluation") == "exceeded":
+            st.error("💸 このセッションのトークン予算を使い切っちゃったから、採点はできないよ〜")
+            return
+        remaining = usage.remaining("evaluation")
+        if remaining is not None and (max_tokens is None or remaining < max_tokens):
+            max_tokens = remaining
+            st.info(f"💸 トークン予算の残り（{remaining:,}）に収まるぶんだけ採点するね")
         
         try:
-            # 評価実行
-            evaluated_data = self.evaluation_service.evaluate_all_chats(
-                selected_metrics, 
-                progress_callback
-            )
-            
-            progress_bar.progress(1.0)
-            status_text.text("✅ 評価完了〜！")
-            
-            st.success(f"🎉 {len(evaluated_data)}件のチャットを評価したよ〜！")
-            st.rerun()
+            # 評価ジョブを登録（ページを移動しても裏で続くよ）
+            job = self.evaluation_worker.submit(selected_metrics, run_config, force, max_calls, max_tokens, config=self.services.config, usage=usage, service=self.evaluation_service)
+            st.session_state.evaluation_job_id = job.job_id
             
         except Exception as e:
-            st.error(f"❌ 評価中にエラーが起きちゃった💦: {str(e)}")
-            status_text.text("エラーが発生しました")
+            st.error(f"❌ 評価を始められなかった💦: {str(e)}")
+            return
+        
+        st.rerun()
     
     def render_evaluation_details(self):
-        """評価詳細を表示"""
-        if "evaluation_data" not in st.session_state:
+        """評価詳細を表示（表示するページの分だけストアから読み込む）"""
+        total = self.evaluation_service.count_evaluation_data()
+        if total == 0:
             return
         
         st.subheader("📋 詳しい評価結果")
         
-        data = st.session_state.evaluation_data
-        
-        if not data:
-            st.info("評価データがないよ〜")
-            return
-        
         # フィルタリング
-        col1, col2 = st.columns([1, 1])
+        col1, col2, col3 = st.columns([1, 1, 1])
         
         with col1:
             show_evaluated_only = st.checkbox("評価済みだけ見る", value=False)
+            min_score = st.slider("総合スコアの下限", 0.0, 1.0, 0.0, step=0.05, disabled=not show_evaluated_only)
         
         with col2:
             sort_by = st.selectbox("並び順", ["時間順", "スコア順"], index=0)
+            date_range = st.date_input("期間", value=(), help="指定しないと全期間だよ〜")
         
-        # データをフィルタリング・ソート
-        filtered_data = data
-        if show_evaluated_only:
-            filtered_data = [item for item in data if item.overall_score is not None]
+        # データをフィルタリング・ソート（SQL側でやるので全件は読まない）
+        filters = {'evaluated_only': show_evaluated_only}
+        if show_evaluated_only and min_score > 0:
+            filters['min_score'] = min_score
+        if len(date_range) == 2:
+            filters['start'] = datetime.combine(date_range[0], datetime.min.time())
+            filters['end'] = datetime.combine(date_range[1] + timedelta(days=1), datetime.min.time())
         
-        if sort_by == "スコア順" and filtered_data:
-            filtered_data = sorted(filtered_data, key=lambda x: x.overall_score or 0, reverse=True)
+        filtered_total = self.evaluation_service.count_evaluation_data(**filters)
+        total_pages = max(1, -(-filtered_total // DETAILS_PAGE_SIZE))
+        
+        with col3:
+            page = st.number_input(f"ページ (全{total_pages}ページ)", min_value=1, max_value=total_pages, value=1)
+        
+        page_data = self.evaluation_service.get_evaluation_data(
+            order_by='score' if sort_by == "スコア順" else 'timestamp',
+            descending=sort_by == "スコア順",
+            limit=DETAILS_PAGE_SIZE,
+            offset=(page - 1) * DETAILS_PAGE_SIZE,
+            **filters
+        )
+        
+        if not page_data:
+            st.info("評価データがないよ〜")
+            return
+        
+        st.caption(f"{filtered_total}件中 {(page - 1) * DETAILS_PAGE_SIZE + 1}〜{(page - 1) * DETAILS_PAGE_SIZE + len(page_data)}件目")
         
         # データ表示
-        for i, item in enumerate(filtered_data):
+        for i, item in enumerate(page_data):
             with st.expander(f"💬 {item.question[:50]}... ({item.timestamp.strftime('%Y-%m-%d %H:%M')})"):
                 col1, col2 = st.columns([2, 1])
                 
@@ -218,22 +350,37 @@ class EvaluationUI:
     def render_data_management(self):
         """データ管理UI"""
         st.subheader("🗂️ データの管理")
+        st.caption(
+            f"ワークスペース: `{self.services.workspace_id}`（このURLをブックマークしておけば、リロードしても別のブラウザでも同じ評価データが見られるよ〜🔖）"
+        )
         
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            if st.button("📥 CSVでダウンロード"):
-                df = self.evaluation_service.export_evaluation_data()
-                if not df.empty:
-                    csv = df.to_csv(index=False)
-                    st.download_button(
-                        label="📥 ダウンロード開始",
-                        data=csv,
-                        file_name=f"evaluation_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                        mime="text/csv"
-                    )
-                else:
-                    st.warning("ダウンロードするデータがないよ〜")
+            export_format = st.radio("形式", list(EXPORT_FORMATS), horizontal=True, format_func=str.upper)
+            include_contexts = st.checkbox("文脈の本文も入れる", value=True, help="外すとファイルがかなり小さくなるよ〜")
+            st.caption(f"ダウンロードできるのは{EXPORT_MAX_MB}MBまでだよ〜")
+            
+            if st.button("📥 ファイルを作る"):
+                # 書き出しは一時ファイルにバッチごとにするけど、ダウンロードボタンには丸ごと渡すので大きさに上限をつける
+                with tempfile.TemporaryFile() as file:
+                    rows = self.evaluation_service.export_evaluation_file(file, export_format, include_contexts)
+                    size = file.tell()
+                    if rows and size > EXPORT_MAX_BYTES:
+                        st.warning(
+                            f"ファイルが{size / 1024 / 1024:.1f}MBになって上限（{EXPORT_MAX_MB}MB）を超えちゃったよ〜💦 "
+                            "文脈の本文を外すかParquetにしてみてね"
+                        )
+                    elif rows:
+                        file.seek(0)
+                        st.download_button(
+                            label="📥 ダウンロード開始",
+                            data=file.read(),
+                            file_name=f"evaluation_data_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{EXPORT_FORMATS[export_format]['extension']}",
+                            mime=EXPORT_FORMATS[export_format]['mime']
+                        )
+                    else:
+                        st.warning("ダウンロードするデータがないよ〜")
         
         with col2:
                 # セッション状態で削除確認フラグを管理
@@ -247,7 +394,7 @@ class EvaluationUI:
             
         # 確認が表示されている場合（カラムの外に出す）
         if st.session_state.show_eval_delete_confirmation:
-            st.error("⚠️ 本当に全ての評価データを削除しますか？この操作は取り消せません！")
+            st.error("⚠️ 本当にこのワークスペースの評価データを全て削除しますか？この操作は取り消せません！")
             
             col1, col2 = st.columns(2)
             
@@ -259,7 +406,7 @@ class EvaluationUI:
                         # 確認フラグをリセット
                         st.session_state.show_eval_delete_confirmation = False
                         
-                        st.success("✅ 評価データを全部消したよ〜")
+                        st.success("✅ このワークスペースの評価データを全部消したよ〜")
                         st.rerun()
                         
                     except Exception as e:
@@ -275,8 +422,8 @@ class EvaluationUI:
         """評価ページ全体をレンダリング"""
         st.header("RAGの性能チェック✨")
         
-        # サマリー表示
-        self.render_evaluation_summary()
+        # 評価の進捗とサマリー表示
+        self.render_live_evaluation()
         
         st.divider()
         
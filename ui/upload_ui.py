@@ -1,10 +1,12 @@
 # upload_ui.py
 import streamlit as st
-from backend.upload import document_processor
+from backend.services import get_services
+from backend.upload import DEFAULT_PDF_EXTRACTOR, PDF_EXTRACTORS, available_pdf_extractors
 
 def render_upload():
     """アップロードタブのUIをレンダリング"""
     st.header("📚 資料アップしちゃお〜🧚‍♀️")
+    document_processor = get_services().document_processor
 
     info_col, upload_col = st.columns(2)
     with info_col:
@@ -14,18 +16,21 @@ def render_upload():
     
     with upload_col:
         # PDFアップロード機能
-        upload_pdf_section()
+        upload_pdf_section(document_processor)
+    
+    # アップロード後の状態を1回だけ取って下の2つで使う
+    stats = document_processor.get_stats()
     
     st.divider()
     exist_col, manage_col = st.columns(2)
 
     with exist_col:
         # 既存の資料表示
-        show_existing_documents()
+        show_existing_documents(stats)
     
     with manage_col:
         # データベース管理
-        database_management_section()
+        database_management_section(document_processor, stats)
 
 def show_privacy_info():
     """プライバシー情報を表示"""
@@ -70,12 +75,10 @@ def show_usage_guidelines():
 
     """)
 
-def show_existing_documents():
+def show_existing_documents(stats):
     """既存のドキュメント一覧を表示"""
     st.subheader("💎 今持ってる資料たち")
     
-    stats = document_processor.get_stats()
-    
     if stats['processed_files'] and stats['total_files'] > 0:
         st.success(f"✨ {stats['total_files']}個のファイルがあるよ〜")
         
@@ -87,6 +90,8 @@ def show_existing_documents():
                     st.write(f"📄 **{file_info['name']}**")
                 with col2:
                     st.write(f"{file_info['pages']} ページ")
+                    if file_info.get('extractor'):
+                        st.caption(file_info['extractor'])
                 with col3:
                     st.write(f"{file_info['size']:,} bytes")
         
@@ -94,7 +99,7 @@ def show_existing_documents():
     else:
         st.info("📝 まだ資料がないよ〜。アップしてみて💕")
 
-def upload_pdf_section():
+def upload_pdf_section(document_processor):
     """PDFアップロードセクション"""
     st.subheader("📄 PDF資料をアップロード✨")
     
@@ -113,11 +118,21 @@ def upload_pdf_section():
         for file in uploaded_files:
             st.write(f"- {file.name} ({file.size:,} bytes)")
         
+        # PDFの読み取り方（使えるバックエンドだけ出す）
+        options = ["auto"] + available_pdf_extractors()
+        extractor = st.selectbox(
+            "📖 PDFの読み取り方",
+            options=options,
+            index=options.index(DEFAULT_PDF_EXTRACTOR) if DEFAULT_PDF_EXTRACTOR in options else 0,
+            format_func=lambda name: "おまかせ（大きいPDFは速いほうで）" if name == "auto" else PDF_EXTRACTORS[name].label,
+            help="文字化けや読み落としがあったら別の読み取り方を試してみて〜📚"
+        )
+        
         # 処理ボタン
         if st.button("🚀 アップロード開始！", type="primary"):
-            process_uploaded_files(uploaded_files)
+            process_uploaded_files(document_processor, uploaded_files, extractor)
 
-def process_uploaded_files(uploaded_files):
+def process_uploaded_files(document_processor, uploaded_files, extractor=None):
     """アップロードされたファイルを処理"""
     progress_bar = st.progress(0)
     status_text = st.empty()
@@ -129,7 +144,8 @@ def process_uploaded_files(uploaded_files):
         # ファイル処理
         result = document_processor.process_uploaded_files(
             uploaded_files, 
-            progress_callback
+            progress_callback,
+            extractor
         )
         
         progress_bar.progress(1.0)
@@ -155,12 +171,10 @@ def process_uploaded_files(uploaded_files):
         st.error(f"❌ なんか変なエラーが起きちゃった💦: {str(e)}")
         status_text.text("エラーが発生しました")
 
-def database_management_section():
+def database_management_section(document_processor, stats):
     """データベース管理セクション"""
     st.subheader("🗑️ 資料の管理")
     
-    stats = document_processor.get_stats()
-    
     if stats['processed_files']:
         st.warning("⚠️ 下のボタンを押すと、全部の資料が消えちゃうよ〜")
 
@@ -0,0 +1,46 @@
+# usage_ui.py
+import streamlit as st
+from backend.usage import FEATURES, TOKEN_PRICES
+
+def render_usage_sidebar(usage):
+    """サイドバーにこのセッションのトークン使用量と予算を表示"""
+    st.sidebar.header("💸 トークン使用量")
+
+    total = usage.usage()
+    budget = usage.budgets.get(None)
+    if budget:
+        st.sidebar.progress(min(total.total_tokens / budget, 1.0), text=f"{total.total_tokens:,} / {budget:,} トークン")
+    else:
+        st.sidebar.caption(f"合計 {total.total_tokens:,} トークン（予算なし）")
+
+    status = usage.status()
+    if status == "exceeded":
+        st.sidebar.error("🙅‍♀️ このセッションの予算を使い切っちゃった💦 新しいセッションで続きしてね")
+    elif status == "throttled":
+        st.sidebar.warning("🐢 予算が残り少ないから、チャットの文脈を減らして節約中だよ〜")
+
+    show_cost = any(TOKEN_PRICES.values())
+    rows = [
+        "| 機能 | 回数 | 入力 | 出力 | 埋め込み |" + (" 料金 |" if show_cost else ""),
+        "|---|---:|---:|---:|---:|" + ("---:|" if show_cost else ""),
+    ]
+    for feature, label in FEATURES.items():
+        feature_usage = usage.usage(feature)
+        if not feature_usage.calls:
+            continue
+        # 機能ごとの予算を超えていたら印をつける
+        mark = " 🙅‍♀️" if usage.budgets.get(feature) and usage.status(feature) == "exceeded" else ""
+        row = (
+            f"| {label}{mark} | {feature_usage.calls} | {feature_usage.prompt_tokens:,} "
+            f"| {feature_usage.completion_tokens:,} | {feature_usage.embedding_tokens:,} |"
+        )
+        if show_cost:
+            row += f" {feature_usage.cost:.4f} |"
+        rows.append(row)
+
+    if len(rows) > 2:
+        st.sidebar.markdown("\n".join(rows))
+        if total.estimated:
+            st.sidebar.caption("※ 埋め込みと、usageを返さないモデルの分は文字数からの見積もりだよ")
+    if show_cost:
+        st.sidebar.caption(f"料金の合計: {total.cost:.4f}")